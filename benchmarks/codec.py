@@ -0,0 +1,143 @@
+# Encoding benchmark of the control messages: protobuf objects against the
+# pre-encoded templates of modules/lib/codec.py. The messages name peers of a
+# mesh of --peers peers in turn: past modules.lib.codec.ID_CACHE peers, the
+# varints of their IDs are no longer cached.
+# Usage: python -m benchmarks.codec [--iterations N] [--peers N] [--buckets N]
+
+import argparse
+import itertools
+import random
+import time
+
+from gen.proto.communication_pb2 import (
+    AnnouncementType,
+    Digest,
+    HandshakeResponse,
+    HandshakeStart,
+    Join,
+    Leave,
+    PeerMessage,
+    PeerMessageType,
+    PropagationMessage,
+)
+from modules.lib.codec import (
+    encode_digest,
+    encode_handshake_response,
+    encode_handshake_start,
+    encode_join,
+    encode_leave,
+)
+
+# Peers dropped along with the one leaving, in each LEAVE
+LEAVE_IDS = 8
+
+
+def cases(peers: int, buckets: int):
+    # (name, protobuf encoder, codec encoder) per message type. Both encoders
+    # of a type take the same arguments, drawn from the same peers in turn
+    ids = random.sample(range(1, 2**62), peers)
+    addresses = [(f"10.0.{i >> 8 & 255}.{i & 255}", 5000 + i % 1000) for i in range(peers)]
+    me = ids[0]
+    hashes = [random.getrandbits(64) for _ in range(buckets)]
+
+    def args(make):
+        # Arguments of the i-th message, cycling over the peers
+        pool = [make(i) for i in range(peers)]
+        return lambda: itertools.cycle(pool)
+
+    def leave_args(i: int):
+        return ids[i], [ids[(i + k) % peers] for k in range(1, LEAVE_IDS + 1)]
+
+    def join(uid, host, port, hops):
+        join = Join(id=uid, via_id=me, host=host, port=port, hops=hops)
+        return PeerMessage(
+            type=PeerMessageType.ANNOUNCEMENT,
+            announcement=PropagationMessage(type=AnnouncementType.JOIN, join=join),
+        ).SerializeToString()
+
+    def leave(uid, dropped):
+        leave = Leave(id=uid, ids=dropped)
+        return PeerMessage(
+            type=PeerMessageType.ANNOUNCEMENT,
+            announcement=PropagationMessage(type=AnnouncementType.LEAVE, leave=leave),
+        ).SerializeToString()
+
+    def start(uid, host, port):
+        start = HandshakeStart(id=uid, fast_path=True, host=host, port=port)
+        return PeerMessage(
+            type=PeerMessageType.HANDSHAKE_START, handshakeStart=start
+        ).SerializeToString()
+
+    def response(uid):
+        ack = HandshakeResponse(id=uid, error=False, fast_path=True)
+        return PeerMessage(
+            type=PeerMessageType.HANDSHAKE_RESPONSE, handshakeResponse=ack
+        ).SerializeToString()
+
+    def digest(uid):
+        digest = Digest(fr=uid, buckets=hashes)
+        return PeerMessage(type=PeerMessageType.DIGEST, digest=digest).SerializeToString()
+
+    return [
+        (
+            "join",
+            args(lambda i: (ids[i], *addresses[i], 1 + i % 6)),
+            join,
+            lambda uid, host, port, hops: encode_join(uid, me, host, port, hops).body,
+        ),
+        ("leave", args(leave_args), leave, lambda uid, dropped: encode_leave(uid, dropped).body),
+        (
+            "handshake start",
+            args(lambda i: (ids[i], *addresses[i])),
+            start,
+            lambda uid, host, port: encode_handshake_start(uid, True, host, port).body,
+        ),
+        (
+            "handshake response",
+            args(lambda i: (ids[i],)),
+            response,
+            lambda uid: encode_handshake_response(uid, False, True).body,
+        ),
+        (
+            f"digest ({buckets} buckets)",
+            args(lambda i: (ids[i],)),
+            digest,
+            lambda uid: encode_digest(uid, hashes).body,
+        ),
+    ]
+
+
+def measure(encode, messages, iterations: int) -> tuple[float, float]:
+    # Microseconds per message to encode, then to encode and parse it as the
+    # receiver does
+    start = time.perf_counter()
+    for args in itertools.islice(messages(), iterations):
+        encode(*args)
+    encoded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for args in itertools.islice(messages(), iterations):
+        PeerMessage().ParseFromString(encode(*args))
+    round_trip = time.perf_counter() - start
+    return encoded / iterations * 1e6, round_trip / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control message codec benchmark")
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--peers", type=int, default=1000)
+    parser.add_argument("--buckets", type=int, default=128)
+    args = parser.parse_args()
+
+    print(f"{args.iterations} messages per type, {args.peers} peers (us per message)")
+    columns = ("protobuf", "codec", "speedup", "+parse pb", "+parse codec", "speedup")
+    print(f"{'':24}" + "".join(f"{name:>14}" for name in columns))
+    for name, messages, protobuf, codec in cases(args.peers, args.buckets):
+        slow, slow_trip = measure(protobuf, messages, args.iterations)
+        fast, fast_trip = measure(codec, messages, args.iterations)
+        row = (slow, fast, slow / fast, slow_trip, fast_trip, slow_trip / fast_trip)
+        print(f"{name:24}" + "".join(f"{value:14.2f}" for value in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Replay of a traffic capture (peer.py --capture) against an offline peer.
+# Usage: python -m benchmarks.replay CAPTURE [--speed recorded|max] [--repeat N]
+#
+# The received frames are fed to Peer.handle_frame in the recorded order, from a
+# single thread. Every link of the capture is replaced by a sink that counts
+# the frames written to it: the routes learned from the handshakes and the
+# announcements of the capture lead to these sinks.
+
+import argparse
+import logging
+import time
+from collections import Counter
+
+from gen.proto.communication_pb2 import PeerMessageType
+from modules.lib.capture import CaptureRecord, read_capture
+from modules.lib.network import decode_frame, enable_fast_path
+from modules.lib.peer import Peer, PeerState
+
+
+class SinkConnection:
+    # Stands for a link of the capture: writes are counted, then discarded
+    def __init__(self, link: int):
+        self.link = link
+        self.writes = 0
+        self.bytes = 0
+
+    def sendall(self, data) -> None:
+        self.writes += 1
+        self.bytes += len(data)
+
+    def sendmsg(self, buffers) -> int:
+        size = sum(len(b) for b in buffers)
+        self.writes += 1
+        self.bytes += size
+        return size
+
+    def close(self) -> None:
+        pass
+
+
+def replay(
+    records: list[CaptureRecord], speed: str, sinks: dict[int, SinkConnection]
+) -> tuple[Counter[str], float]:
+    # Feed the received frames to the bound peer. Returns the frames handled
+    # per type and the time spent in Peer.handle_frame
+    handled = Counter[str]()
+    busy = 0.0
+    # Neighbor on the other end of each link
+    neighbors = dict[int, int]()
+    start, first = time.perf_counter(), records[0].timestamp if records else 0.0
+    for record in records:
+        sink = sinks.get(record.link)
+        if sink is None:
+            sink = sinks[record.link] = SinkConnection(record.link)
+        if record.fast_path:
+            enable_fast_path(sink)  # type: ignore[arg-type]
+        if record.sent:
+            continue
+        frame = decode_frame(record.frame, record.fast_path)
+        kind = frame.type if frame.type is not None else frame.message.type
+        # The handshakes tell which neighbor is on the other end of each link
+        if kind in (PeerMessageType.HANDSHAKE_START, PeerMessageType.HANDSHAKE_RESPONSE):
+            msg = frame.message
+            start_hs = kind == PeerMessageType.HANDSHAKE_START
+            hs = msg.handshakeStart if start_hs else msg.handshakeResponse
+            if hs.id and hs.id not in Peer.routing_table:
+                Peer.routing_table.add_local_peer(hs.id, sink)  # type: ignore[arg-type]
+            if hs.id:
+                neighbors[record.link] = hs.id
+            continue
+        if speed == "recorded":
+            delay = record.timestamp - first - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        t = time.perf_counter()
+        Peer.handle_frame(frame, neighbors.get(record.link))
+        busy += time.perf_counter() - t
+        handled[PeerMessageType.Name(kind)] += 1
+    return handled, busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a traffic capture")
+    parser.add_argument("capture", help="file written by peer.py --capture")
+    parser.add_argument("--speed", choices=["recorded", "max"], default="max")
+    parser.add_argument("--repeat", type=int, default=1, help="replay N times (fresh peer each time)")
+    args = parser.parse_args()
+
+    Peer.logger.setLevel(logging.CRITICAL)
+    peer_id, records = read_capture(args.capture)
+    captured = list(records)
+    received = sum(1 for r in captured if not r.sent)
+    span = captured[-1].timestamp - captured[0].timestamp if captured else 0.0
+    print(
+        f"Capture of peer {peer_id}: {len(captured)} frames ({received} received) "
+        f"on {len({r.link for r in captured})} links over {span:.2f}s"
+    )
+
+    for run in range(1, args.repeat + 1):
+        state = PeerState()
+        with Peer.bound(state):
+            Peer.set_id(peer_id)
+            sinks = dict[int, SinkConnection]()
+            start = time.perf_counter()
+            handled, busy = replay(captured, args.speed, sinks)
+            elapsed = time.perf_counter() - start
+            state.deliveries.close()
+            total = handled.total()
+            print(f"Run {run}: {total} frames handled in {elapsed:.3f}s", end="")
+            if total:
+                print(
+                    f", {total / busy:,.0f} frames/s in handle_frame "
+                    f"({busy / total * 1e6:.1f}us per frame)"
+                )
+            else:
+                print()
+            print(f"  Types: {dict(handled)}")
+            written = sum(sink.writes for sink in sinks.values())
+            buffered = sum(len(msgs) for msgs in Peer.buffer.values())
+            print(
+                f"  Writes: {len(captured) - received} recorded, "
+                f"{written} replayed, {buffered} messages buffered"
+            )
+
+
+if __name__ == "__main__":
+    main()
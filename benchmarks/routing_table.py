@@ -0,0 +1,93 @@
+# Memory and lookup benchmark of the routing table backends.
+# Usage: python -m benchmarks.routing_table [--peers N] [--lookups N]
+
+import argparse
+import random
+import socket
+import time
+import tracemalloc
+
+from modules.model.routing_table import CompactRoutingTable, RoutingTable
+
+LOCAL_PEERS = 10
+
+
+def build(cls: type[RoutingTable], ids: list[int], conns: list[socket.socket]):
+    # Bypass the singleton to always start from an empty table
+    cls._instance = None
+    table = cls()
+    for conn, uid in zip(conns, ids[:LOCAL_PEERS]):
+        table.add_local_peer(uid, conn)
+    for uid in ids[LOCAL_PEERS:]:
+        table.add_remote_peer(uid, ids[uid % LOCAL_PEERS])
+    return table
+
+
+def measure(cls: type[RoutingTable], ids: list[int], lookups: list[int], conns):
+    tracemalloc.start()
+    start = time.perf_counter()
+    table = build(cls, ids, conns)
+    build_time = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for uid in lookups:
+        conn, via = table[uid]
+        if conn is None:
+            # Resolve the next hop as Peer.find_route does
+            conn, via = table[via]
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for uid in lookups:
+        _ = uid in table
+    contains_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in table:
+        pass
+    iter_time = time.perf_counter() - start
+
+    # Losing a neighbor drops the entries routed through it (1 / LOCAL_PEERS)
+    start = time.perf_counter()
+    table.remove_with_dependents(ids[0])
+    invalidate_time = time.perf_counter() - start
+
+    return {
+        "memory (MiB)": memory / 2**20,
+        "build (ms)": build_time * 1000,
+        "lookup (ns/op)": lookup_time / len(lookups) * 1e9,
+        "contains (ns/op)": contains_time / len(lookups) * 1e9,
+        "iterate (ms)": iter_time * 1000,
+        "invalidate (ms)": invalidate_time * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Routing table benchmark")
+    parser.add_argument("--peers", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    args = parser.parse_args()
+
+    # Snowflake-like 63-bit IDs
+    ids = random.sample(range(1, 2**62), args.peers)
+    lookups = random.choices(ids, k=args.lookups)
+    conns = [socket.socket() for _ in range(LOCAL_PEERS)]
+
+    results = {
+        cls.__name__: measure(cls, ids, lookups, conns)
+        for cls in (RoutingTable, CompactRoutingTable)
+    }
+
+    print(f"{args.peers} peers, {args.lookups} lookups")
+    print(f"{'':20}" + "".join(f"{name:>22}" for name in results))
+    for metric in next(iter(results.values())):
+        print(f"{metric:20}" + "".join(f"{r[metric]:22.2f}" for r in results.values()))
+
+    for conn in conns:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# Simulation of a large mesh in a single process, over the in-memory transport.
+# Usage: python -m benchmarks.simulation [--peers N] [--messages N] [--latency MS]
+#                                        [--jitter MS] [--loss P] [--seed N] [--reliable]
+#                                        [--repair-interval S] [--degree N]
+
+import argparse
+import logging
+import random
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from gen.proto.communication_pb2 import Message
+from modules.lib.delivery import Delivery
+from modules.lib.node import PeerNode
+from modules.lib.peer import Peer
+from modules.lib.transport import MemoryTransport
+from modules.model.config import ServerAddress, in_process_config
+
+# Worker threads only run the receive loop: keep their stacks small
+THREAD_STACK_SIZE = 256 * 1024
+# Routes followed hop by hop to measure the path lengths
+PATH_SAMPLES = 10_000
+
+
+def completeness(nodes: list[PeerNode]) -> float:
+    # Mean fraction of the other peers known by each routing table
+    known = sum(len(node.state.routing_table) for node in nodes)
+    return known / (len(nodes) * (len(nodes) - 1))
+
+
+def next_hop(node: PeerNode, to: int) -> int | None:
+    # ID of the neighbor the node forwards messages for `to` to
+    table = node.state.routing_table
+    uid: int | None = to
+    for _ in range(len(table)):
+        if uid is None or uid not in table:
+            return None
+        conn, via = table[uid]
+        if conn:
+            return uid
+        uid = via
+    return None
+
+
+def paths(
+    nodes: list[PeerNode], pairs: int, rng: random.Random
+) -> tuple[Counter[int], Counter[int]]:
+    # Follow the routes between random pairs of peers, hop by hop. Returns the
+    # path lengths and the number of paths relayed by each peer
+    by_id = {node.id: node for node in nodes}
+    lengths, relayed = Counter[int](), Counter[int]()
+    for _ in range(pairs):
+        node, to = rng.sample(nodes, 2)
+        relays = list[int]()
+        while node is not to and len(relays) < 255:
+            uid = next_hop(node, to.id)
+            if uid is None:
+                break
+            node = by_id[uid]
+            if node is not to:
+                relays.append(uid)
+        if node is to:
+            lengths[len(relays) + 1] += 1
+            relayed.update(relays)
+    return lengths, relayed
+
+
+def repair_rounds(nodes: list[PeerNode], interval: float, stop: threading.Event) -> None:
+    # A single thread runs the anti-entropy rounds of every peer, spread over the
+    # interval: a thread per peer would mostly contend for the interpreter
+    pause = interval / len(nodes)
+    while True:
+        for node in nodes:
+            if stop.wait(pause):
+                return
+            node.state.anti_entropy.round(node.state.routing_table, node.id)
+
+
+def converge(nodes: list[PeerNode], timeout: float, settle: float) -> list[str]:
+    # Sample the routing tables until they are complete or stop changing
+    lines = []
+    start = last_change = time.monotonic()
+    previous = -1.0
+    while True:
+        now = time.monotonic()
+        current = completeness(nodes)
+        if current != previous:
+            lines.append(f"  t={now - start:7.3f}s  {current * 100:6.2f}% of the routes known")
+            previous, last_change = current, now
+        if current >= 1.0 or now - last_change > settle or now - start > timeout:
+            return lines
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process mesh simulation")
+    parser.add_argument("--peers", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--latency", type=float, default=0.0, help="one-way, in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="in ms")
+    parser.add_argument("--loss", type=float, default=0.0, help="write drop probability")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--reliable", action="store_true", help="send with end-to-end acknowledgements"
+    )
+    parser.add_argument(
+        "--repair-interval", type=float, default=0.0, help="anti-entropy rounds, in s (0 = off)"
+    )
+    parser.add_argument(
+        "--degree", type=int, default=0, help="neighbors kept by every peer (0 = off)"
+    )
+    args = parser.parse_args()
+
+    # The harness reports the outcome itself
+    Peer.logger.setLevel(logging.CRITICAL)
+    threading.stack_size(THREAD_STACK_SIZE)
+    rng = random.Random(args.seed)
+    transport = MemoryTransport(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        loss=args.loss,
+        seed=args.seed,
+    )
+
+    # Every peer joins a random peer that is already part of the network
+    tracemalloc.start()
+    start = time.perf_counter()
+    nodes = list[PeerNode]()
+    for uid in range(1, args.peers + 1):
+        seed = rng.randint(1, uid - 1) if uid > 1 else None
+        peer = ServerAddress(ip="sim", port=seed) if seed is not None else None
+        config = in_process_config(uid, "sim", peer=peer, degree=args.degree)
+        node = PeerNode(config, args.peers, transport, isolated=True)
+        node.start()
+        nodes.append(node)
+    startup = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.peers} peers started in {startup:.2f}s, {threading.active_count()} threads")
+    print(f"Memory: {memory / 2**20:.1f} MiB ({memory / args.peers / 1024:.1f} KiB per peer)")
+
+    # Anti-entropy starts once every peer is up: tracemalloc slows its rounds down
+    repairs = threading.Event()
+    if args.repair_interval > 0:
+        threading.Thread(
+            target=repair_rounds, args=(nodes, args.repair_interval, repairs), daemon=True
+        ).start()
+
+    print("Convergence:")
+    # Without anti-entropy the tables stop changing once the joins are over
+    for line in converge(nodes, args.timeout, settle=max(1.0, 2 * args.repair_interval)):
+        print(line)
+    repairs.set()
+    degrees = [sum(1 for _, (conn, _) in node.state.routing_table if conn) for node in nodes]
+    print(f"Neighbors: {sum(degrees) / len(degrees):.2f} per peer, {max(degrees)} at most")
+    lengths, relayed = paths(nodes, PATH_SAMPLES, random.Random(args.seed))
+    if lengths:
+        mean = sum(hops * count for hops, count in lengths.items()) / lengths.total()
+        busiest = max(relayed.values(), default=0) / lengths.total()
+        print(
+            f"Paths: {mean:.2f} hops on average, {max(lengths)} at most, "
+            f"busiest relay on {busiest * 100:.1f}% of them"
+        )
+    join_writes, join_bytes = transport.writes, transport.bytes
+    print(f"Join traffic: {join_writes} writes, {join_bytes / 1024:.0f} KiB")
+
+    # Unicast traffic between random pairs
+    delivered = Counter[int]()
+    lock = threading.Lock()
+
+    def on_message(msg: Message):
+        with lock:
+            delivered[msg.to] += 1
+
+    for node in nodes:
+        node.on_message(on_message)
+    sent = buffered = 0
+    deliveries = list[Delivery]()
+    start = time.perf_counter()
+    for i in range(args.messages):
+        fr, to = rng.sample(nodes, 2)
+        if args.reliable:
+            deliveries.append(fr.send_reliable(to.id, f"message {i}"))
+            sent += 1
+        elif fr.send(to.id, f"message {i}"):
+            sent += 1
+        else:
+            buffered += 1
+    deadline = time.monotonic() + args.timeout
+    if args.reliable:
+        # Retransmitted until acknowledged or failed
+        for delivery in deliveries:
+            delivery.wait(max(deadline - time.monotonic(), 0))
+    else:
+        # Wait for the deliveries, lost messages are never retried
+        last, last_change = 0, time.monotonic()
+        while delivered.total() < sent and time.monotonic() < deadline:
+            time.sleep(0.05)
+            if delivered.total() != last:
+                last, last_change = delivered.total(), time.monotonic()
+            elif time.monotonic() - last_change > 1.0:
+                break
+    elapsed = time.perf_counter() - start
+    writes = transport.writes - join_writes
+    size = transport.bytes - join_bytes
+    total = delivered.total()
+    print(f"Messages: {sent} sent, {buffered} buffered (no route), {total} delivered in {elapsed:.2f}s")
+    if total:
+        print(f"Overhead: {writes / total:.2f} writes and {size / total:.0f} bytes per delivered message")
+    print(f"Transport: {transport.dropped} writes dropped")
+    if args.reliable:
+        statuses = Counter(delivery.status.value for delivery in deliveries)
+        print(f"Deliveries: {dict(statuses)}")
+
+    start = time.perf_counter()
+    for node in reversed(nodes):
+        node.stop()
+    print(f"Shutdown: {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import contextvars
+import random
+from collections import Counter
+from socket import socket
+from threading import Event, Thread
+from typing import Optional
+
+from gen.proto.communication_pb2 import (
+    Digest,
+    PeerMessage,
+    PeerMessageType,
+    RouteRepair,
+)
+from modules.lib.codec import Encoded, encode_digest
+from modules.lib.network import send
+from modules.model.route_hashes import RouteHashes, bucket_of, route_hash
+from modules.model.routing_table import RoutingTable
+
+
+class AntiEntropy:
+    """
+    Periodic repair of the routes learned from the neighbors.
+
+    JOIN and LEAVE announcements are sent once: if one is lost, or races a
+    handshake, the tables diverge for good. Every `interval` seconds (with
+    jitter) the peer sends each neighbor a `Digest` of the routes it holds
+    through it: the IDs are hashed into buckets and each bucket is summarized
+    by the XOR of the hashes of its IDs and route lengths. The neighbor hashes
+    the routes it offers (its own ID, and every peer it does not reach through
+    the sender) the same way and answers with a `RouteRepair` listing its IDs
+    and their lengths in the buckets that differ only. The sender then offers
+    these routes to its routing table (see `RoutingTable.offer_route`): the
+    missing ones are added, the shorter ones replace the known ones, and the
+    routes through the neighbor that it no longer offers are dropped.
+
+    The routing table keeps the bucket hashes up to date as routes change (see
+    `RouteHashes`): a digest is built and checked without walking the table,
+    which only happens to list the routes of the buckets that differ. A digest
+    costs 8 bytes per `PER_BUCKET` routes (a power of two of buckets); a
+    repair is proportional to the number of buckets that differ, nothing when
+    the tables agree.
+    Routes also spread further than the direct neighbors this way, and get
+    shorter as links are added. On meshes with cycles, the buckets holding
+    peers reached through another neighbor are sent again on each round.
+
+    Parameters:
+        - interval (float): Mean seconds between two rounds, 0 disables them.
+    """
+
+    INTERVAL = 10.0
+    PER_BUCKET = 8
+    MAX_BUCKETS = RouteHashes.BUCKETS
+
+    def __init__(self, interval: float = INTERVAL):
+        self.interval = interval
+        self.counters = Counter[str]()
+        self._thread: Optional[Thread] = None
+
+    def start(self, routing_table: RoutingTable, peer_id: int, exit_event: Event) -> None:
+        # Run the rounds of a peer until it exits
+        if self.interval <= 0:
+            return
+        self._thread = Thread(
+            target=contextvars.copy_context().run,
+            args=(self._run, routing_table, peer_id, exit_event),
+            name="AntiEntropy",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self, routing_table: RoutingTable, peer_id: int, exit_event: Event) -> None:
+        # Jitter keeps the neighbors from sending their digests in lockstep
+        while not exit_event.wait(self.interval * random.uniform(0.5, 1.5)):
+            self.round(routing_table, peer_id)
+
+    def round(self, routing_table: RoutingTable, peer_id: int) -> None:
+        # Send a digest to every neighbor
+        neighbors = [(uid, conn) for uid, (conn, _) in routing_table if conn]
+        for uid, conn in neighbors:
+            # The neighbor and the peers reached through it
+            held = routing_table.count_through(uid) + 1
+            count = min(max(held // self.PER_BUCKET, 1), self.MAX_BUCKETS)
+            # Folding needs a power of two
+            count = 1 << (count.bit_length() - 1)
+            buckets = routing_table.route_hashes_through(uid, count)
+            buckets[bucket_of(uid, count)] ^= route_hash(uid, 0)
+            _send(conn, encode_digest(peer_id, buckets))
+            self.counters["digests_sent"] += 1
+
+    def on_digest(self, routing_table: RoutingTable, peer_id: int, digest: Digest) -> None:
+        count = len(digest.buckets)
+        conn = _link_to(routing_table, digest.fr)
+        if not 0 < count <= self.MAX_BUCKETS or count & (count - 1) or conn is None:
+            return
+        # This peer and the peers not reached through the neighbor, with
+        # their distance from this peer (0 if unknown)
+        mine = routing_table.route_hashes(count, excluded=digest.fr)
+        mine[bucket_of(digest.fr, count)] ^= route_hash(digest.fr, routing_table.hops(digest.fr))
+        mine[bucket_of(peer_id, count)] ^= route_hash(peer_id, 0)
+        differ = [i for i in range(count) if mine[i] != digest.buckets[i]]
+        if not differ:
+            return
+        wanted = set(differ)
+        routes = [
+            (uid, hops)
+            for uid, hops in _offered_to(routing_table, peer_id, digest.fr)
+            if bucket_of(uid, count) in wanted
+        ]
+        repair = RouteRepair(
+            fr=peer_id,
+            buckets=count,
+            indexes=differ,
+            ids=[uid for uid, _ in routes],
+            hops=[hops for _, hops in routes],
+        )
+        _send(conn, PeerMessage(type=PeerMessageType.ROUTE_REPAIR, repair=repair))
+        self.counters["repairs_sent"] += 1
+
+    def on_repair(self, routing_table: RoutingTable, peer_id: int, repair: RouteRepair) -> None:
+        neighbor = repair.fr
+        if repair.buckets <= 0 or _link_to(routing_table, neighbor) is None:
+            # Not a neighbor anymore
+            return
+        distances = list(repair.hops) or [0] * len(repair.ids)
+        for uid, hops in zip(repair.ids, distances):
+            if uid == peer_id or uid == neighbor:
+                continue
+            known = uid in routing_table
+            # One more link to cross: the one to the neighbor
+            if routing_table.offer_route(uid, neighbor, hops + 1 if hops else 0):
+                self.counters["routes_shortened" if known else "routes_repaired"] += 1
+        offered = set(repair.ids)
+        indexes = set(repair.indexes)
+        stale = [
+            uid
+            for uid in routing_table.dependents(neighbor)
+            if uid not in offered and bucket_of(uid, repair.buckets) in indexes
+        ]
+        for uid in stale:
+            removed = routing_table.remove_with_dependents(uid)
+            self.counters["routes_expired"] += len(removed)
+
+
+def _link_to(routing_table: RoutingTable, uid: int) -> Optional[socket]:
+    # Connection to a neighbor, None if the peer is not one
+    try:
+        return routing_table[uid][0]
+    except KeyError:
+        return None
+
+
+def _offered_to(
+    routing_table: RoutingTable, peer_id: int, neighbor: int
+) -> list[tuple[int, int]]:
+    # This peer and the peers not reached through the neighbor, with their
+    # distance from this peer (0 if unknown)
+    offered = [
+        (uid, routing_table.hops(uid))
+        for uid, (_, via) in routing_table
+        if uid != neighbor and via != neighbor
+    ]
+    return [(peer_id, 0), *offered]
+
+
+def _send(conn: socket, message: PeerMessage | Encoded) -> None:
+    try:
+        send(conn, message)
+    except OSError:
+        # The link is closing: its worker cleans the routes up
+        pass
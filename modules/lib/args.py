@@ -23,6 +23,94 @@ def parse(args) -> Config:
         default="INFO",
         help="The log level to use. Valid values are DEBUG, INFO, WARNING, ERROR, CRITICAL",
     )
+    parser.add_argument(
+        "--script",
+        type=str,
+        default=None,
+        help="Read newline-delimited commands from this file ('-' for stdin) instead of the interactive prompt",
+    )
+    parser.add_argument(
+        "--ipc-socket",
+        type=str,
+        default=None,
+        help="Optional Unix domain socket path where local applications can send and receive messages",
+    )
+    parser.add_argument(
+        "--trace-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the sent messages to trace, between 0 (disabled) and 1",
+    )
+    parser.add_argument(
+        "--compact-routing",
+        action="store_true",
+        help="Use the memory-lean routing table, meant for meshes with many thousands of peers",
+    )
+    parser.add_argument(
+        "--max-hops",
+        type=int,
+        default=32,
+        help="Maximum number of links a message may traverse before relays drop it (1-255)",
+    )
+    parser.add_argument(
+        "--notify-drops",
+        action="store_true",
+        help="Notify the sender when this peer drops a message that exceeded its hop limit",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0.0,
+        help="Messages per second accepted from each neighbor (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--origin-rate-limit",
+        type=float,
+        default=0.0,
+        help="Messages per second accepted from each sender ID, whatever the neighbor (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--rate-burst",
+        type=float,
+        default=0.0,
+        help="Messages accepted at once above the rate limits (one second of traffic by default)",
+    )
+    parser.add_argument(
+        "--throttle-policy",
+        choices=["drop", "delay"],
+        default="drop",
+        help="Drop the messages over the rate limits, or delay them (backpressure on the neighbor)",
+    )
+    parser.add_argument(
+        "--inbox-log",
+        type=str,
+        default=None,
+        help="Optional file where the received messages are appended, to query them with 'history'",
+    )
+    parser.add_argument(
+        "--capture",
+        type=str,
+        default=None,
+        help="Optional file where every frame sent and received is recorded, for benchmarks/replay.py",
+    )
+    parser.add_argument(
+        "--state-file",
+        type=str,
+        default=None,
+        help="Optional file where the ID, known peers, routes and buffered messages are kept, to restart warm",
+    )
+    parser.add_argument(
+        "--repair-interval",
+        type=float,
+        default=10.0,
+        help="Mean seconds between two anti-entropy rounds with the neighbors (0 = disabled)",
+    )
+    parser.add_argument(
+        "--degree",
+        type=int,
+        default=0,
+        help="Number of neighbors to keep, linking to distant known peers (0 = disabled)",
+    )
     parsed_args = parser.parse_args(args)
 
     # Build the Config object with the information included in this data
@@ -57,6 +145,21 @@ def parse(args) -> Config:
         if parsed_args.peer_address
         else None,
         log_level=numeric_value,
+        script=parsed_args.script,
+        ipc=parsed_args.ipc_socket,
+        trace_rate=parsed_args.trace_rate,
+        compact_routing=parsed_args.compact_routing,
+        max_hops=parsed_args.max_hops,
+        notify_drops=parsed_args.notify_drops,
+        rate_limit=parsed_args.rate_limit,
+        origin_rate_limit=parsed_args.origin_rate_limit,
+        rate_burst=parsed_args.rate_burst,
+        throttle_policy=parsed_args.throttle_policy,
+        inbox_log=parsed_args.inbox_log,
+        capture=parsed_args.capture,
+        state_file=parsed_args.state_file,
+        repair_interval=parsed_args.repair_interval,
+        degree=parsed_args.degree,
     )
 
     return config
@@ -121,5 +224,49 @@ def _validate_args(parsed_args) -> tuple[bool, ErrorList]:
             errors.append(("desired_id", str(e)))
             status = False
 
+    # Validate the trace sampling rate
+    if not (0 <= parsed_args.trace_rate <= 1):
+        errors.append(
+            (
+                "trace_rate",
+                f"Invalid trace rate: '{parsed_args.trace_rate}'. Should be between 0 and 1.",
+            )
+        )
+        status = False
+
+    # Validate the hop limit (it must fit in the fast-path header)
+    if not (1 <= parsed_args.max_hops <= 255):
+        errors.append(
+            (
+                "max_hops",
+                f"Invalid hop limit: '{parsed_args.max_hops}'. Should be between 1 and 255.",
+            )
+        )
+        status = False
+
+    # Validate the rate limits
+    for name in ("rate_limit", "origin_rate_limit", "rate_burst", "repair_interval"):
+        value = getattr(parsed_args, name)
+        if value < 0:
+            errors.append((name, f"Invalid value: '{value}'. Should not be negative."))
+            status = False
+    # A bucket smaller than one message would drop (or delay) every message
+    limited = parsed_args.rate_limit > 0 or parsed_args.origin_rate_limit > 0
+    if limited and 0 < parsed_args.rate_burst < 1:
+        errors.append(
+            (
+                "rate_burst",
+                f"Invalid burst: '{parsed_args.rate_burst}'. Should be at least 1 message.",
+            )
+        )
+        status = False
+
+    # Validate the number of neighbors to keep
+    if parsed_args.degree < 0:
+        errors.append(
+            ("degree", f"Invalid degree: '{parsed_args.degree}'. Should not be negative.")
+        )
+        status = False
+
     # Return status and the error message
     return status, errors
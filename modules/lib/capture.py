@@ -0,0 +1,89 @@
+import itertools
+import struct
+import time
+from socket import socket
+from threading import Lock
+from typing import BinaryIO, Iterator, NamedTuple
+from weakref import WeakKeyDictionary
+
+# [8B magic || 8B ID of the capturing peer || records]
+MAGIC = b"P2PCAP\x00\x01"
+_FILE_HEADER = struct.Struct(">8sq")
+# [8B timestamp || 1B flags || 4B link ID || 4B frame size || frame]. The frame
+# is what follows the size prefix on the wire (fast-path header included)
+_RECORD = struct.Struct(">dBII")
+FLAG_SENT = 0x01
+FLAG_FAST_PATH = 0x02
+
+
+class CaptureRecord(NamedTuple):
+    timestamp: float
+    sent: bool
+    fast_path: bool
+    link: int
+    frame: bytes
+
+
+class CaptureWriter:
+    """
+    Appends the frames sent and received by a peer to a compact binary log.
+
+    Each connection gets a link ID (in the order they are first seen), so the
+    frames of a link can be told apart and replayed in order. Writes are
+    buffered; `close()` flushes them.
+
+    Parameters:
+        - path (str): File to write, truncated if it exists.
+        - peer_id (int): ID of the capturing peer, stored in the file header.
+    """
+
+    def __init__(self, path: str, peer_id: int):
+        self._file: BinaryIO = open(path, "wb")
+        self._file.write(_FILE_HEADER.pack(MAGIC, peer_id))
+        self._links: WeakKeyDictionary[socket, int] = WeakKeyDictionary()
+        self._next_link = itertools.count(1)
+        self._lock = Lock()
+
+    def record(self, conn: socket, sent: bool, fast_path: bool, *parts) -> None:
+        size = sum(len(part) for part in parts)
+        flags = (FLAG_SENT if sent else 0) | (FLAG_FAST_PATH if fast_path else 0)
+        with self._lock:
+            if self._file.closed:
+                return
+            link = self._links.get(conn)
+            if link is None:
+                link = self._links[conn] = next(self._next_link)
+            self._file.write(_RECORD.pack(time.time(), flags, link, size))
+            for part in parts:
+                self._file.write(part)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path: str) -> tuple[int, Iterator[CaptureRecord]]:
+    """
+    Open a capture. Returns the ID of the capturing peer and its records.
+
+    Raises ValueError if the file is not a capture. A record cut short (the
+    peer did not stop cleanly) ends the iteration.
+    """
+    file = open(path, "rb")
+    magic, peer_id = _FILE_HEADER.unpack(file.read(_FILE_HEADER.size).ljust(16, b"\0"))
+    if magic != MAGIC:
+        file.close()
+        raise ValueError(f"{path} is not a capture file")
+
+    def records() -> Iterator[CaptureRecord]:
+        with file:
+            while len(header := file.read(_RECORD.size)) == _RECORD.size:
+                timestamp, flags, link, size = _RECORD.unpack(header)
+                frame = file.read(size)
+                if len(frame) < size:
+                    return
+                yield CaptureRecord(
+                    timestamp, bool(flags & FLAG_SENT), bool(flags & FLAG_FAST_PATH), link, frame
+                )
+
+    return peer_id, records()
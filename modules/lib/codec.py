@@ -0,0 +1,184 @@
+import functools
+import struct
+from typing import NamedTuple, Sequence
+
+from google.protobuf.message import Message as ProtoMessage
+
+from gen.proto.communication_pb2 import (
+    AnnouncementType,
+    Digest,
+    HandshakeResponse,
+    HandshakeStart,
+    Join,
+    Leave,
+    PeerMessage,
+    PeerMessageType,
+    PropagationMessage,
+)
+
+# Hand-written encoders for the control messages of fixed shape. Everything
+# but the integer fields is encoded once, at import: the field keys, the type
+# of the PeerMessage and the nesting of its content. Encoding a message then
+# only appends the varints of its fields, instead of building the protobuf
+# objects and serializing them. The bytes are the same as SerializeToString()
+# (fields in number order, default values left out), so receivers parse them
+# as usual.
+
+_VARINT, _LEN = 0, 2
+_MASK = (1 << 64) - 1
+# Peer IDs whose varint (and address) is kept: the IDs of a mesh come back in
+# every message. Past a few thousand peers the cache misses and the codec is
+# no faster than protobuf (benchmarks/codec.py --peers); an entry takes about
+# 170 bytes
+ID_CACHE = 1 << 12
+
+
+def _lanes(width: int, bits: int) -> tuple[int, int]:
+    # Masks of the low and high `bits` bits of every `width` bits lane
+    low = sum(((1 << bits) - 1) << base for base in range(0, 96, width))
+    return low, low << bits
+
+
+_LOW14, _HIGH14 = _lanes(32, 14)
+_LOW7, _HIGH7 = _lanes(16, 7)
+# Continuation bits of a varint of n bytes: set on all of them but the last
+_MORE = [int.from_bytes(b"\x80" * (n - 1), "little") for n in range(1, 11)]
+
+
+class Encoded(NamedTuple):
+    # A control message serialized by this module, sent as-is by
+    # modules.lib.network. Never routed: its fast-path header only has the type
+    type: int
+    body: bytes
+
+
+def varint(value: int) -> bytes:
+    # Negative int32 and int64 values take 10 bytes (two's complement)
+    value &= _MASK
+    if value < 0x80:
+        return bytes((value,))
+    # Spread the 7 bits groups over bytes in three steps rather than one per
+    # byte: 28 bits per 32 bits lane, then 14 per 16 bits and 7 per byte
+    x = value & 0xFFFFFFF | (value >> 28 & 0xFFFFFFF) << 32 | (value >> 56) << 64
+    x = x & _LOW14 | (x & _HIGH14) << 2
+    x = x & _LOW7 | (x & _HIGH7) << 1
+    size = (value.bit_length() + 6) // 7
+    return (x | _MORE[size - 1]).to_bytes(size, "little")
+
+
+_id = functools.lru_cache(maxsize=ID_CACHE)(varint)
+
+
+def _key(message: type[ProtoMessage], field: str, wire_type: int) -> bytes:
+    number = message.DESCRIPTOR.fields_by_name[field].number
+    return varint(number << 3 | wire_type)
+
+
+def _content(kind: int, field: str) -> bytes:
+    # Start of a PeerMessage: its type and the key of its content
+    return _key(PeerMessage, "type", _VARINT) + varint(kind) + _key(PeerMessage, field, _LEN)
+
+
+def _nested(key: bytes, payload: bytes) -> bytes:
+    return key + varint(len(payload)) + payload
+
+
+_ANNOUNCEMENT = _content(PeerMessageType.ANNOUNCEMENT, "announcement")
+_HANDSHAKE_START = _content(PeerMessageType.HANDSHAKE_START, "handshakeStart")
+_HANDSHAKE_RESPONSE = _content(PeerMessageType.HANDSHAKE_RESPONSE, "handshakeResponse")
+_DIGEST = _content(PeerMessageType.DIGEST, "digest")
+
+# The JOIN type is the default value: only the join itself is encoded
+_JOIN = _key(PropagationMessage, "join", _LEN)
+_LEAVE = (
+    _key(PropagationMessage, "type", _VARINT)
+    + varint(AnnouncementType.LEAVE)
+    + _key(PropagationMessage, "leave", _LEN)
+)
+
+_JOIN_ID = _key(Join, "id", _VARINT)
+_JOIN_VIA = _key(Join, "via_id", _VARINT)
+_JOIN_HOST = _key(Join, "host", _LEN)
+_JOIN_PORT = _key(Join, "port", _VARINT)
+_JOIN_HOPS = _key(Join, "hops", _VARINT)
+_LEAVE_ID = _key(Leave, "id", _VARINT)
+_LEAVE_IDS = _key(Leave, "ids", _LEN)
+_START_ID = _key(HandshakeStart, "id", _VARINT)
+_START_FAST_PATH = _key(HandshakeStart, "fast_path", _VARINT) + varint(1)
+_START_HOST = _key(HandshakeStart, "host", _LEN)
+_START_PORT = _key(HandshakeStart, "port", _VARINT)
+_RESPONSE_ID = _key(HandshakeResponse, "id", _VARINT)
+_RESPONSE_ERROR = _key(HandshakeResponse, "error", _VARINT) + varint(1)
+_RESPONSE_FAST_PATH = _key(HandshakeResponse, "fast_path", _VARINT) + varint(1)
+_DIGEST_FR = _key(Digest, "fr", _VARINT)
+_DIGEST_BUCKETS = _key(Digest, "buckets", _LEN)
+
+
+def _field(key: bytes, value: int) -> bytes:
+    return key + varint(value) if value else b""
+
+
+def _id_field(key: bytes, uid: int) -> bytes:
+    return key + _id(uid) if uid else b""
+
+
+def _string(key: bytes, value: str) -> bytes:
+    return _nested(key, value.encode()) if value else b""
+
+
+@functools.lru_cache(maxsize=ID_CACHE)
+def _join_via(via_id: int) -> bytes:
+    # A peer announces every JOIN through itself: encoded once per peer
+    return _id_field(_JOIN_VIA, via_id)
+
+
+@functools.lru_cache(maxsize=ID_CACHE)
+def _join_address(host: str, port: int) -> bytes:
+    # Listening address of a peer: the same in every JOIN announcing it
+    return _string(_JOIN_HOST, host) + _field(_JOIN_PORT, port)
+
+
+def encode_join(uid: int, via_id: int, host: str = "", port: int = 0, hops: int = 0) -> Encoded:
+    join = (
+        _id_field(_JOIN_ID, uid)
+        + _join_via(via_id)
+        + _join_address(host, port)
+        + _field(_JOIN_HOPS, hops)
+    )
+    announcement = _nested(_JOIN, join)
+    return Encoded(PeerMessageType.ANNOUNCEMENT, _nested(_ANNOUNCEMENT, announcement))
+
+
+def encode_leave(uid: int, ids: Sequence[int] = ()) -> Encoded:
+    leave = _id_field(_LEAVE_ID, uid)
+    if ids:
+        # Repeated scalars are packed: a single key and length for all of them
+        leave += _nested(_LEAVE_IDS, b"".join(map(_id, ids)))
+    announcement = _LEAVE + varint(len(leave)) + leave
+    return Encoded(PeerMessageType.ANNOUNCEMENT, _nested(_ANNOUNCEMENT, announcement))
+
+
+def encode_handshake_start(uid: int, fast_path: bool, host: str = "", port: int = 0) -> Encoded:
+    start = (
+        _id_field(_START_ID, uid)
+        + (_START_FAST_PATH if fast_path else b"")
+        + _string(_START_HOST, host)
+        + _field(_START_PORT, port)
+    )
+    return Encoded(PeerMessageType.HANDSHAKE_START, _nested(_HANDSHAKE_START, start))
+
+
+def encode_handshake_response(uid: int, error: bool, fast_path: bool) -> Encoded:
+    response = (
+        _id_field(_RESPONSE_ID, uid)
+        + (_RESPONSE_ERROR if error else b"")
+        + (_RESPONSE_FAST_PATH if fast_path else b"")
+    )
+    return Encoded(PeerMessageType.HANDSHAKE_RESPONSE, _nested(_HANDSHAKE_RESPONSE, response))
+
+
+def encode_digest(fr: int, buckets: Sequence[int]) -> Encoded:
+    digest = _id_field(_DIGEST_FR, fr)
+    if buckets:
+        digest += _nested(_DIGEST_BUCKETS, struct.pack(f"<{len(buckets)}Q", *buckets))
+    return Encoded(PeerMessageType.DIGEST, _nested(_DIGEST, digest))
@@ -0,0 +1,90 @@
+from modules.lib.inbox import format_entry
+from modules.lib.logger import Logger
+from modules.lib.peer import Peer
+
+# Recipient ID used by IPC clients to address commands to the peer itself
+CONTROL_ID = 0
+
+
+def run_command(command: str) -> list[str]:
+    """
+    Execute an administrative command and return its output lines.
+
+    Shared by the console and the IPC gateway. Supported commands:
+        - table: print the routing table
+        - buffer: print the number of buffered messages per recipient
+        - trace: print the latency histograms of the traced messages
+        - stats: print the routing counters (dropped messages, ...)
+        - deliveries: print the state of the acknowledged messages per destination
+        - throttle: print the rate limits and the throttled messages per peer
+        - inbox: print the number of messages received per sender
+        - history <id> [count]: print the last messages received from a peer
+        - groups: print the known groups and their members
+        - group <group> add|remove <id> [<id> ...]: edit the members of a group
+        - profile start [interval_ms]: start profiling the live node
+        - profile stop [file]: stop profiling and write the results to a file
+    """
+    name, _, arg = command.partition(" ")
+    arg = arg.strip()
+
+    if name == "table":
+        return ["[Routing Table]", *Peer.routing_table.format_routing_table()]
+    elif name == "buffer":
+        if len(Peer.buffer) == 0:
+            return ["[Buffer]", "  - No messages in the buffer"]
+        return [
+            "[Buffer]",
+            *(f"   [{uid}]: {len(msgs)} messages" for uid, msgs in Peer.buffer.items()),
+        ]
+    elif name == "stats":
+        counters = Peer.counters + Peer.deliveries.counters + Peer.anti_entropy.counters
+        if not counters:
+            return ["[Stats]", "  - No events recorded"]
+        return ["[Stats]", *(f"  {k}: {v}" for k, v in sorted(counters.items()))]
+    elif name == "deliveries":
+        return ["[Deliveries]", *Peer.deliveries.report()]
+    elif name == "throttle":
+        return ["[Throttle]", *Peer.rate_limiter.report()]
+    elif name == "inbox":
+        return ["[Inbox]", *Peer.inbox.report()]
+    elif name == "history":
+        parts = arg.split()
+        try:
+            fr, limit = int(parts[0]), int(parts[1]) if len(parts) > 1 else 20
+        except (IndexError, ValueError):
+            return ["The format should be 'history <id> [count]'."]
+        entries = Peer.inbox.history(fr, limit)
+        if not entries:
+            return [f"[History {fr}]", "  - No message received"]
+        return [f"[History {fr}]", *(f"  {format_entry(e)}" for e in entries)]
+    elif name == "groups":
+        return ["[Groups]", *Peer.groups.format_group_table()]
+    elif name == "group":
+        parts = arg.split()
+        try:
+            group, action, ids = int(parts[0]), parts[1], [int(p) for p in parts[2:]]
+        except (IndexError, ValueError):
+            ids, action = [], ""
+        if not ids or action not in ("add", "remove"):
+            return ["The format should be 'group <group> add|remove <id> [<id> ...]'."]
+        if action == "add":
+            Peer.groups.add_members(group, ids)
+        else:
+            Peer.groups.remove_members(group, ids)
+        return [f"Group {group}: {sorted(Peer.groups.members(group))}"]
+    elif name == "trace":
+        return ["[Trace]", *(f"  {line}" for line in Peer.tracer.report())]
+    elif name == "profile":
+        action, _, param = arg.partition(" ")
+        param = param.strip()
+        if action == "start":
+            try:
+                interval = float(param) / 1000 if param else 0.005
+            except ValueError:
+                return ["Invalid sampling interval. Should be a number of milliseconds."]
+            return ["[Profiler]", *Peer.profiler.start(interval)]
+        elif action == "stop":
+            path = param or Logger.generate_file_name("profile_%s.prof")
+            return ["[Profiler]", *Peer.profiler.stop(path)]
+        return ["The format should be 'profile start [interval_ms]' or 'profile stop [file]'."]
+    return [f"Invalid command: '{command}'"]
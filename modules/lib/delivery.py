@@ -0,0 +1,322 @@
+import contextvars
+import heapq
+import random
+import time
+from collections import Counter, deque
+from enum import Enum
+from threading import Condition, Event, Thread
+from typing import Callable, Optional
+
+from gen.proto.communication_pb2 import (
+    Ack,
+    Message,
+    PeerMessage,
+)
+
+
+class DeliveryStatus(Enum):
+    PENDING = "pending"  # Waiting for room in the window of the destination
+    IN_FLIGHT = "in flight"  # Sent, not acknowledged yet
+    DELIVERED = "delivered"
+    FAILED = "failed"  # Not acknowledged after the last attempt
+
+
+class Delivery:
+    """Handle on a message sent with end-to-end acknowledgement."""
+
+    def __init__(self, to: int, seq: int, message: PeerMessage):
+        self.to = to
+        self.seq = seq
+        self.status = DeliveryStatus.PENDING
+        self.attempts = 0
+        self._message = message
+        self._sent_at = 0.0
+        self._deadline = 0.0
+        # Acknowledgements received for later messages while this one is missing
+        self._later_acks = 0
+        self._done = Event()
+
+    def __repr__(self) -> str:
+        return f"<Delivery to={self.to} seq={self.seq} {self.status.value}>"
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the outcome. Returns True if the message was acknowledged."""
+        self._done.wait(timeout)
+        return self.status == DeliveryStatus.DELIVERED
+
+
+class _Window:
+    # Sending state towards one destination
+    def __init__(self, rto: float):
+        self.next_seq = 1
+        self.in_flight = dict[int, Delivery]()
+        self.queued = deque[Delivery]()
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.rto = rto
+
+
+class _Received:
+    # Receiving state of one sender session
+    def __init__(self, session: int):
+        self.session = session
+        self.cumulative = 0
+        self.above = set[int]()
+
+
+class DeliveryTracker:
+    """
+    End-to-end acknowledgements with a sliding window per destination.
+
+    Every message sent through `send()` gets a sequence number within the
+    session of this peer (random per run). Up to `window` messages per
+    destination are in flight at once; the others wait in order. Recipients
+    acknowledge each message with the highest sequence number up to which
+    everything was received plus the latest ones received above it, and drop
+    the duplicates. Every transmission also carries the lowest sequence number
+    the sender still waits an acknowledgement for: the recipient stops waiting
+    for the messages below it, which the sender gave up on, so that a failed
+    message never holds the acknowledgements back. Only the messages missing
+    from an acknowledgement are sent
+    again: when their retransmission timeout expires (estimated from the
+    round-trip times as in RFC 6298, doubled on each attempt), or right away
+    once `FAST_RETRANSMIT` later messages were acknowledged. Each attempt is
+    routed again, so a route that changed since is followed.
+
+    Parameters:
+        - route (Callable[[int, PeerMessage], bool]): Sends a message towards a
+          peer, returns False if no route is known.
+        - window (int): Messages in flight per destination.
+        - max_attempts (int): Transmissions before a message is reported failed.
+    """
+
+    INITIAL_RTO = 1.0
+    MIN_RTO = 0.2
+    MAX_RTO = 30.0
+    FAST_RETRANSMIT = 3
+    # Sequence numbers listed above the cumulative one in an acknowledgement
+    # (the latest ones)
+    MAX_SELECTIVE = 64
+
+    def __init__(
+        self,
+        route: Callable[[int, PeerMessage], bool],
+        window: int = 64,
+        max_attempts: int = 6,
+    ):
+        self.session = random.getrandbits(62) + 1
+        self.window = window
+        self.max_attempts = max_attempts
+        self.counters = Counter[str]()
+        self._route = route
+        self._cond = Condition()
+        self._windows = dict[int, _Window]()
+        self._received = dict[int, _Received]()
+        # (deadline, destination, seq), stale entries are skipped
+        self._timers = list[tuple[float, int, int]]()
+        self._timer: Optional[Thread] = None
+        self._closed = False
+
+    # Sender side
+
+    def send(self, message: PeerMessage) -> Delivery:
+        msg = message.message
+        with self._cond:
+            if self._timer is None and not self._closed:
+                # Retransmissions are routed on behalf of the peer sending now
+                self._timer = Thread(
+                    target=contextvars.copy_context().run,
+                    args=(self._retransmit_loop,),
+                    name="DeliveryTimer",
+                    daemon=True,
+                )
+                self._timer.start()
+            window = self._windows.get(msg.to)
+            if window is None:
+                window = self._windows[msg.to] = _Window(self.INITIAL_RTO)
+            msg.session = self.session
+            msg.seq = window.next_seq
+            window.next_seq += 1
+            delivery = Delivery(msg.to, msg.seq, message)
+            if self._closed:
+                self._finish(delivery, DeliveryStatus.FAILED)
+                return delivery
+            if len(window.in_flight) < self.window and not window.queued:
+                self._schedule(window, delivery)
+            else:
+                window.queued.append(delivery)
+                return delivery
+        self._transmit([delivery])
+        return delivery
+
+    def on_ack(self, ack: Ack) -> None:
+        resend = list[Delivery]()
+        with self._cond:
+            window = self._windows.get(ack.fr)
+            if ack.session != self.session or window is None:
+                return
+            selective = set(ack.selective)
+            now = time.monotonic()
+            for seq in [s for s in window.in_flight if s <= ack.cumulative or s in selective]:
+                delivery = window.in_flight.pop(seq)
+                # Karn's algorithm: retransmitted messages give no RTT sample
+                if delivery.attempts == 1:
+                    self._sample_rtt(window, now - delivery._sent_at)
+                self._finish(delivery, DeliveryStatus.DELIVERED)
+            # Messages still missing below the highest acknowledged one. Only
+            # count the acknowledgements that could follow their last attempt
+            highest = max(selective, default=ack.cumulative)
+            rtt = window.srtt if window.srtt is not None else window.rto
+            for seq, delivery in window.in_flight.items():
+                if seq > highest:
+                    break
+                if now - delivery._sent_at < rtt:
+                    continue
+                delivery._later_acks += 1
+                if (
+                    delivery._later_acks == self.FAST_RETRANSMIT
+                    and delivery.attempts < self.max_attempts
+                ):
+                    self.counters["fast_retransmits"] += 1
+                    resend.append(delivery)
+            resend.extend(self._fill(window))
+            for delivery in resend:
+                self._schedule(window, delivery)
+        self._transmit(resend)
+
+    def _fill(self, window: _Window) -> list[Delivery]:
+        # Queued messages that fit in the window
+        ready = []
+        while window.queued and len(window.in_flight) + len(ready) < self.window:
+            ready.append(window.queued.popleft())
+        return ready
+
+    def _schedule(self, window: _Window, delivery: Delivery) -> None:
+        # Account for a new attempt (called with the lock held)
+        delivery.attempts += 1
+        delivery.status = DeliveryStatus.IN_FLIGHT
+        delivery._sent_at = time.monotonic()
+        delivery._later_acks = 0
+        backoff = window.rto * 2 ** min(delivery.attempts - 1, 8)
+        delivery._deadline = delivery._sent_at + min(backoff, self.MAX_RTO)
+        window.in_flight[delivery.seq] = delivery
+        # In flight in sequence order: the first one is the lowest unacknowledged
+        delivery._message.message.lowest_unacked = next(iter(window.in_flight))
+        heapq.heappush(self._timers, (delivery._deadline, delivery.to, delivery.seq))
+        self._cond.notify()
+
+    def _transmit(self, deliveries: list[Delivery]) -> None:
+        # Never write to a connection while holding the lock
+        for delivery in deliveries:
+            if delivery.attempts > 1:
+                self.counters["retransmits"] += 1
+            try:
+                routed = self._route(delivery.to, delivery._message)
+            except OSError:
+                # The next hop just went away
+                routed = False
+            if not routed:
+                # Retried when the timeout expires, maybe through another route
+                self.counters["no_route"] += 1
+
+    def _sample_rtt(self, window: _Window, rtt: float) -> None:
+        if window.srtt is None:
+            window.srtt, window.rttvar = rtt, rtt / 2
+        else:
+            window.rttvar = 0.75 * window.rttvar + 0.25 * abs(window.srtt - rtt)
+            window.srtt = 0.875 * window.srtt + 0.125 * rtt
+        rto = window.srtt + max(0.01, 4 * window.rttvar)
+        window.rto = min(max(rto, self.MIN_RTO), self.MAX_RTO)
+
+    def _finish(self, delivery: Delivery, status: DeliveryStatus) -> None:
+        delivery.status = status
+        self.counters[status.name.lower()] += 1
+        delivery._done.set()
+
+    def _retransmit_loop(self) -> None:
+        while True:
+            resend = list[Delivery]()
+            with self._cond:
+                # Sleep until the earliest deadline (forever if nothing is in flight)
+                while not self._closed:
+                    if self._timers and self._timers[0][0] <= time.monotonic():
+                        break
+                    timeout = self._timers[0][0] - time.monotonic() if self._timers else None
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    deadline, to, seq = heapq.heappop(self._timers)
+                    window = self._windows[to]
+                    delivery = window.in_flight.get(seq)
+                    if delivery is None or delivery._deadline != deadline:
+                        continue
+                    if delivery.attempts >= self.max_attempts:
+                        del window.in_flight[seq]
+                        self._finish(delivery, DeliveryStatus.FAILED)
+                        for queued in self._fill(window):
+                            self._schedule(window, queued)
+                            resend.append(queued)
+                        continue
+                    self._schedule(window, delivery)
+                    resend.append(delivery)
+            self._transmit(resend)
+
+    def close(self) -> None:
+        # Report the messages still waiting for an acknowledgement as failed
+        with self._cond:
+            self._closed = True
+            for window in self._windows.values():
+                for delivery in [*window.in_flight.values(), *window.queued]:
+                    self._finish(delivery, DeliveryStatus.FAILED)
+                window.in_flight.clear()
+                window.queued.clear()
+            self._timers.clear()
+            self._cond.notify_all()
+
+    # Recipient side
+
+    def on_message(self, msg: Message) -> tuple[bool, Ack]:
+        # Returns whether the message is new and the acknowledgement to send back
+        with self._cond:
+            received = self._received.get(msg.fr)
+            if received is None or received.session != msg.session:
+                # First message of the sender, or the sender restarted
+                received = self._received[msg.fr] = _Received(msg.session)
+            fresh = msg.seq > received.cumulative and msg.seq not in received.above
+            if fresh:
+                received.above.add(msg.seq)
+            else:
+                self.counters["duplicates"] += 1
+            if msg.lowest_unacked > received.cumulative + 1:
+                # The sender gave up on the missing messages below
+                received.cumulative = msg.lowest_unacked - 1
+                received.above = {seq for seq in received.above if seq > received.cumulative}
+            while received.cumulative + 1 in received.above:
+                received.cumulative += 1
+                received.above.remove(received.cumulative)
+            selective = sorted(received.above)[-self.MAX_SELECTIVE :]
+            return fresh, Ack(
+                fr=msg.to,
+                to=msg.fr,
+                session=msg.session,
+                cumulative=received.cumulative,
+                selective=selective,
+            )
+
+    def report(self) -> list[str]:
+        with self._cond:
+            if not self._windows:
+                return ["  - No message sent with acknowledgement"]
+            lines = ["Destination | In flight | Queued | Next seq | RTO"]
+            for to, window in sorted(self._windows.items()):
+                lines.append(
+                    f"{to} | {len(window.in_flight)} | {len(window.queued)} | "
+                    f"{window.next_seq} | {window.rto * 1000:.0f}ms"
+                )
+            return lines
@@ -0,0 +1,145 @@
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+from typing import BinaryIO, Optional
+
+from gen.proto.communication_pb2 import Message
+
+# On-disk record: [4B body size || 8B reception time || 8B sender ID || Message]
+_RECORD = struct.Struct(">Idq")
+
+type Entry = tuple[float, Message]
+
+
+class InboxStore:
+    """
+    Messages received by this peer, queryable by sender and time.
+
+    The latest `capacity` messages are kept in memory. If a log file is opened,
+    every message is also appended to it and an index of the records (offset
+    and reception time, plus the record numbers of each sender) is kept in
+    memory, rebuilt from the record headers when the file is opened again.
+    Queries read only the records they return. Appends are buffered: the
+    last records may be lost if the process crashes.
+
+    Parameters:
+        - capacity (int): Messages kept in memory.
+    """
+
+    CAPACITY = 1000
+
+    def __init__(self, capacity: int = CAPACITY):
+        self._recent = deque[Entry](maxlen=capacity)
+        # Sender ID -> (messages received, reception time of the last one)
+        self._senders = dict[int, tuple[int, float]]()
+        self._lock = Lock()
+        self._log: Optional[BinaryIO] = None
+        self._size = 0
+        # Record number -> offset and reception time, in append order
+        self._offsets = array("q")
+        self._times = array("d")
+        # Sender ID -> its record numbers
+        self._by_sender = dict[int, array]()
+
+    def open(self, path: str) -> None:
+        """Append to the given log file, indexing the records it already holds."""
+        with self._lock:
+            log = open(path, "a+b")
+            size = os.fstat(log.fileno()).st_size
+            offset = 0
+            # Only the headers are read, the bodies are skipped
+            while offset + _RECORD.size <= size:
+                header = os.pread(log.fileno(), _RECORD.size, offset)
+                body_size, received_at, fr = _RECORD.unpack(header)
+                end = offset + _RECORD.size + body_size
+                if end > size:
+                    break
+                self._index(offset, received_at, fr)
+                offset = end
+            # Drop a record cut short by a crash
+            log.truncate(offset)
+            self._log, self._size = log, offset
+
+    def close(self) -> None:
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def _index(self, offset: int, received_at: float, fr: int) -> None:
+        self._by_sender.setdefault(fr, array("q")).append(len(self._offsets))
+        self._offsets.append(offset)
+        self._times.append(received_at)
+        count, _ = self._senders.get(fr, (0, 0.0))
+        self._senders[fr] = (count + 1, received_at)
+
+    def add(self, msg: Message) -> None:
+        received_at = time.time()
+        with self._lock:
+            self._recent.append((received_at, msg))
+            if self._log is None:
+                count, _ = self._senders.get(msg.fr, (0, 0.0))
+                self._senders[msg.fr] = (count + 1, received_at)
+                return
+            body = msg.SerializeToString()
+            self._log.write(_RECORD.pack(len(body), received_at, msg.fr) + body)
+            self._index(self._size, received_at, msg.fr)
+            self._size += _RECORD.size + len(body)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._log is not None:
+                self._log.flush()
+
+    def recent(self, limit: int = 20) -> list[Entry]:
+        with self._lock:
+            return list(self._recent)[-limit:]
+
+    def history(self, fr: int, limit: int = 20, since: float = 0.0) -> list[Entry]:
+        """The last `limit` messages from a sender, received at or after `since`."""
+        with self._lock:
+            if self._log is None:
+                entries = [e for e in self._recent if e[1].fr == fr and e[0] >= since]
+                return entries[-limit:]
+            records = self._by_sender.get(fr, array("q"))
+            first = bisect_left(records, since, key=lambda i: self._times[i])
+            self._log.flush()
+            return [self._read(i) for i in records[max(first, len(records) - limit) :]]
+
+    def _read(self, record: int) -> Entry:
+        assert self._log is not None
+        offset = self._offsets[record]
+        end = self._offsets[record + 1] if record + 1 < len(self._offsets) else self._size
+        data = os.pread(self._log.fileno(), end - offset, offset)
+        _, received_at, _ = _RECORD.unpack_from(data)
+        msg = Message()
+        msg.ParseFromString(data[_RECORD.size :])
+        return received_at, msg
+
+    def report(self) -> list[str]:
+        with self._lock:
+            if not self._senders:
+                return ["  - No message received"]
+            lines = ["Sender | Messages | Last received"]
+            for fr, (count, last) in sorted(self._senders.items()):
+                lines.append(f"{fr} | {count} | {format_time(last)}")
+            return lines
+
+
+def format_time(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def format_message(msg: Message) -> str:
+    if msg.group:
+        return f"[Peer {msg.fr} @ {msg.group}]: {msg.msg}"
+    return f"[Peer {msg.fr}]: {msg.msg}"
+
+
+def format_entry(entry: Entry) -> str:
+    received_at, msg = entry
+    return f"{format_time(received_at)} {format_message(msg)}"
@@ -3,25 +3,47 @@ from modules.model.errors import (
     InvalidMessageError,
 )
 
+PROMPT = "Enter a message: "
+
 
 def read_command() -> tuple[Optional[int], str]:
     # Ask the user
     try:
-        data = input("Enter a message: ")
+        data = input(PROMPT)
     except ValueError:
         raise InvalidMessageError("You must enter a valid message.")
 
-    # Preprocess input
-    data = data.strip().lower()
+    return parse_command(data)
+
+
+def parse_command(data: str) -> tuple[Optional[int], str]:
+    # Preprocess input (keywords are case-insensitive, payloads are kept as-is)
+    data = data.strip()
+    keyword = data.lower()
+    name, _, arg = data.partition(" ")
 
-    if data == "end":
+    if keyword == "end":
         return (None, "exit")
-    elif data == "":
+    elif keyword == "":
         return (None, "")
-    elif data == "table":
+    elif keyword == "table":
         return (None, "table")  # type: ignore
-    elif data == "buffer":
+    elif keyword == "buffer":
         return (None, "buffer")
+    elif keyword == "trace":
+        return (None, "trace")
+    elif keyword == "groups":
+        return (None, "groups")
+    elif keyword == "stats":
+        return (None, "stats")
+    elif keyword == "deliveries":
+        return (None, "deliveries")
+    elif keyword == "throttle":
+        return (None, "throttle")
+    elif keyword == "inbox":
+        return (None, "inbox")
+    elif name.lower() in ("profile", "group", "multicast", "history"):
+        return (None, f"{name.lower()} {arg.strip()}".strip())
 
     # Process data as a "SEND" command
     parts = data.split(" ", 1)  # Split on the first space only
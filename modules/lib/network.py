@@ -1,36 +1,247 @@
+import functools
+import struct
+from contextvars import ContextVar
 from socket import socket
+from threading import Lock
+from typing import Iterable, Optional
+from weakref import WeakKeyDictionary, WeakSet
+
 from gen.proto.communication_pb2 import (
     PeerMessage,
+    PeerMessageType,
 )
 
 from modules.model.routing_table import RoutingTable
+from modules.lib.capture import CaptureWriter
+from modules.lib.codec import Encoded
 from modules.lib.logger import Logger
 
+# Per-connection write locks: several threads (workers, console, IPC clients) may
+# write to the same connection and frames must never interleave
+_send_locks: WeakKeyDictionary[socket, Lock] = WeakKeyDictionary()
+_send_locks_guard = Lock()
 
-def send(conn: socket, msg: PeerMessage) -> None:
-    serialized = msg.SerializeToString()
-    conn.sendall(len(serialized).to_bytes(4, byteorder="big"))
-    conn.sendall(serialized)
 
+def _send_lock(conn: socket) -> Lock:
+    with _send_locks_guard:
+        lock = _send_locks.get(conn)
+        if lock is None:
+            lock = _send_locks[conn] = Lock()
+        return lock
 
-def receive(conn: socket) -> PeerMessage:
-    msg = PeerMessage()
-    size_data = conn.recv(4)
-    if not size_data:
+
+# Fast-path header, negotiated during the handshake: relays route on it and
+# forward the protobuf body untouched, without parsing it
+# [4B big-endian size || 1B type || 1B flags || 1B hop limit || 8B destination ||
+#  8B origin || body]
+_HEADER = struct.Struct(">BBBqq")
+FLAG_TRACED = 0x01
+# The hop limit must fit in a single header byte
+MAX_HOP_LIMIT = 255
+
+# Connections on which both ends agreed to use the fast-path header
+_fast_path: WeakSet[socket] = WeakSet()
+
+
+def enable_fast_path(conn: socket) -> None:
+    _fast_path.add(conn)
+
+
+# Capture of the frames sent and received by the peer bound to the context, None
+# if it records none (see Peer.start_capture and Peer.bound)
+current_capture = ContextVar[Optional[CaptureWriter]]("capture", default=None)
+
+
+class Frame:
+    """
+    A received frame. The protobuf body is only parsed when `message` is accessed.
+
+    Frames received on a fast-path connection expose the type, flags, hop limit,
+    destination and origin from the header; on other connections these are None.
+    Relays update the hop limit in the header only, the body keeps the value
+    set by the sender until the frame is re-encoded for a link without header.
+    """
+
+    __slots__ = ("type", "flags", "hops", "to", "fr", "body", "_message")
+
+    def __init__(
+        self,
+        body: memoryview,
+        type: Optional[int] = None,
+        flags: Optional[int] = None,
+        hops: Optional[int] = None,
+        to: Optional[int] = None,
+        fr: Optional[int] = None,
+    ):
+        self.type = type
+        self.flags = flags
+        self.hops = hops
+        self.to = to
+        self.fr = fr
+        self.body = body
+        self._message: Optional[PeerMessage] = None
+
+    @property
+    def message(self) -> PeerMessage:
+        if self._message is None:
+            self._message = PeerMessage()
+            self._message.ParseFromString(self.body)
+        return self._message
+
+    def header(self) -> bytes:
+        if self.type is None:
+            return _header_of(self.message)
+        return _HEADER.pack(self.type, self.flags, self.hops, self.to, self.fr)
+
+    @property
+    def origin(self) -> int:
+        # ID of the peer that sent the frame (0 for announcements and handshakes)
+        return self.fr if self.fr is not None else origin_of(self.message)
+
+
+def origin_of(msg: PeerMessage) -> int:
+    if msg.type == PeerMessageType.MESSAGE:
+        return msg.message.fr
+    elif msg.type == PeerMessageType.MULTICAST:
+        return msg.multicast.fr
+    return 0
+
+
+def _header_of(msg: PeerMessage) -> bytes:
+    if msg.type == PeerMessageType.MESSAGE:
+        flags = FLAG_TRACED if msg.message.HasField("trace") else 0
+        hops = min(msg.message.hop_limit, MAX_HOP_LIMIT)
+        return _HEADER.pack(msg.type, flags, hops, msg.message.to, msg.message.fr)
+    elif msg.type == PeerMessageType.MULTICAST:
+        hops = min(msg.multicast.hop_limit, MAX_HOP_LIMIT)
+        return _HEADER.pack(msg.type, 0, hops, 0, msg.multicast.fr)
+    return _HEADER.pack(msg.type, 0, 0, 0, 0)
+
+
+@functools.cache
+def _control_header(kind: int) -> bytes:
+    # Header of the messages encoded by modules.lib.codec: never routed
+    return _HEADER.pack(kind, 0, 0, 0, 0)
+
+
+def encode(msg: PeerMessage | Encoded, fast_path: bool = False) -> bytes:
+    # Length-prefixed frame: [4B big-endian size || (header) || protobuf body]
+    if isinstance(msg, Encoded):
+        serialized = msg.body
+        if fast_path:
+            serialized = _control_header(msg.type) + serialized
+    else:
+        serialized = msg.SerializeToString()
+        if fast_path:
+            serialized = _header_of(msg) + serialized
+    return len(serialized).to_bytes(4, byteorder="big") + serialized
+
+
+def send(conn: socket, msg: PeerMessage | Encoded) -> None:
+    # Single sendall so that the size and body are never split across writes
+    fast_path = conn in _fast_path
+    data = encode(msg, fast_path)
+    capture = current_capture.get()
+    with _send_lock(conn):
+        if capture is not None:
+            capture.record(conn, True, fast_path, memoryview(data)[4:])
+        conn.sendall(data)
+
+
+def send_many(conn: socket, msgs: Iterable[PeerMessage | Encoded]) -> None:
+    # Coalesce all frames into a single write
+    fast_path = conn in _fast_path
+    frames = [encode(msg, fast_path) for msg in msgs]
+    data = b"".join(frames)
+    capture = current_capture.get()
+    with _send_lock(conn):
+        if capture is not None:
+            for frame in frames:
+                capture.record(conn, True, fast_path, memoryview(frame)[4:])
+        conn.sendall(data)
+
+
+def send_frame(conn: socket, frame: Frame) -> None:
+    # Forward a received frame as-is: only the prefix is rebuilt for the next link
+    fast_path = conn in _fast_path
+    if fast_path:
+        prefix, body = frame.header(), frame.body
+    elif frame.hops is None:
+        prefix, body = b"", frame.body
+    else:
+        # No header on this link: the hop limit updated by the relay goes in the body
+        frame.message.message.hop_limit = frame.hops
+        prefix, body = b"", frame.message.SerializeToString()
+    size = len(prefix) + len(body)
+    capture = current_capture.get()
+    with _send_lock(conn):
+        if capture is not None:
+            capture.record(conn, True, fast_path, prefix, body)
+        _sendall_buffers(conn, [size.to_bytes(4, byteorder="big") + prefix, body])
+
+
+def _sendall_buffers(conn: socket, buffers: list) -> None:
+    # Scatter-gather write: the body is never copied into a new buffer
+    views = [memoryview(b) for b in buffers]
+    while views:
+        sent = conn.sendmsg(views)
+        while sent > 0:
+            if sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+def _recv_exact(conn: socket, size: int) -> bytearray:
+    # recv() may return less than requested on large or coalesced frames
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        n = conn.recv_into(view[received:])
+        if n == 0:
+            return data[:received]
+        received += n
+    return data
+
+
+def receive_frame(conn: socket) -> Frame:
+    size_data = _recv_exact(conn, 4)
+    if len(size_data) < 4:
         raise ConnectionResetError("Connection closed by peer during size reception")
 
     size = int.from_bytes(size_data, byteorder="big")
-    data = conn.recv(size)
+    data = _recv_exact(conn, size)
     if len(data) < size:
         raise ConnectionResetError("Incomplete message received")
 
-    msg.ParseFromString(data)
-    return msg
+    fast_path = conn in _fast_path
+    capture = current_capture.get()
+    if capture is not None:
+        capture.record(conn, False, fast_path, data)
+    return decode_frame(data, fast_path)
+
 
+def decode_frame(data: bytes | bytearray, fast_path: bool) -> Frame:
+    # Frame from the bytes that follow the size prefix
+    if fast_path:
+        type, flags, hops, to, fr = _HEADER.unpack_from(data)
+        return Frame(memoryview(data)[_HEADER.size :], type, flags, hops, to, fr)
+    return Frame(memoryview(data))
 
-def send_broadcast(routing_table: RoutingTable, msg: PeerMessage) -> None:
+
+def receive(conn: socket) -> PeerMessage:
+    return receive_frame(conn).message
+
+
+def send_broadcast(routing_table: RoutingTable, msg: PeerMessage | Encoded) -> None:
     for _, (conn, _) in routing_table:
         if conn is None:
             continue
         # Otherwise, send the message to the peer
-        send(conn, msg)
+        try:
+            send(conn, msg)
+        except OSError:
+            # That link is closing as well: its own worker cleans it up
+            continue
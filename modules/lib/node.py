@@ -0,0 +1,402 @@
+import contextvars
+import functools
+import queue
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+
+from gen.proto.communication_pb2 import (
+    Message,
+    Multicast,
+    PeerMessage,
+    PeerMessageType,
+)
+from modules.lib.delivery import Delivery
+from modules.lib.inbox import Entry
+from modules.lib.network import send_many
+from modules.lib.peer import Peer, PeerState
+from modules.lib.persistence import StateFile, former_neighbors, restore
+from modules.lib.ratelimit import RateLimiter, ThrottlePolicy
+from modules.lib.server import IPCGateway, PeerServer
+from modules.lib.topology import TopologyManager
+from modules.lib.transport import Address, Transport
+from modules.model.config import Config
+from modules.model.errors import InvalidMessageError, NoRouteError
+from modules.model.factory import make_message
+from modules.model.routing_table import CompactRoutingTable
+from modules.model.workers import PeerClientWorker, PeerServerWorker
+
+
+def _bound(method):
+    # Run the method against the network state of the node
+    @functools.wraps(method)
+    def wrapper(self: "PeerNode", *args, **kwargs):
+        with Peer.bound(self._state):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class _Inbox(queue.Queue[Optional[Message]]):
+    def wake(self) -> None:
+        self.put(None)
+
+
+class PeerNode:
+    """
+    Programmatic entry point to the peer-to-peer network.
+
+    Wraps the startup sequence of `peer.py` (ID assignment, optional join, server
+    start) and exposes sending and receiving as plain method calls. By default
+    the node uses the process-wide state of the `Peer` class, hence only one
+    such node can be running per process; isolated nodes get a state of their
+    own and can run side by side (e.g. on a `MemoryTransport`).
+
+    Parameters:
+        - config (Config): Startup configuration (see `modules.lib.args.parse`).
+        - max_peers (int): Maximum number of inbound connections served.
+        - transport (Transport): How to reach the other peers, TCP if omitted.
+        - isolated (bool): Whether the node gets its own network state.
+    """
+
+    # Handshakes in flight at once when joining
+    MAX_DIALS = 8
+
+    def __init__(
+        self,
+        config: Config,
+        max_peers: int = 10,
+        transport: Optional[Transport] = None,
+        isolated: bool = False,
+    ):
+        self._config = config
+        self._max_peers = max_peers
+        self._state = PeerState() if isolated else Peer.state()
+        if transport is not None:
+            self._state.transport = transport
+        self._server: Optional[PeerServer] = None
+        self._clients = list[PeerClientWorker]()
+        self._state_file: Optional[StateFile] = None
+        self._topology: Optional[TopologyManager] = None
+        self._gateway: Optional[IPCGateway] = None
+
+    @property
+    @_bound
+    def id(self) -> Optional[int]:
+        return Peer.id()
+
+    @property
+    def state(self) -> PeerState:
+        return self._state
+
+    @_bound
+    def start(self) -> None:
+        """
+        Join the configured network (or create a new one) and start serving.
+
+        Raises ConnectionError if the handshake with the seed peer fails and
+        OSError if the local server (or IPC gateway) cannot be started.
+        """
+        Peer.tracer.sample_rate = self._config["trace_rate"]
+        Peer.max_hops = self._config["max_hops"]
+        Peer.notify_drops = self._config["notify_drops"]
+        Peer.rate_limiter = RateLimiter(
+            neighbor_rate=self._config["rate_limit"],
+            origin_rate=self._config["origin_rate_limit"],
+            burst=self._config["rate_burst"],
+            policy=ThrottlePolicy(self._config["throttle_policy"]),
+        )
+        if self._config["compact_routing"]:
+            Peer.routing_table = CompactRoutingTable.detached()
+        if self._config["inbox_log"] is not None:
+            Peer.inbox.open(self._config["inbox_log"])
+
+        # Snapshot left by the previous run, if any
+        cache = None
+        if self._config["state_file"] is not None:
+            self._state_file = StateFile(self._config["state_file"])
+            cache = self._state_file.load()
+
+        # If user has set a desired ID, set it. Otherwise, reuse the ID of the
+        # previous run or use a random ID
+        if self._config["id"] is not None:
+            Peer.set_id(self._config["id"])
+        elif cache is not None and cache.id:
+            Peer.set_id(cache.id)
+        else:
+            Peer.set_random_id()
+
+        # Shared in the handshakes, for the peers to link back to this one
+        Peer.address = (self._config["local"]["ip"], self._config["local"]["port"])
+
+        # Record the traffic from the handshake on, so that it can be replayed
+        if self._config["capture"] is not None:
+            Peer.start_capture(self._config["capture"])
+
+        # check whether we want to create a new network or access an existing
+        # one using an handshake request (with the configured peer and the
+        # neighbors of the previous run, up to the target degree if any: the
+        # topology manager links to the others if needed)
+        seeds = list[Address]()
+        if self._config["peer"] is not None:
+            seeds.append((self._config["peer"]["ip"], self._config["peer"]["port"]))
+        if cache is not None:
+            for _, addr in former_neighbors(cache):
+                if self._config["degree"] and len(seeds) >= self._config["degree"]:
+                    break
+                if addr not in seeds and addr != Peer.address:
+                    seeds.append(addr)
+        if seeds:
+            Peer.logger.info(f"[Startup] Connecting to {len(seeds)} peers...")
+            self._join(seeds)
+        else:
+            Peer.logger.info("[Startup] Creating a new network...")
+
+        if cache is not None:
+            restored = restore(cache)
+            Peer.logger.info(
+                f"[Startup] Restored {restored} routes and "
+                f"{sum(len(b.messages) for b in cache.buffered)} buffered messages"
+            )
+            # The seeds were linked before the messages were restored: send
+            # the ones that have a route now
+            for uid in list(Peer.buffer):
+                try:
+                    Peer.flush_buffer(uid, Peer.find_route(uid))
+                except NoRouteError:
+                    pass
+
+        # Start the server thread
+        self._server = PeerServer(
+            self._config["local"]["ip"],
+            self._config["local"]["port"],
+            PeerServerWorker,
+            self._max_peers,
+        )
+        self._server.start()
+
+        # Start the local gateway, if requested
+        if self._config["ipc"] is not None:
+            self._gateway = IPCGateway(self._config["ipc"])
+            self._gateway.start()
+
+        # Keep the snapshot up to date in the background
+        if self._state_file is not None:
+            self._state_file.start()
+
+        # Repair the routes that announcements failed to spread
+        Peer.anti_entropy.interval = self._config["repair_interval"]
+        Peer.anti_entropy.start(Peer.routing_table, Peer.id(), Peer.EXIT_EVENT)
+
+        # Keep the number of neighbors on target, whatever the seeds were
+        self._topology = TopologyManager(self._config["degree"], self._connect)
+        self._topology.start()
+
+    def _join(self, seeds: list[Address]) -> None:
+        # Handshake with the seeds, MAX_DIALS at a time. Only the configured
+        # peer is required: the neighbors of the previous run may be gone
+        with ThreadPoolExecutor(max_workers=min(len(seeds), self.MAX_DIALS)) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, Peer.join, *addr)
+                for addr in seeds
+            ]
+        for addr, future in zip(seeds, futures):
+            try:
+                uid, conn = future.result()
+            except (ConnectionError, OSError) as e:
+                if self._config["peer"] is not None and addr == seeds[0]:
+                    raise ConnectionError(f"Cannot join {addr[0]}:{addr[1]}: {e}")
+                Peer.logger.warning(f"[Startup] Cannot reach {addr[0]}:{addr[1]}: {e}")
+                continue
+            self._link(uid, conn, addr)
+
+    def _connect(self, addr: Address) -> bool:
+        # Open one more link (see TopologyManager)
+        try:
+            uid, conn = Peer.join(*addr)
+        except (ConnectionError, OSError) as e:
+            Peer.logger.warning(f"[Topology] Cannot reach {addr[0]}:{addr[1]}: {e}")
+            return False
+        return self._link(uid, conn, addr)
+
+    def _link(self, uid: int, conn: socket.socket, addr: Address) -> bool:
+        # Record the connection inside the routing table. Same peer behind two
+        # addresses, or both peers linked to each other at once: the link
+        # opened by the smaller ID is kept on both ends
+        kept, previous = Peer.link(uid, conn, outbound=True)
+        if not kept:
+            conn.close()
+            return False
+        Peer.logger.info(f"[Node] Connected to {uid} at {addr[0]}:{addr[1]}")
+        Peer.addresses[uid] = addr
+        Peer.flush_buffer(uid, conn)
+
+        # Start a worker thread to handle all incoming messages
+        client = PeerClientWorker(uid, conn, addr)
+        client.start()
+        self._clients.append(client)
+        if previous is not None:
+            previous.close()
+        return True
+
+    @_bound
+    def stop(self) -> None:
+        """Stop the server and close every connection."""
+        # Last snapshot, while the routes are still there
+        if self._state_file is not None:
+            self._state_file.save()
+        Peer.EXIT_EVENT.set()
+        Peer.deliveries.close()
+        for client in self._clients:
+            client.stop()
+        if self._gateway is not None:
+            self._gateway.stop()
+        if self._server is not None:
+            self._server.stop()
+        Peer.inbox.close()
+        Peer.stop_capture()
+        # The workers woke up on the event and are leaving: release its pipe
+        Peer.EXIT_EVENT.close()
+
+    def __enter__(self) -> "PeerNode":
+        self.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+    @_bound
+    def send(self, to: int, text: str) -> bool:
+        """
+        Send a text message to a peer.
+
+        Returns True if the message was written to the next hop, False if no
+        route is known yet and the message has been buffered instead.
+        """
+        return Peer.route_message(to, self._make_message(to, text))
+
+    @_bound
+    def send_reliable(self, to: int, text: str) -> Delivery:
+        """
+        Send a text message that the recipient acknowledges end to end.
+
+        Messages are retransmitted (over the current route) until acknowledged,
+        up to `Peer.deliveries.max_attempts` times, and the recipient drops the
+        duplicates. Many messages can be in flight at once; the returned handle
+        tells whether this one was delivered (`status`, `wait()`).
+        """
+        return Peer.deliveries.send(self._make_message(to, text))
+
+    @_bound
+    def send_many(self, messages: Iterable[tuple[int, str]]) -> int:
+        """
+        Send a batch of (recipient, text) messages.
+
+        Frames sharing the same next hop are coalesced into a single write.
+        Returns the number of messages written; the others are buffered.
+        """
+        routes: dict[int, Optional[socket.socket]] = {}
+        batches: dict[socket.socket, list[PeerMessage]] = {}
+        for to, text in messages:
+            msg = self._make_message(to, text)
+            if to not in routes:
+                try:
+                    routes[to] = self._route(to)
+                except NoRouteError:
+                    routes[to] = None
+            conn = routes[to]
+            if conn is None:
+                Peer.buffer_message(to, msg)
+                continue
+            batches.setdefault(conn, []).append(msg)
+
+        sent = 0
+        for conn, msgs in batches.items():
+            send_many(conn, msgs)
+            sent += len(msgs)
+        return sent
+
+    @_bound
+    def send_multicast(self, recipients: Iterable[int], text: str, group: int = 0) -> int:
+        """
+        Send the same text to several peers with a single multicast message.
+
+        The message travels once over each link shared by the routes to the
+        recipients. Returns the number of links it was sent to.
+        """
+        peerid = Peer.id()
+        assert peerid is not None, "Peer ID is not set"
+        to = [uid for uid in recipients if uid != peerid]
+        if not to:
+            raise InvalidMessageError("A multicast needs at least one other recipient.")
+        mc = Multicast(fr=peerid, to=to, msg=text, group=group, hop_limit=Peer.max_hops)
+        return Peer.route_multicast(PeerMessage(type=PeerMessageType.MULTICAST, multicast=mc))
+
+    @_bound
+    def send_group(self, group: int, text: str) -> int:
+        """Multicast a text to the members of a group (see `Peer.groups`)."""
+        if group not in Peer.groups:
+            raise InvalidMessageError(f"Unknown group {group}.")
+        return self.send_multicast(Peer.groups.members(group), text, group)
+
+    @_bound
+    def on_message(self, callback: Callable[[Message], None]) -> None:
+        """Register a callback invoked (from a worker thread) on every inbound message."""
+        Peer.listeners.append(callback)
+
+    @_bound
+    def remove_listener(self, callback: Callable[[Message], None]) -> None:
+        Peer.listeners.remove(callback)
+
+    def messages(self, timeout: Optional[float] = None) -> Iterator[Message]:
+        """
+        Iterate over inbound messages as they arrive.
+
+        Stops when the node exits or, if a timeout is given, when no message
+        arrives within `timeout` seconds.
+        """
+        inbox = _Inbox()
+        # The exit event wakes the inbox up with a None message
+        self._state.EXIT_EVENT.watch(inbox)
+        self.on_message(inbox.put)
+        try:
+            while not self._state.EXIT_EVENT.is_set():
+                try:
+                    msg = inbox.get(timeout=timeout)
+                except queue.Empty:
+                    return
+                if msg is None:
+                    return
+                yield msg
+        finally:
+            self.remove_listener(inbox.put)
+
+    @_bound
+    def history(self, fr: int, limit: int = 20, since: float = 0.0) -> list[Entry]:
+        """
+        The last messages received from a peer, as (reception time, message).
+
+        Answered from the inbox log if one is configured (`inbox_log`), from
+        the latest messages kept in memory otherwise.
+        """
+        return Peer.inbox.history(fr, limit, since)
+
+    @_bound
+    def trace_report(self) -> list[str]:
+        """Per-hop and end-to-end latency histograms of the traced messages received."""
+        return Peer.tracer.report()
+
+    def _make_message(self, to: int, text: str) -> PeerMessage:
+        peerid = Peer.id()
+        assert peerid is not None, "Peer ID is not set"
+        if to == peerid:
+            raise InvalidMessageError("You cannot send a message to yourself!")
+        msg = make_message(peerid, to, text, Peer.max_hops)
+        Peer.tracer.start(msg.message)
+        return msg
+
+    def _route(self, to: int) -> socket.socket:
+        # If the UID is known, try to look for a route to it
+        if to not in Peer.routing_table:
+            raise NoRouteError()
+        return Peer.find_route(to)
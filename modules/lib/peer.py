@@ -1,70 +1,206 @@
 import socket
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
 from random import randint
-from threading import Event
-from typing import Optional
+from typing import Callable, Iterable, Iterator, Optional
 
 from gen.proto.communication_pb2 import (
     AnnouncementType,
-    HandshakeResponse,
-    HandshakeStart,
+    Leave,
+    Message,
+    Multicast,
     PeerMessage,
     PeerMessageType,
+    Undeliverable,
 )
+from modules.lib.antientropy import AntiEntropy
+from modules.lib.capture import CaptureWriter
+from modules.lib.codec import (
+    encode_handshake_response,
+    encode_handshake_start,
+    encode_leave,
+)
+from modules.lib.delivery import DeliveryTracker
+from modules.lib.inbox import InboxStore
 from modules.lib.logger import Logger
-from modules.lib.network import receive, send
+from modules.lib.network import (
+    FLAG_TRACED,
+    Frame,
+    current_capture,
+    enable_fast_path,
+    receive,
+    receive_frame,
+    send,
+    send_broadcast,
+    send_frame,
+    send_many,
+)
+from modules.lib.profiler import Profiler
+from modules.lib.ratelimit import RateLimiter
 from modules.lib.snowflake import derive_id
+from modules.lib.tracing import Tracer
+from modules.lib.transport import Address, TcpTransport, Transport, WakeupEvent
 from modules.model.errors import NoRouteError
+from modules.model.group_table import GroupTable
 from modules.model.routing_table import RoutingTable
 
 
-class Peer:
-    _ID: Optional[int] = None
-    EXIT_EVENT = Event()
+class PeerState:
+    """
+    Network state of a peer: identity, routes, buffered messages, settings.
+
+    A process normally runs a single peer, which uses the default state. Other
+    states are bound to a context with `Peer.bound()` (e.g. to simulate many
+    peers in one process); worker threads inherit the state of their creator.
+
+    Parameters:
+        - routing_table (RoutingTable): Table to use, a new one if omitted.
+        - transport (Transport): How to reach the other peers, TCP if omitted.
+    """
+
+    def __init__(
+        self,
+        routing_table: Optional[RoutingTable] = None,
+        transport: Optional[Transport] = None,
+    ):
+        self._ID: Optional[int] = None
+        # Listening address of this peer, shared in the handshakes
+        self.address: Optional[Address] = None
+        # Selectable: threads waiting for data wake up as soon as it is set
+        self.EXIT_EVENT = WakeupEvent()
+        self.routing_table = (
+            routing_table if routing_table is not None else RoutingTable.detached()
+        )
+        self.groups = GroupTable()
+        self.buffer = dict[int, list[PeerMessage]]()
+        # Listening addresses of the peers we know one of
+        self.addresses = dict[int, Address]()
+        self.listeners = list[Callable[[Message], None]]()
+        # Messages received, queryable by sender (`inbox` and `history` commands)
+        self.inbox = InboxStore()
+        self.tracer = Tracer()
+        self.counters = Counter[str]()
+        # Links a message may traverse before relays drop it
+        self.max_hops = 32
+        # Whether to notify the sender of the messages dropped by this relay
+        self.notify_drops = False
+        self.transport = transport or TcpTransport()
+        # Limits on the messages relayed for each neighbor and sender
+        self.rate_limiter = RateLimiter()
+        # Periodic repair of the routes learned from the neighbors
+        self.anti_entropy = AntiEntropy()
+        # Messages sent with end-to-end acknowledgement (no buffering: the
+        # tracker retries them itself)
+        self.deliveries = DeliveryTracker(
+            lambda uid, message: Peer.route_message(uid, message, buffer=False)
+        )
+        # Frames sent and received, recorded for replay (see Peer.start_capture)
+        self.capture: Optional[CaptureWriter] = None
+
+
+_default_state = PeerState(RoutingTable())
+_current_state = ContextVar[PeerState]("peer_state", default=_default_state)
+
+
+class _StateAttribute:
+    # Class attribute of Peer resolved against the state of the current context
+    def __set_name__(self, owner: type, name: str):
+        self._name = name
+
+    def __get__(self, instance, owner=None):
+        return getattr(_current_state.get(), self._name)
+
+    def __set__(self, instance, value):
+        setattr(_current_state.get(), self._name, value)
+
+
+class _PeerMeta(type):
+    _ID = _StateAttribute()
+    address = _StateAttribute()
+    EXIT_EVENT = _StateAttribute()
+    routing_table = _StateAttribute()
+    groups = _StateAttribute()
+    buffer = _StateAttribute()
+    addresses = _StateAttribute()
+    listeners = _StateAttribute()
+    inbox = _StateAttribute()
+    tracer = _StateAttribute()
+    counters = _StateAttribute()
+    max_hops = _StateAttribute()
+    notify_drops = _StateAttribute()
+    transport = _StateAttribute()
+    deliveries = _StateAttribute()
+    rate_limiter = _StateAttribute()
+    anti_entropy = _StateAttribute()
+    capture = _StateAttribute()
+
+
+class Peer(metaclass=_PeerMeta):
+    # Shared by every peer of the process (the network state is in PeerState)
     logger = Logger("p2p-network").get_logger()
-    routing_table = RoutingTable()
-    buffer = dict[int, list[PeerMessage]]()
+    profiler = Profiler()
+
+    @staticmethod
+    def state() -> PeerState:
+        return _current_state.get()
+
+    @staticmethod
+    @contextmanager
+    def bound(state: PeerState) -> Iterator[PeerState]:
+        # Act on behalf of another peer within the block
+        token = _current_state.set(state)
+        capture_token = current_capture.set(state.capture)
+        try:
+            yield state
+        finally:
+            current_capture.reset(capture_token)
+            _current_state.reset(token)
 
     @staticmethod
-    def handle_handshake(conn: socket.socket) -> tuple[int, bool]:
-        # Receive the handshake message
+    def handle_handshake(
+        conn: socket.socket, addr: Optional[Address] = None
+    ) -> tuple[int, bool]:
+        # Receive the handshake message. The remote address of the connection
+        # (addr) stands for a wildcard listening host of the client
         handshake = receive(conn)
         if handshake.type != PeerMessageType.HANDSHAKE_START:
             raise ConnectionError(
                 f"[ServerWorker] Unexpected message type received during handshake: expected {PeerMessageType.HANDSHAKE_START}, got {handshake.type}"
             )
         handshake = handshake.handshakeStart
-        # Ensure that no other peers with same ID are connected to the server
-        if handshake.id in Peer.routing_table or handshake.id == Peer.id():
+        # Ensure that no other peers with same ID are connected to the server.
+        # A peer reached through others may open a direct link, and a second
+        # one if it wins the tie-break (see Peer.link)
+        if handshake.id == Peer.id() or (
+            Peer.is_neighbor(handshake.id) and not Peer.prevails(handshake.id, outbound=False)
+        ):
             Peer.logger.error(
                 f"[ServerWorker] Peer with ID {handshake.id} already connected. Handhake failed"
             )
             # Notify the client + share our id
-            ack = HandshakeResponse(error=True)
-            send(
-                conn,
-                PeerMessage(
-                    type=PeerMessageType.HANDSHAKE_RESPONSE, handshakeResponse=ack
-                ),
-            )
+            send(conn, encode_handshake_response(0, error=True, fast_path=False))
             return handshake.id, False
 
+        if handshake.port:
+            host = handshake.host
+            if host in ("", "0.0.0.0", "::") and addr is not None:
+                host = addr[0]
+            Peer.addresses[handshake.id] = (host, handshake.port)
+
         # Send back success ack
-        ack = HandshakeResponse(id=Peer.id(), error=False)
-        send(
-            conn,
-            PeerMessage(type=PeerMessageType.HANDSHAKE_RESPONSE, handshakeResponse=ack),
-        )
+        send(conn, encode_handshake_response(Peer.id(), False, handshake.fast_path))
+        # Every following frame carries the fast-path header, if agreed
+        if handshake.fast_path:
+            enable_fast_path(conn)
         return (handshake.id, True)
 
     @staticmethod
     def _send_handshake(conn: socket.socket, attempts=3) -> tuple[int, bool]:
         # Send the handshake start message
         Peer.logger.debug("[Handshake] Sending handshake start message")
-        handshake = HandshakeStart(id=Peer.id())
-        send(
-            conn,
-            PeerMessage(type=PeerMessageType.HANDSHAKE_START, handshakeStart=handshake),
-        )
+        host, port = Peer.address or ("", 0)
+        send(conn, encode_handshake_start(Peer.id(), True, host, port))
 
         # Receive back the response
         try:
@@ -83,6 +219,8 @@ class Peer:
         # Check if the handshake was successful
         if not res.error:
             Peer.logger.debug(f"[Handshake] Handshake successful. Peer ID: {res.id}")
+            if res.fast_path:
+                enable_fast_path(conn)
             return res.id, True
         else:
             # Retry using the provided ID
@@ -99,55 +237,295 @@ class Peer:
             return -1, False
 
     @staticmethod
-    def receive_message(conn: socket.socket) -> Optional[PeerMessage]:
+    def receive_message(conn: socket.socket) -> Optional[Frame]:
         try:
-            return receive(conn)
+            return receive_frame(conn)
         except ConnectionResetError:
             Peer.logger.error("Connection reset by peer")
             return None
 
     @staticmethod
-    def handle_message(message: PeerMessage) -> None:
+    def handle_frame(frame: Frame, sender: Optional[int] = None) -> None:
+        # Transit messages with a fast-path header are routed without parsing
+        # them (traced messages are parsed to record the hop). The sender is
+        # the neighbor the frame came from, when known
+        if (
+            frame.type == PeerMessageType.MESSAGE
+            and frame.to != Peer.id()
+            and not frame.flags & FLAG_TRACED
+        ):
+            frame.hops = Peer.next_hop_limit(frame.hops or 0)
+            if frame.hops <= 0:
+                Peer.drop_message(frame.message.message)
+                return
+            try:
+                if frame.to not in Peer.routing_table:
+                    raise NoRouteError()
+                send_frame(Peer.find_route(frame.to), frame)
+            except NoRouteError:
+                Peer.logger.error(
+                    f"[Routing] No route to {frame.to}. Saving message for later..."
+                )
+                frame.message.message.hop_limit = frame.hops
+                Peer.buffer_message(frame.to, frame.message)
+            return
+        Peer.handle_message(frame.message, sender)
+
+    @staticmethod
+    def handle_message(message: PeerMessage, sender: Optional[int] = None) -> None:
         # Handle incoming messages
         if message.type == PeerMessageType.MESSAGE:
             msg = message.message
             # If the target is not us, forward the message
             if msg.to != Peer.id():
-                try:
-                    # If we don't know how to reach the target, save it locally
-                    if msg.to not in Peer.routing_table:
-                        raise NoRouteError()
-                    else:
-                        Peer.logger.debug(
-                            f"[OUTBOX] Forwarding message to {msg.to} via {Peer.routing_table[msg.to]}"
-                        )
-                        # Find route to the peer and forward the message
-                        send(Peer.find_route(msg.to), message)
-                except NoRouteError:
-                    Peer.logger.error(
-                        f"[Routing] No route to {msg.to}. Saving message for later..."
-                    )
-                    if msg.to not in Peer.buffer:
-                        Peer.buffer[msg.to] = []
-                    Peer.buffer[msg.to].append(message)
+                msg.hop_limit = Peer.next_hop_limit(msg.hop_limit)
+                if msg.hop_limit <= 0:
+                    Peer.drop_message(msg)
+                    return
+                if msg.HasField("trace"):
+                    Peer.tracer.hop(msg, Peer.id())
+                Peer.route_message(msg.to, message)
             else:
                 Peer.logger.debug(f"[INBOX] Received new message from {msg.fr}")
-                print(f"[Peer {msg.fr}]: {msg.msg}")
+                # Acknowledge the messages that asked for it, drop the duplicates
+                if msg.seq and not Peer.acknowledge(msg):
+                    return
+                if msg.HasField("trace"):
+                    Peer.tracer.finish(msg, msg.to)
+                Peer.deliver(msg)
+        # Multicast messages: deliver our copy, forward the rest
+        elif message.type == PeerMessageType.MULTICAST:
+            mc = message.multicast
+            mc.hop_limit = Peer.next_hop_limit(mc.hop_limit)
+            Peer.route_multicast(message)
+        # A relay dropped one of our messages (or we relay the notification)
+        elif message.type == PeerMessageType.UNDELIVERABLE:
+            und = message.undeliverable
+            if und.to == Peer.id():
+                Peer.counters["undeliverable"] += 1
+                Peer.logger.warning(
+                    f"[Routing] Message to {und.dest} dropped by {und.fr}: hop limit exceeded"
+                )
+                return
+            # Notifications are never notified about: drop them silently
+            und.hop_limit = Peer.next_hop_limit(und.hop_limit)
+            if und.hop_limit > 0:
+                Peer.route_message(und.to, message, buffer=False)
+        # End-to-end acknowledgement of messages we sent (or we relay it)
+        elif message.type == PeerMessageType.ACK:
+            ack = message.ack
+            if ack.to == Peer.id():
+                Peer.deliveries.on_ack(ack)
+                return
+            ack.hop_limit = Peer.next_hop_limit(ack.hop_limit)
+            if ack.hop_limit > 0:
+                Peer.route_message(ack.to, message, buffer=False)
+        # Anti-entropy with a neighbor: compare the routes, then repair them
+        elif message.type == PeerMessageType.DIGEST:
+            Peer.anti_entropy.on_digest(Peer.routing_table, Peer.id(), message.digest)
+        elif message.type == PeerMessageType.ROUTE_REPAIR:
+            Peer.anti_entropy.on_repair(Peer.routing_table, Peer.id(), message.repair)
         # Handling broadcast messages (announcements)
         elif message.type == PeerMessageType.ANNOUNCEMENT:
             ann = message.announcement
             # Join announcement
             if ann.type == AnnouncementType.JOIN:
-                Peer.routing_table.add_remote_peer(ann.join.id, ann.join.via_id)
+                join = ann.join
+                if join.id == Peer.id():
+                    return
+                if join.port:
+                    Peer.addresses[join.id] = (join.host, join.port)
+                # Known routes are only replaced by shorter ones, so that they
+                # cannot loop once the mesh has cycles
+                hops = join.hops + 1 if join.hops else 0
+                Peer.routing_table.offer_route(join.id, join.via_id, hops)
             # Leave announcement
             elif message.announcement.type == AnnouncementType.LEAVE:
-                del Peer.routing_table[ann.leave.id]
+                Peer.handle_leave(ann.leave, sender)
         else:
             Peer.logger.warning(
                 f"[Client] Received unknown message type: {message.type}"
             )
             Peer.logger.debug(f"[Client] Message: {message}")
 
+    @staticmethod
+    def handle_leave(leave: Leave, sender: Optional[int]) -> list[int]:
+        # Forget the peers a neighbor can no longer reach, if they were reached
+        # through it: the routes through another neighbor, and the links to
+        # the peers themselves, still hold. The peers that became unreachable
+        # are announced to the neighbors in turn. Returns their IDs
+        if sender is None:
+            return []
+        removed = list[int]()
+        for uid in (leave.id, *leave.ids):
+            removed.extend(Peer.routing_table.withdraw(uid, sender))
+        if removed:
+            Peer.logger.info(f"[Routing] Lost the routes to {len(removed)} peers via {sender}")
+            Peer.forget_addresses(removed)
+            send_broadcast(Peer.routing_table, encode_leave(removed[0], removed[1:]))
+        return removed
+
+    @staticmethod
+    def drop_link(uid: int, conn: Optional[socket.socket] = None) -> list[int]:
+        # Forget a neighbor whose connection closed, along with every peer
+        # reached through it, and tell the other neighbors in a single LEAVE.
+        # Nothing is dropped if the neighbor is linked through another
+        # connection than the closed one (conn) by now
+        if conn is not None and uid in Peer.routing_table:
+            if Peer.routing_table[uid][0] not in (conn, None):
+                return []
+        removed = Peer.routing_table.remove_with_dependents(uid)
+        if not removed:
+            return removed
+        Peer.logger.info(f"[Routing] Lost the routes to {len(removed)} peers via {uid}")
+        send_broadcast(Peer.routing_table, encode_leave(uid, removed[1:]))
+        return removed
+
+    @staticmethod
+    def close_link(uid: int) -> Optional[socket.socket]:
+        # Close the link to a neighbor on purpose. Its worker reads the end of
+        # the stream and drops the link as if the neighbor had closed it (see
+        # drop_link); so does the neighbor. Returns the connection closed, None
+        # if the peer is not a neighbor
+        try:
+            conn = Peer.routing_table[uid][0]
+        except KeyError:
+            return None
+        if conn is None:
+            return None
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # Already closed: its worker is dropping the link
+            pass
+        return conn
+
+    @staticmethod
+    def forget_addresses(uids: Iterable[int]) -> None:
+        # The peers left (see handle_leave) or cannot be reached: stop
+        # linking to them. The addresses of the peers lost along with a link
+        # of this peer are kept, to link to them again
+        for uid in uids:
+            Peer.addresses.pop(uid, None)
+
+    @staticmethod
+    def next_hop_limit(hop_limit: int) -> int:
+        # Hop limit left after crossing one more link (0 = unset by the sender)
+        return (hop_limit or Peer.max_hops) - 1
+
+    @staticmethod
+    def drop_message(msg: Message) -> None:
+        # Drop a message that exceeded its hop limit, most likely due to a loop
+        Peer.counters["dropped_hop_limit"] += 1
+        Peer.logger.warning(
+            f"[Routing] Dropping message from {msg.fr} to {msg.to}: hop limit exceeded"
+        )
+        if not Peer.notify_drops or msg.fr == Peer.id():
+            return
+        und = Undeliverable(fr=Peer.id(), to=msg.fr, dest=msg.to, hop_limit=Peer.max_hops)
+        Peer.route_message(
+            msg.fr,
+            PeerMessage(type=PeerMessageType.UNDELIVERABLE, undeliverable=und),
+            buffer=False,
+        )
+
+    @staticmethod
+    def acknowledge(msg: Message) -> bool:
+        # Send back the acknowledgement of a message, returns False on duplicates
+        fresh, ack = Peer.deliveries.on_message(msg)
+        ack.hop_limit = Peer.max_hops
+        Peer.route_message(
+            msg.fr, PeerMessage(type=PeerMessageType.ACK, ack=ack), buffer=False
+        )
+        return fresh
+
+    @staticmethod
+    def route_message(uid: int, message: PeerMessage, buffer: bool = True) -> bool:
+        # Returns True if the message was sent, False if it was buffered (or dropped)
+        try:
+            # If we don't know how to reach the target, save it locally
+            if uid not in Peer.routing_table:
+                raise NoRouteError()
+            Peer.logger.debug(
+                f"[OUTBOX] Forwarding message to {uid} via {Peer.routing_table[uid]}"
+            )
+            # Find route to the peer and forward the message
+            send(Peer.find_route(uid), message)
+            return True
+        except (NoRouteError, OSError):
+            # OSError: the link is closing, its worker drops the route
+            if not buffer:
+                Peer.logger.debug(f"[Routing] No route to {uid}. Dropping message...")
+                return False
+            Peer.logger.error(f"[Routing] No route to {uid}. Saving message for later...")
+            Peer.buffer_message(uid, message)
+            return False
+
+    @staticmethod
+    def route_multicast(message: PeerMessage) -> int:
+        # Split the recipients by next hop and send one copy per link.
+        # Returns the number of links the message was forwarded to
+        mc = message.multicast
+        batches = dict[socket.socket, list[int]]()
+        for uid in dict.fromkeys(mc.to):
+            if uid == Peer.id():
+                Peer.logger.debug(f"[INBOX] Received new multicast from {mc.fr}")
+                Peer.deliver(Message(fr=mc.fr, to=uid, msg=mc.msg, group=mc.group))
+                continue
+            try:
+                if uid not in Peer.routing_table:
+                    raise NoRouteError()
+                batches.setdefault(Peer.find_route(uid), []).append(uid)
+            except NoRouteError:
+                Peer.logger.error(f"[Routing] No route to {uid}. Saving message for later...")
+                copy = Message(
+                    fr=mc.fr, to=uid, msg=mc.msg, group=mc.group, hop_limit=mc.hop_limit
+                )
+                Peer.buffer_message(
+                    uid, PeerMessage(type=PeerMessageType.MESSAGE, message=copy)
+                )
+
+        # Do not forward further a multicast that exceeded its hop limit
+        if batches and mc.hop_limit <= 0:
+            for ids in batches.values():
+                for uid in ids:
+                    Peer.drop_message(Message(fr=mc.fr, to=uid))
+            return 0
+
+        for conn, ids in batches.items():
+            Peer.logger.debug(f"[OUTBOX] Forwarding multicast to {ids}")
+            subset = Multicast(
+                fr=mc.fr, to=ids, msg=mc.msg, group=mc.group, hop_limit=mc.hop_limit
+            )
+            send(conn, PeerMessage(type=PeerMessageType.MULTICAST, multicast=subset))
+        return len(batches)
+
+    @staticmethod
+    def deliver(msg: Message) -> None:
+        # Record the message, then hand it over to every registered listener
+        Peer.inbox.add(msg)
+        for listener in list(Peer.listeners):
+            try:
+                listener(msg)
+            except Exception as e:
+                Peer.logger.error(f"[INBOX] Listener failed on message from {msg.fr}")
+                Peer.logger.exception(e)
+
+    @staticmethod
+    def buffer_message(uid: int, message: PeerMessage) -> None:
+        if uid not in Peer.buffer:
+            Peer.buffer[uid] = []
+        Peer.buffer[uid].append(message)
+
+    @staticmethod
+    def flush_buffer(uid: int, conn: socket.socket) -> None:
+        # Send the messages buffered for a peer through the given link, e.g.
+        # when it becomes a neighbor, whichever end opened the link
+        messages = Peer.buffer.pop(uid, None)
+        if messages:
+            Peer.logger.debug(f"[OUTBOX] Sending {len(messages)} buffered messages to {uid}")
+            send_many(conn, messages)
+
     @staticmethod
     def id() -> Optional[int]:
         return Peer._ID
@@ -160,12 +538,27 @@ class Peer:
     def set_random_id() -> None:
         Peer._ID = derive_id(randint(0, 2**32))
 
+    @staticmethod
+    def start_capture(path: str) -> None:
+        # Record the frames of this peer from now on: in the current context,
+        # the threads started from it, and the next ones bound to the peer
+        Peer.stop_capture()
+        Peer.capture = CaptureWriter(path, Peer.id())
+        current_capture.set(Peer.capture)
+
+    @staticmethod
+    def stop_capture() -> None:
+        # Threads still holding the capture record nothing once it is closed
+        capture, Peer.capture = Peer.capture, None
+        current_capture.set(None)
+        if capture is not None:
+            capture.close()
+
     @staticmethod
     def join(ip: str, port: int) -> tuple[int, socket.socket]:
-        # Connect to the peer using a socket
-        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Connect to the peer using the transport of this peer
         try:
-            conn.connect((ip, port))
+            conn = Peer.transport.connect((ip, port))
         except ConnectionRefusedError:
             raise ConnectionError("Connection refused by peer")
 
@@ -179,6 +572,31 @@ class Peer:
         # Return the peer and its connection
         return (peer_id, conn)
 
+    @staticmethod
+    def prevails(uid: int, outbound: bool) -> bool:
+        # Whether a new link to the peer replaces the one already there: the
+        # link opened by the smaller ID is kept, on both ends
+        return (Peer.id() < uid) == outbound
+
+    @staticmethod
+    def link(
+        uid: int, conn: socket.socket, outbound: bool
+    ) -> tuple[bool, Optional[socket.socket]]:
+        # Record a link to a neighbor, opened by this peer (outbound) or by
+        # the neighbor. Both peers may dial each other at once, or the same
+        # peer be behind two addresses: checked and recorded at once, so that
+        # both paths agree. Returns whether the link was kept, and the link it
+        # replaced if any (to close)
+        return Peer.routing_table.add_link(uid, conn, Peer.prevails(uid, outbound))
+
+    @staticmethod
+    def is_neighbor(uid: int) -> bool:
+        # Whether the peer is directly connected to this one
+        try:
+            return Peer.routing_table[uid][0] is not None
+        except KeyError:
+            return False
+
     @staticmethod
     def find_route(uid: int) -> socket.socket:
         if uid in Peer.routing_table:
@@ -193,6 +611,9 @@ class Peer:
                     if not via:
                         break
                     _max_hops -= 1
+                    # The relay may have left since the route was learned
+                    if via not in Peer.routing_table:
+                        raise NoRouteError()
                     conn, via = Peer.routing_table[via]
                 # Check if a connection was found or if the max hops was reached
                 if _max_hops == 0 or conn is None:
@@ -0,0 +1,163 @@
+import contextvars
+import os
+import time
+from threading import Lock, Thread
+from typing import Optional
+
+from google.protobuf.message import DecodeError
+
+from gen.proto.communication_pb2 import (
+    BufferedMessages,
+    KnownPeer,
+    PeerCache,
+    Route,
+)
+from modules.lib.peer import Peer
+from modules.lib.transport import Address
+
+
+class StateFile:
+    """
+    On-disk snapshot of a peer, to restart warm.
+
+    Holds the ID of the peer, the listening addresses of the peers it knows,
+    its routing table and its buffered messages (a `PeerCache` message). The
+    snapshot is taken every `interval` seconds by a background thread and only
+    written when it changed, to a temporary file renamed over the previous one:
+    a crash never leaves a partial file behind.
+
+    Parameters:
+        - path (str): File holding the snapshot.
+        - interval (float): Seconds between two snapshots.
+    """
+
+    INTERVAL = 5.0
+
+    def __init__(self, path: str, interval: float = INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._saved = b""
+        self._thread: Optional[Thread] = None
+        # The last snapshot, taken on stop, may race the background one: both
+        # write the same temporary file
+        self._lock = Lock()
+
+    def load(self) -> Optional[PeerCache]:
+        # The previous snapshot, None if there is none or it can't be read
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            Peer.logger.error(f"[State] Cannot read {self.path}: {e}")
+            return None
+        cache = PeerCache()
+        try:
+            cache.ParseFromString(data)
+        except DecodeError as e:
+            Peer.logger.error(f"[State] Ignoring the corrupted state file {self.path}: {e}")
+            return None
+        self._saved = data
+        return cache
+
+    def snapshot(self) -> PeerCache:
+        # Copies are taken first: the workers keep updating the tables meanwhile
+        # (the routing table is copied under its lock)
+        routes = list(Peer.routing_table)
+        buffer = list(Peer.buffer.items())
+        addresses = list(Peer.addresses.items())
+        return PeerCache(
+            id=Peer.id(),
+            peers=[KnownPeer(id=uid, host=host, port=port) for uid, (host, port) in addresses],
+            routes=[
+                Route(id=uid, via_id=via or 0, hops=Peer.routing_table.hops(uid))
+                for uid, (_, via) in routes
+            ],
+            buffered=[BufferedMessages(to=uid, messages=list(msgs)) for uid, msgs in buffer if msgs],
+        )
+
+    def save(self) -> bool:
+        # Write the current snapshot if it changed. Returns whether it was written
+        with self._lock:
+            return self._save()
+
+    def _save(self) -> bool:
+        cache = self.snapshot()
+        data = cache.SerializeToString()
+        if data == self._saved:
+            return False
+        cache.saved_at = int(time.time())
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "wb") as file:
+                file.write(cache.SerializeToString())
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            Peer.logger.error(f"[State] Cannot write {self.path}: {e}")
+            return False
+        self._saved = data
+        return True
+
+    def start(self) -> None:
+        # Snapshot the peer bound to the caller until it exits
+        self._thread = Thread(
+            target=contextvars.copy_context().run,
+            args=(self._run,),
+            name="StateWriter",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not Peer.EXIT_EVENT.wait(self.interval):
+            self.save()
+
+
+def known_addresses(cache: PeerCache) -> list[tuple[int, Address]]:
+    return [(peer.id, (peer.host, peer.port)) for peer in cache.peers]
+
+
+def former_neighbors(cache: PeerCache) -> list[tuple[int, Address]]:
+    # Addresses of the peers linked when the snapshot was taken (their routes
+    # have no via), in the order of the routing table
+    addresses = dict(known_addresses(cache))
+    return [
+        (route.id, addresses[route.id])
+        for route in cache.routes
+        if not route.via_id and route.id in addresses
+    ]
+
+
+def restore(cache: PeerCache) -> int:
+    """
+    Load the routes and the buffered messages of a snapshot into the bound peer.
+
+    Only the routes leading to a neighbor connected again are restored; the
+    others are learned from the announcements as usual. Returns the number of
+    routes restored.
+    """
+    for peer in cache.peers:
+        Peer.addresses.setdefault(peer.id, (peer.host, peer.port))
+    for buffered in cache.buffered:
+        Peer.buffer.setdefault(buffered.to, []).extend(buffered.messages)
+
+    # Add the routes whose via is already known, until none can be added
+    pending = [r for r in cache.routes if r.via_id and r.id != Peer.id()]
+    restored = 0
+    while pending:
+        left = []
+        for route in pending:
+            if route.id in Peer.routing_table:
+                continue
+            if route.via_id in Peer.routing_table:
+                Peer.routing_table.add_remote_peer(route.id, route.via_id, route.hops)
+                restored += 1
+            else:
+                left.append(route)
+        if len(left) == len(pending):
+            break
+        pending = left
+    return restored
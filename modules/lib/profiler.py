@@ -0,0 +1,181 @@
+import cProfile
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from modules.lib.transport import WakeupEvent
+
+
+class Profiler:
+    """
+    Runtime-toggled profiler for a live peer.
+
+    Combines two views of the process:
+        - cProfile, enabled by the worker threads themselves the next time they
+          call `checkpoint()` (before Python 3.12 a profiler only sees the thread
+          that enabled it).
+        - A lightweight stack sampler covering every thread, including the ones
+          blocked in `accept()` or `input()`, written in the folded format used
+          by flame graph tools.
+
+    Per-thread CPU time is measured between `start()` and `stop()`. The
+    `started` event is set meanwhile: idle workers wait on it along with their
+    connection, so that they start profiling at once rather than on their next
+    message.
+    """
+
+    # Seconds to wait for the workers to hand back their cProfile data
+    COLLECT_TIMEOUT = 2.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._active = False
+        self._session = 0
+        self._pending = 0
+        self._profiles = list[cProfile.Profile]()
+        self._stacks = Counter[str]()
+        self._cpu_start = dict[int, float]()
+        self._started_at = 0.0
+        self._sampler: Optional[threading.Thread] = None
+        self._sampler_stop = threading.Event()
+        self.started = WakeupEvent()
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def start(self, interval: float = 0.005) -> list[str]:
+        with self._lock:
+            if self._active:
+                return ["Profiler is already running"]
+            self._session += 1
+            self._pending = 0
+            self._profiles.clear()
+            self._stacks.clear()
+            self._cpu_start = {
+                t.ident: cpu
+                for t in threading.enumerate()
+                if t.ident is not None and (cpu := _thread_cpu_time(t.ident)) is not None
+            }
+            self._started_at = time.perf_counter()
+            self._active = True
+        # Wake the idle workers up to enable their profilers
+        self.started.set()
+
+        # Start sampling the stacks of all threads
+        self._sampler_stop.clear()
+        self._sampler = threading.Thread(
+            target=self._sample, args=(interval,), name="ProfilerSampler", daemon=True
+        )
+        self._sampler.start()
+        return [f"Profiler started (sampling every {interval * 1000:.0f}ms)"]
+
+    def stop(self, path: str) -> list[str]:
+        with self._lock:
+            if not self._active:
+                return ["Profiler is not running"]
+            self._active = False
+            self.started.clear()
+        elapsed = time.perf_counter() - self._started_at
+
+        # Stop the sampler and wait for the workers to detach their profilers
+        # (the calling thread may be a worker itself, e.g. an IPC client)
+        self.detach()
+        self._sampler_stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        deadline = time.monotonic() + self.COLLECT_TIMEOUT
+        while self._pending > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        lines = [f"Profiled {elapsed:.2f}s"]
+        with self._lock:
+            profiles = list(self._profiles)
+            stacks = self._stacks.copy()
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+            lines.append(f"cProfile data of {len(profiles)} threads written to {path}")
+        else:
+            lines.append("No worker thread was profiled")
+        with open(f"{path}.stacks", "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        lines.append(f"Sampled stacks written to {path}.stacks")
+
+        # Report the CPU time spent by each thread while profiling
+        lines.append("CPU time per thread:")
+        for thread in threading.enumerate():
+            if thread.ident is None:
+                continue
+            cpu = _thread_cpu_time(thread.ident)
+            if cpu is None:
+                continue
+            used = cpu - self._cpu_start.get(thread.ident, 0.0)
+            lines.append(f"  {thread.name}: {used * 1000:.1f}ms")
+        return lines
+
+    def checkpoint(self) -> None:
+        # Called by worker threads once per loop iteration
+        profile = getattr(self._local, "profile", None)
+        if profile is not None and (
+            not self._active or self._local.session != self._session
+        ):
+            self.detach()
+            profile = None
+        if profile is None and self._active:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Since Python 3.12 cProfile is process-wide: another worker's
+                # profiler is already recording this thread as well
+                return
+            with self._lock:
+                self._local.session = self._session
+                self._pending += 1
+            self._local.profile = profile
+
+    def detach(self) -> None:
+        # Hand back the profile of the calling thread (also called on thread exit)
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            return
+        profile.disable()
+        self._local.profile = None
+        with self._lock:
+            if self._local.session == self._session:
+                self._profiles.append(profile)
+                self._pending -= 1
+
+    def _sample(self, interval: float) -> None:
+        me = threading.get_ident()
+        while not self._sampler_stop.wait(interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            samples = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                samples.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(samples)
+
+
+def _thread_cpu_time(ident: int) -> Optional[float]:
+    # Per-thread CPU clocks are only available on POSIX systems
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
@@ -0,0 +1,145 @@
+import time
+from collections import Counter, OrderedDict
+from enum import Enum
+from threading import Lock
+from typing import Optional
+
+
+class ThrottlePolicy(Enum):
+    DROP = "drop"  # Frames over the limit are discarded
+    DELAY = "delay"  # The worker waits for a token, which stops reading the link
+
+
+class TokenBucket:
+    """
+    Allows `rate` events per second on average, with bursts of `burst` events.
+
+    The bucket refills continuously; an event takes one token. A delayed event
+    takes its token before waiting, so the balance may go negative and the
+    next events wait for the tokens already promised instead of the same one.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self) -> float:
+        # Seconds until a token is available (0 if there is one now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    Token-bucket limits on the messages relayed for each neighbor and for each
+    originating peer.
+
+    The limits are checked by the workers right after reading a frame, before
+    it is parsed (on fast-path links) or routed. A frame is admitted only if
+    both the bucket of the neighbor that sent it and the bucket of its `fr`
+    peer have a token. Otherwise it is dropped, or with `ThrottlePolicy.DELAY`
+    the worker waits for the tokens: it stops reading that link meanwhile, so
+    TCP flow control pushes back on the neighbor. Waits longer than
+    `MAX_DELAY` are dropped anyway.
+
+    Parameters:
+        - neighbor_rate (float): Messages per second per neighbor, 0 disables.
+        - origin_rate (float): Messages per second per sender, 0 disables.
+        - burst (float): Bucket size, one second of traffic if 0.
+        - policy (ThrottlePolicy): What to do with the frames over the limit.
+    """
+
+    MAX_DELAY = 1.0
+    # Sender buckets kept at once, the least recently used ones are forgotten
+    MAX_ORIGINS = 4096
+
+    def __init__(
+        self,
+        neighbor_rate: float = 0.0,
+        origin_rate: float = 0.0,
+        burst: float = 0.0,
+        policy: ThrottlePolicy = ThrottlePolicy.DROP,
+    ):
+        self.neighbor_rate = neighbor_rate
+        self.origin_rate = origin_rate
+        self.burst = burst
+        self.policy = policy
+        # Throttled frames per neighbor and per sender
+        self.dropped = Counter[tuple[str, int]]()
+        self.delayed = Counter[tuple[str, int]]()
+        self._neighbors = dict[int, TokenBucket]()
+        self._origins = OrderedDict[int, TokenBucket]()
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.neighbor_rate > 0 or self.origin_rate > 0
+
+    def _bucket(self, buckets: dict, key: int, rate: float, now: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, self.burst or max(rate, 1), now)
+        else:
+            bucket.refill(now)
+        return bucket
+
+    def acquire(self, neighbor: int, origin: Optional[int]) -> Optional[float]:
+        """
+        Take a token for a frame received from `neighbor` and sent by `origin`.
+
+        Returns the number of seconds to wait before handling the frame (0 if
+        it can be handled now), or None if it must be dropped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = list[tuple[str, int, TokenBucket]]()
+            if self.neighbor_rate > 0:
+                bucket = self._bucket(self._neighbors, neighbor, self.neighbor_rate, now)
+                buckets.append(("neighbor", neighbor, bucket))
+            if self.origin_rate > 0 and origin:
+                bucket = self._bucket(self._origins, origin, self.origin_rate, now)
+                self._origins.move_to_end(origin)
+                if len(self._origins) > self.MAX_ORIGINS:
+                    self._origins.popitem(last=False)
+                buckets.append(("origin", origin, bucket))
+
+            wait = max((bucket.wait_time() for *_, bucket in buckets), default=0.0)
+            if wait > 0 and (self.policy == ThrottlePolicy.DROP or wait > self.MAX_DELAY):
+                # Only the buckets that were empty are charged for the drop
+                for kind, key, bucket in buckets:
+                    if bucket.wait_time() > 0:
+                        self.dropped[kind, key] += 1
+                return None
+            for kind, key, bucket in buckets:
+                if wait > 0 and bucket.wait_time() > 0:
+                    self.delayed[kind, key] += 1
+                bucket.take()
+            return wait
+
+    def report(self) -> list[str]:
+        with self._lock:
+            if not self.enabled:
+                return ["  - Rate limiting is disabled"]
+            lines = [
+                f"  Neighbor: {self.neighbor_rate or 'unlimited'}/s, "
+                f"sender: {self.origin_rate or 'unlimited'}/s, policy: {self.policy.value}"
+            ]
+            keys = sorted(set(self.dropped) | set(self.delayed))
+            if not keys:
+                return [*lines, "  - No message throttled"]
+            lines.append("Limit | Peer | Dropped | Delayed")
+            for kind, key in keys:
+                lines.append(
+                    f"{kind} | {key} | {self.dropped[kind, key]} | {self.delayed[kind, key]}"
+                )
+            return lines
@@ -0,0 +1,78 @@
+import queue
+import sys
+from threading import Thread
+from typing import Optional, TextIO
+
+from gen.proto.communication_pb2 import Message
+from modules.lib.inbox import format_message
+
+try:
+    import readline
+except ImportError:  # Not available on every platform
+    readline = None
+
+
+class ConsoleRenderer:
+    """
+    Prints the inbound messages from a single thread.
+
+    Worker threads only enqueue the messages (`show()` never blocks); the
+    renderer writes everything queued meanwhile at once, up to `BATCH` lines,
+    so a burst costs a few writes instead of one per message. On a terminal
+    the pending prompt is erased before the batch and drawn again after it,
+    with what the user has typed so far.
+
+    Parameters:
+        - prompt (str): Prompt of the console, None if there is none.
+        - stream (TextIO): Where to write, stdout if omitted.
+    """
+
+    BATCH = 512
+    # Messages queued before they are dropped, when the console can't keep up
+    # (counted in `dropped`, reported by the 'inbox' command)
+    MAX_PENDING = 65536
+
+    def __init__(self, prompt: Optional[str] = None, stream: Optional[TextIO] = None):
+        self.prompt = prompt
+        self.dropped = 0
+        self._stream = stream or sys.stdout
+        self._queue = queue.Queue[Optional[Message]](maxsize=self.MAX_PENDING)
+        self._thread = Thread(target=self._run, name="ConsoleRenderer", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Print what is still queued, then exit
+        self._queue.put(None)
+        self._thread.join()
+
+    def show(self, msg: Message) -> None:
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        interactive = self.prompt is not None and self._stream.isatty()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Stop at the sentinel, whatever was queued after it
+            done = None in batch
+            if done:
+                batch = batch[: batch.index(None)]
+            lines = [format_message(msg) + "\n" for msg in batch]
+            if lines:
+                if interactive:
+                    # Erase the prompt line, then draw it again below the messages
+                    typed = readline.get_line_buffer() if readline else ""
+                    lines = ["\r\x1b[K", *lines, f"{self.prompt}{typed}"]
+                self._stream.write("".join(lines))
+                self._stream.flush()
+            if done:
+                return
@@ -1,10 +1,17 @@
+import os
 import socket
+import stat
 from abc import ABC, abstractmethod
 from threading import Thread
 from typing import Generic, Type, TypeVar
 
 from modules.lib.peer import Peer
-from modules.model.workers import Address, PeerServerWorker, ServerAccessWorker
+from modules.model.workers import (
+    Address,
+    IPCClientWorker,
+    PeerServerWorker,
+    ServerAccessWorker,
+)
 
 
 class Server(ABC):
@@ -32,12 +39,18 @@ class Server(ABC):
             raise ConnectionError("Server is already connected")
 
         # Open socket connection
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.bind((self._host, self._port))
+        self._socket = self._bind()
 
         # Set connected flag
         self._connected = True
 
+    def _bind(self) -> socket.socket:
+        return Peer.transport.listen((self._host, self._port))
+
+    @property
+    def address(self) -> str:
+        return f"{self._host}:{self._port}"
+
     @abstractmethod
     def start(self) -> None:
         pass
@@ -91,7 +104,7 @@ class ThreadedServer(Server):
         # Connect to the server
         super()._connect()
 
-        Peer.logger.info(f"[Server] Starting listener at {self._host}:{self._port}...")
+        Peer.logger.info(f"[Server] Starting listener at {self.address}...")
 
         # Ensure binding is successful
         assert self._socket is not None
@@ -107,6 +120,10 @@ class ThreadedServer(Server):
         if not self._connected:
             raise ConnectionError("Server is not connected")
 
+        # The listener leaves on the exit event: wait for it, a connection
+        # accepted meanwhile would add a worker not started yet
+        if self._listener is not None:
+            self._listener.join()
         # Stop all workers
         for worker in self._workers:
             worker.stop()
@@ -141,3 +158,49 @@ class PeerServer(ThreadedServer, Generic[T]):
     # Create a new worker to handle the connection
     def create_worker(self, conn: socket.socket, addr: tuple[str, int]) -> Thread:
         return self.worker_cls(conn, addr)
+
+
+# Local gateway for applications running on the same host. Speaks the same
+# length-prefixed PeerMessage framing as the peer connections over a Unix socket
+class IPCGateway(ThreadedServer):
+    def __init__(self, path: str, max_connections: int = 64):
+        super().__init__(path, 0, max_connections)
+        self._path = path
+
+    @property
+    def address(self) -> str:
+        return self._path
+
+    def _bind(self) -> socket.socket:
+        # Remove a stale socket file left behind by a previous run
+        try:
+            if stat.S_ISSOCK(os.stat(self._path).st_mode):
+                os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.bind(self._path)
+        return conn
+
+    def serve(self, conn: socket.socket, addr: Address):
+        # Unix socket clients have no address: skip the TCP address checks
+        self._workers = [w for w in self._workers if w.is_alive()]
+        if len(self._workers) >= self._max_connections:
+            conn.close()
+            Peer.logger.warning(
+                "[IPCGateway] Connection limit reached. Cannot serve more clients."
+            )
+            return
+        worker = self.create_worker(conn, (self._path, 0))
+        self._workers.append(worker)
+        worker.start()
+
+    def create_worker(self, conn: socket.socket, addr: Address) -> Thread:
+        return IPCClientWorker(conn, addr)
+
+    def stop(self):
+        super().stop()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
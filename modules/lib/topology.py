@@ -0,0 +1,132 @@
+import contextvars
+import random
+import socket
+from threading import Thread
+from typing import Callable, Optional
+
+from modules.lib.peer import Peer
+from modules.lib.transport import Address
+
+
+class TopologyManager:
+    """
+    Keeps a peer linked to a target number of neighbors.
+
+    Left alone, the mesh takes the shape of the seeds given on the command
+    line: chains of peers each joined to the previous one, with long relay
+    paths and a cut at every link. Every `interval` seconds (with jitter) the
+    manager counts the direct neighbors and, below the target, links to a
+    known peer (see `Peer.addresses`) picked at random, weighted by its distance
+    (see `RoutingTable.hops`): links to distant peers shorten the most paths,
+    and a few random ones per peer keep the number of hops between any two
+    peers growing with the logarithm of the size of the mesh. Always picking
+    the most distant one would have every peer of a region link to the same
+    few, which then turn into hubs. The links opened by the other peers count
+    too: only above twice the target is one closed per round, the one
+    carrying the fewest routes, so that hubs shed the load without links
+    being opened and closed in turn. A peer that cannot be reached, or whose
+    link was shed, is left aside for `BACKOFF` rounds; the address of a peer
+    that cannot be reached and has no route is forgotten, as are those of the
+    peers that left (see `Peer.forget_addresses`). Links lost when neighbors
+    leave are replaced in the following rounds.
+
+    Parameters:
+        - degree (int): Neighbors to keep, 0 disables the manager.
+        - connect (Callable[[Address], bool]): Opens a link to a peer (handshake,
+            route and worker) and returns whether it succeeded.
+        - interval (float): Mean seconds between two checks.
+    """
+
+    INTERVAL = 5.0
+    # Links attempted per round, and rounds an unreachable peer is skipped for
+    MAX_ATTEMPTS = 3
+    BACKOFF = 12
+
+    def __init__(
+        self, degree: int, connect: Callable[[Address], bool], interval: float = INTERVAL
+    ):
+        self.degree = degree
+        # Neighbors above which links are closed
+        self.max_degree = 2 * degree
+        self.interval = interval
+        self._connect = connect
+        self._round = 0
+        # Peer ID -> first round it may be linked to again
+        self._failed = dict[int, int]()
+        # Peer ID -> link closed by shed(), until its worker drops the route
+        self._closing = dict[int, socket.socket]()
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        # Check the neighbors of the peer bound to the caller until it exits
+        if self.degree <= 0:
+            return
+        self._thread = Thread(
+            target=contextvars.copy_context().run,
+            args=(self._run,),
+            name="TopologyManager",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not Peer.EXIT_EVENT.wait(self.interval * random.uniform(0.5, 1.5)):
+            self.rebalance()
+
+    def rebalance(self) -> Optional[int]:
+        # Link to one more peer below the target, or close a link above the
+        # maximum. Returns the ID of the peer, if any
+        self._round += 1
+        links = {uid: conn for uid, (conn, _) in Peer.routing_table if conn}
+        # A closed link is only dropped once its worker reads the end of the
+        # stream: not a neighbor anymore, nor one to close again
+        self._closing = {
+            uid: conn for uid, conn in self._closing.items() if links.get(uid) is conn
+        }
+        neighbors = [uid for uid in links if uid not in self._closing]
+        if len(neighbors) > self.max_degree:
+            return self.shed(neighbors)
+        if len(neighbors) >= self.degree:
+            return None
+        for uid in self.candidates()[: self.MAX_ATTEMPTS]:
+            addr = Peer.addresses.get(uid)
+            if addr is None:
+                continue
+            if self._connect(addr):
+                Peer.counters["topology_links"] += 1
+                return uid
+            Peer.counters["topology_failures"] += 1
+            if uid in Peer.routing_table:
+                self._failed[uid] = self._round + self.BACKOFF
+            else:
+                # A former neighbor, most likely gone
+                Peer.forget_addresses([uid])
+        return None
+
+    def shed(self, neighbors: list[int]) -> Optional[int]:
+        # Close the link carrying the fewest routes (ties at random): the
+        # routes through it are the fewest to learn again through others
+        random.shuffle(neighbors)
+        uid = min(neighbors, key=Peer.routing_table.count_through)
+        conn = Peer.close_link(uid)
+        if conn is None:
+            return None
+        self._closing[uid] = conn
+        Peer.counters["topology_shed"] += 1
+        # The peer is likely to be below its own target now: let it link to
+        # another one rather than back to this one
+        self._failed[uid] = self._round + self.BACKOFF
+        return uid
+
+    def candidates(self) -> list[int]:
+        # Known peers not linked to yet, in random order weighted by their
+        # distance (1 if unknown): the distant ones come first more often,
+        # without every peer picking the same ones
+        me = Peer.id()
+        self._failed = {uid: end for uid, end in self._failed.items() if end > self._round}
+        keys = {
+            uid: random.random() ** (1 / max(Peer.routing_table.hops(uid), 1))
+            for uid in list(Peer.addresses)
+            if uid != me and not Peer.is_neighbor(uid) and uid not in self._failed
+        }
+        return sorted(keys, key=keys.__getitem__, reverse=True)
@@ -0,0 +1,122 @@
+import random
+import time
+from threading import Lock
+
+from gen.proto.communication_pb2 import (
+    Message,
+    TraceContext,
+)
+
+
+class Histogram:
+    """
+    Latency histogram with power-of-two buckets (in microseconds).
+
+    Bucket `i` counts the samples in [2^(i-1), 2^i), bucket 0 counts the samples
+    below one microsecond (including negative ones caused by clock skew).
+    """
+
+    BUCKETS = 40
+
+    def __init__(self):
+        self.buckets = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        index = min(max(value, 0).bit_length(), self.BUCKETS - 1)
+        self.buckets[index] += 1
+        if self.count == 0:
+            self.min = self.max = value
+        else:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+        self.count += 1
+        self.total += value
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> int:
+        # Upper bound of the bucket holding the p-th percentile
+        if self.count == 0:
+            return 0
+        threshold = p / 100 * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= threshold:
+                return min(1 << index, self.max)
+        return self.max
+
+    def __str__(self) -> str:
+        return (
+            f"n={self.count} min={self.min}us mean={self.mean():.0f}us "
+            f"p50<={self.percentile(50)}us p99<={self.percentile(99)}us max={self.max}us"
+        )
+
+
+class Tracer:
+    """
+    Samples outgoing messages and aggregates hop and end-to-end latencies.
+
+    Each peer handling a sampled message appends its ID and a timestamp to the
+    trace context, so the recipient can compute how long each link of the
+    `via_id` chain took. Timestamps come from the local wall clock of each peer:
+    per-hop values are only as accurate as the clock synchronization between hosts.
+
+    Parameters:
+        - sample_rate (float): Fraction of the outgoing messages that are traced.
+    """
+
+    def __init__(self, sample_rate: float = 0.0):
+        self.sample_rate = sample_rate
+        self._lock = Lock()
+        self.hops = dict[tuple[int, int], Histogram]()
+        self.end_to_end = dict[int, Histogram]()
+
+    @staticmethod
+    def _now() -> int:
+        return time.time_ns() // 1000
+
+    def start(self, msg: Message) -> None:
+        # Called by the sender: costs a single comparison when tracing is off
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        msg.trace.CopyFrom(TraceContext(trace_id=random.getrandbits(63)))
+        msg.trace.hops.add(id=msg.fr, timestamp=self._now())
+
+    def hop(self, msg: Message, uid: int) -> None:
+        # Called by every relay forwarding a traced message
+        msg.trace.hops.add(id=uid, timestamp=self._now())
+
+    def finish(self, msg: Message, uid: int) -> None:
+        # Called by the recipient: aggregate the latencies of the whole path
+        msg.trace.hops.add(id=uid, timestamp=self._now())
+        hops = msg.trace.hops
+        with self._lock:
+            for prev, curr in zip(hops, hops[1:]):
+                key = (prev.id, curr.id)
+                if key not in self.hops:
+                    self.hops[key] = Histogram()
+                self.hops[key].record(curr.timestamp - prev.timestamp)
+            if msg.fr not in self.end_to_end:
+                self.end_to_end[msg.fr] = Histogram()
+            self.end_to_end[msg.fr].record(hops[-1].timestamp - hops[0].timestamp)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.hops.clear()
+            self.end_to_end.clear()
+
+    def report(self) -> list[str]:
+        with self._lock:
+            lines = [f"Sample rate: {self.sample_rate}", "End-to-end (by sender):"]
+            for fr, hist in sorted(self.end_to_end.items()):
+                lines.append(f"  {fr}: {hist}")
+            lines.append("Per hop:")
+            for (fr, to), hist in sorted(self.hops.items()):
+                lines.append(f"  {fr} -> {to}: {hist}")
+        return lines
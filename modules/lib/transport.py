@@ -0,0 +1,396 @@
+import errno
+import os
+import random
+import select
+import socket
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from threading import Condition, Event, Lock
+from typing import Iterable, Optional, Sequence
+from weakref import WeakSet
+
+type Address = tuple[str, int]
+
+
+class WakeupEvent(Event):
+    """
+    Event that can also be waited on along with the connections.
+
+    Once set, its descriptor (a self-pipe) stays readable, so that every thread
+    blocked in `Transport.wait_readable()` wakes up at once. In-memory
+    connections and listeners register themselves to be woken up instead: the
+    pipe is only created the first time `fileno()` is called, by `select()`,
+    and released by `close()`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pipe: Optional[tuple[int, int]] = None
+        self._pipe_lock = Lock()
+        self._closed = False
+        self._watchers = WeakSet()
+        self._watchers_lock = Lock()
+
+    def fileno(self) -> int:
+        with self._pipe_lock:
+            if self._closed:
+                raise ValueError("Wakeup event closed")
+            if self._pipe is None:
+                self._pipe = os.pipe()
+                os.set_blocking(self._pipe[0], False)
+                if self.is_set():
+                    os.write(self._pipe[1], b"\0")
+            return self._pipe[0]
+
+    def watch(self, watcher) -> None:
+        # `watcher.wake()` is called when the event is set
+        with self._watchers_lock:
+            self._watchers.add(watcher)
+
+    def set(self) -> None:
+        if self.is_set():
+            return
+        super().set()
+        with self._pipe_lock:
+            if self._pipe is not None:
+                os.write(self._pipe[1], b"\0")
+        with self._watchers_lock:
+            watchers = list(self._watchers)
+        for watcher in watchers:
+            watcher.wake()
+
+    def clear(self) -> None:
+        super().clear()
+        with self._pipe_lock:
+            if self._pipe is None:
+                return
+            try:
+                while os.read(self._pipe[0], 64):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self) -> None:
+        # Release the pipe; waiting on the event along with connections is no
+        # longer possible afterwards
+        with self._pipe_lock:
+            self._closed = True
+            pipe, self._pipe = self._pipe, None
+        if pipe is not None:
+            os.close(pipe[0])
+            os.close(pipe[1])
+
+
+class Transport(ABC):
+    """
+    Socket operations used by the peers, the server and the workers.
+
+    Connections returned by a transport expose the subset of the `socket.socket`
+    interface used by `modules.lib.network` (sendall, sendmsg, recv, recv_into,
+    shutdown, close), listeners the one used by `ServerAccessWorker` (listen,
+    accept, close).
+    """
+
+    @abstractmethod
+    def connect(self, address: Address) -> socket.socket:
+        pass
+
+    @abstractmethod
+    def listen(self, address: Address) -> socket.socket:
+        pass
+
+    def wait_readable(
+        self,
+        conn: socket.socket,
+        timeout: Optional[float] = None,
+        wakeups: Sequence[WakeupEvent] = (),
+    ) -> bool:
+        # Wait until the connection is readable (True), the timeout expires or
+        # one of the wakeup events is set (False). Also used for the sockets
+        # opened outside of the transport (IPC clients)
+        ready, _, _ = select.select([conn, *wakeups], [], [], timeout)
+        return conn in ready
+
+
+class TcpTransport(Transport):
+    def connect(self, address: Address) -> socket.socket:
+        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        conn.connect(address)
+        return conn
+
+    def listen(self, address: Address) -> socket.socket:
+        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        conn.bind(address)
+        return conn
+
+
+class MemoryConnection:
+    """
+    One end of an in-memory stream connection.
+
+    Every write is delivered to the other end as a single chunk after the
+    latency of the transport, or dropped as a whole with its loss probability.
+    Writes always carry complete frames (see `modules.lib.network`), hence a
+    loss drops frames without breaking the framing of the stream. The first
+    write of each end (the handshake) is never dropped: nothing retries it.
+    """
+
+    def __init__(self, transport: "MemoryTransport", name: str):
+        self._transport = transport
+        self._name = name
+        self._chunks = deque[tuple[float, memoryview]]()
+        self._cond = Condition()
+        self._closed = False
+        self._eof = False
+        # Shut down by either end: writes fail, as on a TCP socket
+        self._shut = False
+        self._writes = 0
+        self.remote: Optional["MemoryConnection"] = None
+
+    def __repr__(self) -> str:
+        return f"<MemoryConnection {self._name}>"
+
+    # Writing side
+
+    def sendall(self, data: bytes) -> None:
+        self._write(bytes(data))
+
+    def sendmsg(self, buffers: Iterable) -> int:
+        data = b"".join(bytes(b) for b in buffers)
+        self._write(data)
+        return len(data)
+
+    def _write(self, data: bytes) -> None:
+        if self._closed:
+            raise OSError(errno.EBADF, "Bad file descriptor")
+        remote = self.remote
+        if remote is None or remote._closed or self._shut:
+            raise BrokenPipeError(errno.EPIPE, "Broken pipe")
+        lossy = self._writes > 0 and remote._writes > 0
+        self._writes += 1
+        if not self._transport.deliver(len(data), lossy):
+            return
+        remote._push(time.monotonic() + self._transport.delay(), data)
+
+    def _push(self, deliver_at: float, data: bytes) -> None:
+        with self._cond:
+            self._chunks.append((deliver_at, memoryview(data)))
+            self._cond.notify_all()
+
+    # Reading side
+
+    def wait_readable(
+        self, timeout: Optional[float], wakeups: Sequence[WakeupEvent] = ()
+    ) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for wakeup in wakeups:
+            wakeup.watch(self)
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise OSError(errno.EBADF, "Bad file descriptor")
+                now = time.monotonic()
+                # The end of the stream is only reported once every chunk
+                # written before it was delivered
+                if self._eof and not self._chunks:
+                    return True
+                if any(wakeup.is_set() for wakeup in wakeups):
+                    return False
+                wait = None if deadline is None else deadline - now
+                if self._chunks:
+                    ready_at = self._chunks[0][0]
+                    if ready_at <= now:
+                        return True
+                    wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                if wait is not None and wait <= 0:
+                    return False
+                self._cond.wait(wait)
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        view = memoryview(buffer).cast("B")
+        size = nbytes or len(view)
+        if not self.wait_readable(None) or not self._chunks:
+            return 0
+        with self._cond:
+            received = 0
+            while self._chunks and received < size:
+                deliver_at, chunk = self._chunks[0]
+                if deliver_at > time.monotonic():
+                    break
+                n = min(size - received, len(chunk))
+                view[received : received + n] = chunk[:n]
+                received += n
+                if n == len(chunk):
+                    self._chunks.popleft()
+                else:
+                    self._chunks[0] = (deliver_at, chunk[n:])
+            return received
+
+    def recv(self, size: int) -> bytes:
+        buffer = bytearray(size)
+        n = self.recv_into(buffer)
+        return bytes(buffer[:n])
+
+    def wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def shutdown(self, how: int) -> None:
+        # Both directions, whatever `how`: each end reads the end of the stream
+        # once the chunks already written are delivered, and can no longer write
+        for end in (self, self.remote):
+            if end is not None:
+                with end._cond:
+                    end._eof = end._shut = True
+                    end._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        remote = self.remote
+        if remote is not None:
+            with remote._cond:
+                remote._eof = True
+                remote._cond.notify_all()
+
+
+class MemoryListener:
+    def __init__(self, transport: "MemoryTransport", address: Address):
+        self._transport = transport
+        self._address = address
+        self._pending = deque[tuple[MemoryConnection, Address]]()
+        self._cond = Condition()
+        self._closed = False
+
+    def __enter__(self) -> "MemoryListener":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def listen(self, backlog: int = 0) -> None:
+        pass
+
+    def push(self, conn: MemoryConnection, addr: Address) -> None:
+        with self._cond:
+            self._pending.append((conn, addr))
+            self._cond.notify_all()
+
+    def wait_readable(
+        self, timeout: Optional[float], wakeups: Sequence[WakeupEvent] = ()
+    ) -> bool:
+        for wakeup in wakeups:
+            wakeup.watch(self)
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._pending
+                or self._closed
+                or any(wakeup.is_set() for wakeup in wakeups),
+                timeout,
+            )
+            return bool(self._pending) or self._closed
+
+    def accept(self) -> tuple[MemoryConnection, Address]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending or self._closed)
+            if self._closed:
+                raise ConnectionAbortedError("Listener closed")
+            return self._pending.popleft()
+
+    def wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._transport.unregister(self._address)
+
+
+class MemoryTransport(Transport):
+    """
+    In-process transport used to simulate large meshes in a single process.
+
+    Parameters:
+        - latency (float): One-way delay of every write, in seconds.
+        - jitter (float): Maximum random delay added to the latency, in seconds.
+        - loss (float): Probability for a write to be dropped.
+        - seed (int): Optional seed making the losses and jitter reproducible.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self._random = random.Random(seed)
+        self._listeners = dict[Address, MemoryListener]()
+        self._lock = Lock()
+        self._next_port = 0
+        # Traffic counters
+        self.writes = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def connect(self, address: Address) -> socket.socket:
+        with self._lock:
+            listener = self._listeners.get(address)
+            self._next_port += 1
+            port = self._next_port
+        if listener is None:
+            raise ConnectionRefusedError(errno.ECONNREFUSED, "Connection refused")
+        # Connections get a unique ephemeral "port", as TCP clients would
+        client = MemoryConnection(self, f"memory:{port} -> {address[0]}:{address[1]}")
+        server = MemoryConnection(self, f"{address[0]}:{address[1]} -> memory:{port}")
+        client.remote, server.remote = server, client
+        listener.push(server, ("memory", port))
+        return client  # type: ignore
+
+    def listen(self, address: Address) -> socket.socket:
+        with self._lock:
+            if address in self._listeners:
+                raise OSError(errno.EADDRINUSE, "Address already in use")
+            listener = self._listeners[address] = MemoryListener(self, address)
+        return listener  # type: ignore
+
+    def unregister(self, address: Address) -> None:
+        with self._lock:
+            self._listeners.pop(address, None)
+
+    def wait_readable(
+        self,
+        conn: socket.socket,
+        timeout: Optional[float] = None,
+        wakeups: Sequence[WakeupEvent] = (),
+    ) -> bool:
+        if isinstance(conn, (MemoryConnection, MemoryListener)):
+            return conn.wait_readable(timeout, wakeups)
+        return super().wait_readable(conn, timeout, wakeups)
+
+    def deliver(self, size: int, lossy: bool = True) -> bool:
+        # Account for a write, returns False if it has to be dropped
+        with self._lock:
+            self.writes += 1
+            self.bytes += size
+            if lossy and self.loss and self._random.random() < self.loss:
+                self.dropped += 1
+                return False
+        return True
+
+    def delay(self) -> float:
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
@@ -1,3 +1,4 @@
+import logging
 from typing import TypedDict
 
 
@@ -11,3 +12,46 @@ class Config(TypedDict):
     local: ServerAddress
     peer: ServerAddress | None
     log_level: int
+    script: str | None
+    ipc: str | None
+    trace_rate: float
+    compact_routing: bool
+    max_hops: int
+    notify_drops: bool
+    rate_limit: float
+    origin_rate_limit: float
+    rate_burst: float
+    throttle_policy: str
+    inbox_log: str | None
+    capture: str | None
+    state_file: str | None
+    repair_interval: float
+    degree: int
+
+
+def in_process_config(uid: int, host: str = "test", **overrides) -> Config:
+    # Settings of a peer run in the same process as others (tests, simulation),
+    # listening on (host, uid) with every optional feature off
+    config = Config(
+        id=uid,
+        local=ServerAddress(ip=host, port=uid),
+        peer=None,
+        log_level=logging.CRITICAL,
+        script=None,
+        ipc=None,
+        trace_rate=0.0,
+        compact_routing=False,
+        max_hops=32,
+        notify_drops=False,
+        rate_limit=0.0,
+        origin_rate_limit=0.0,
+        rate_burst=0.0,
+        throttle_policy="drop",
+        inbox_log=None,
+        capture=None,
+        state_file=None,
+        repair_interval=0.0,
+        degree=0,
+    )
+    config.update(overrides)
+    return config
@@ -6,7 +6,8 @@ from gen.proto.communication_pb2 import (
 
 
 # Lambda to create a new text message
-def make_message(fr: int, to: int, text: str) -> PeerMessage:
+def make_message(fr: int, to: int, text: str, hop_limit: int = 0) -> PeerMessage:
     return PeerMessage(
-        type=PeerMessageType.MESSAGE, message=Message(fr=fr, to=to, msg=text)
+        type=PeerMessageType.MESSAGE,
+        message=Message(fr=fr, to=to, msg=text, hop_limit=hop_limit),
     )
@@ -0,0 +1,43 @@
+from typing import Dict, Iterable
+
+
+class GroupTable:
+    def __init__(self):
+        self.groups: Dict[int, set[int]] = {}
+
+    def add_members(self, group: int, ids: Iterable[int]):
+        if group not in self.groups:
+            self.groups[group] = set()
+        self.groups[group].update(ids)
+
+    def remove_members(self, group: int, ids: Iterable[int]):
+        if group not in self.groups:
+            return
+        self.groups[group].difference_update(ids)
+        # Forget empty groups
+        if not self.groups[group]:
+            del self.groups[group]
+
+    def members(self, group: int) -> set[int]:
+        return set(self.groups.get(group, ()))
+
+    def __contains__(self, group: int):
+        return group in self.groups
+
+    def __iter__(self):
+        return iter(self.groups.items())
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __delitem__(self, group: int):
+        del self.groups[group]
+
+    def __getitem__(self, group: int):
+        return self.groups[group]
+
+    def format_group_table(self) -> list[str]:
+        lines = ["Group | Members"]
+        for group, members in self.groups.items():
+            lines.append(f"{group} | {', '.join(str(m) for m in sorted(members))}")
+        return lines
@@ -0,0 +1,95 @@
+from array import array
+from typing import Dict, Optional
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def mix(uid: int) -> int:
+    # splitmix64 finalizer: spreads the IDs evenly over the buckets and bits
+    z = (uid + _GOLDEN) & _MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    return z ^ (z >> 31)
+
+
+def bucket_of(uid: int, count: int) -> int:
+    return (mix(uid) >> 32) % count
+
+
+def route_hash(uid: int, hops: int) -> int:
+    # Buckets only depend on the IDs: a route getting shorter changes a
+    # single bucket
+    return (mix(uid) + hops * _GOLDEN) & _MASK
+
+
+class RouteHashes:
+    """
+    Bucket hashes of the routes of a routing table, updated along with it.
+
+    The IDs are spread over `BUCKETS` buckets, each summarized by the XOR of
+    the hashes of its IDs and route lengths: XOR being its own inverse, adding
+    or removing a route updates a single bucket. Two sets of buckets are kept:
+    the hashes of every route, and per via ID, of the routes through it. A
+    route through a via ID is hashed twice, with its length and with its
+    length from the via peer (one link less), as the anti-entropy digests
+    compare them. Fewer buckets, a power of two, are read by folding: bucket
+    `i` of `count` is the XOR of the buckets `i`, `i + count`, `i + 2 * count`...
+
+    Not thread-safe: the routing table updates it under its lock.
+    """
+
+    BUCKETS = 256
+
+    def __init__(self):
+        self._all = array("Q", bytes(8 * self.BUCKETS))
+        # Via ID -> [routes, hashes with their lengths, with their lengths from the via peer]
+        self._through: Dict[int, list] = {}
+
+    def add(self, uid: int, via_id: Optional[int], hops: int):
+        self._toggle(uid, via_id, hops, 1)
+
+    def remove(self, uid: int, via_id: Optional[int], hops: int):
+        self._toggle(uid, via_id, hops, -1)
+
+    def _toggle(self, uid: int, via_id: Optional[int], hops: int, delta: int):
+        h = mix(uid)
+        i = (h >> 32) % self.BUCKETS
+        self._all[i] ^= (h + hops * _GOLDEN) & _MASK
+        if not via_id:
+            return
+        through = self._through.get(via_id)
+        if through is None:
+            through = self._through[via_id] = [
+                0,
+                array("Q", bytes(8 * self.BUCKETS)),
+                array("Q", bytes(8 * self.BUCKETS)),
+            ]
+        through[0] += delta
+        through[1][i] ^= (h + hops * _GOLDEN) & _MASK
+        through[2][i] ^= (h + max(hops - 1, 0) * _GOLDEN) & _MASK
+        if not through[0]:
+            del self._through[via_id]
+
+    def count_through(self, via_id: int) -> int:
+        through = self._through.get(via_id)
+        return through[0] if through else 0
+
+    def routes(self, count: int, excluded: Optional[int] = None) -> list[int]:
+        # Every route but the ones through `excluded`, folded into `count` buckets
+        through = self._through.get(excluded) if excluded else None
+        if through is None:
+            return _fold(self._all, count)
+        return _fold((a ^ b for a, b in zip(self._all, through[1])), count)
+
+    def routes_through(self, via_id: int, count: int) -> list[int]:
+        # The routes through the via ID, with their lengths from it
+        through = self._through.get(via_id)
+        return _fold(through[2], count) if through else [0] * count
+
+
+def _fold(hashes, count: int) -> list[int]:
+    buckets = [0] * count
+    for i, h in enumerate(hashes):
+        buckets[i % count] ^= h
+    return buckets
@@ -1,26 +1,187 @@
-from typing import Dict, Optional
+from array import array
+from bisect import bisect_left
+from threading import RLock
+from typing import Dict, Iterator, Optional
 import socket
 
+from modules.model.route_hashes import RouteHashes
+
 
 class RoutingTable:
     _instance = None
+    # Longest route length recorded (the hop limits fit in a byte as well)
+    MAX_HOPS = 255
 
     def __new__(cls, *args, **kwargs):
-        if not cls._instance:
+        # One instance per class (subclasses must not reuse the parent's one)
+        if not cls.__dict__.get("_instance"):
             cls._instance = super(RoutingTable, cls).__new__(cls)
         return cls._instance
 
+    @classmethod
+    def detached(cls):
+        # New table outside of the singleton (e.g. one per simulated peer)
+        table = object.__new__(cls)
+        table.__init__()
+        return table
+
     def __init__(self):
         if not hasattr(self, "routing_table"):
             self.routing_table: Dict[
                 int, tuple[Optional[socket.socket], Optional[int]]
             ] = {}
+            # Reverse index: via ID -> IDs of the entries routed through it
+            self._dependents: Dict[int, set[int]] = {}
+            # Links to cross to reach the remote entries, when known
+            self._hops: Dict[int, int] = {}
+            # Bucket hashes of the routes, for the anti-entropy digests
+            self._hashes = RouteHashes()
+            # Reentrant: offer_route and remove_with_dependents update the
+            # table through the other methods
+            self._lock = RLock()
+
+    def _link(self, id: int, via_id: Optional[int]):
+        if via_id:
+            self._dependents.setdefault(via_id, set()).add(id)
+
+    def _unlink(self, id: int, via_id: Optional[int]):
+        dependents = self._dependents.get(via_id) if via_id else None
+        if dependents is not None:
+            dependents.discard(id)
+            if not dependents:
+                del self._dependents[via_id]
+
+    def _unset(self, id: int):
+        # Unlink the entry of the given ID before it is replaced or removed
+        entry = self.routing_table.get(id)
+        if entry is not None:
+            self._unlink(id, entry[1])
+            self._hashes.remove(id, entry[1], self.hops(id))
 
     def add_local_peer(self, id: int, conn: socket.socket, via_id=None):
-        self.routing_table[id] = (conn, via_id)
+        with self._lock:
+            self._unset(id)
+            self.routing_table[id] = (conn, via_id)
+            self._hops.pop(id, None)
+            self._link(id, via_id)
+            self._hashes.add(id, via_id, 1)
+
+    def add_remote_peer(self, id: int, via_id: int, hops: int = 0):
+        hops = min(hops, self.MAX_HOPS)
+        with self._lock:
+            self._unset(id)
+            self.routing_table[id] = (None, via_id)
+            if hops:
+                self._hops[id] = hops
+            else:
+                self._hops.pop(id, None)
+            self._link(id, via_id)
+            self._hashes.add(id, via_id, hops)
+
+    def hops(self, id: int) -> int:
+        # Links to cross to reach the peer: 1 for local peers, 0 if unknown
+        with self._lock:
+            entry = self.routing_table.get(id)
+            if entry is None:
+                return 0
+            return 1 if entry[0] else self._hops.get(id, 0)
+
+    def offer_route(self, id: int, via_id: int, hops: int = 0) -> bool:
+        """
+        Record a route to a peer learned from the neighbor `via_id`.
+
+        The route replaces the known one only if it is shorter (routes of
+        unknown length, 0, are the longest) or goes through the same neighbor,
+        whose distance to the peer changed; local peers are kept. Switching
+        only to strictly shorter routes keeps the routes from looping. Returns
+        whether the peer is now reached through another neighbor.
+        """
+        with self._lock:
+            try:
+                conn, via = self[id]
+            except KeyError:
+                self.add_remote_peer(id, via_id, hops)
+                return True
+            if conn:
+                return False
+            known = self.hops(id)
+            if via == via_id:
+                if hops != known:
+                    self.add_remote_peer(id, via_id, hops)
+                return False
+            if hops and hops < (known or self.MAX_HOPS + 1):
+                self.add_remote_peer(id, via_id, hops)
+                return True
+            return False
+
+    def dependents(self, via_id: int) -> list[int]:
+        # IDs of the entries routed through the given peer
+        with self._lock:
+            return list(self._dependents.get(via_id, ()))
+
+    def remove_with_dependents(self, id: int) -> list[int]:
+        """
+        Remove a peer and every entry whose via chain goes through it.
+
+        Walks the reverse via index, so the cost is proportional to the number
+        of entries removed. Returns their IDs (unknown IDs are ignored).
+        """
+        removed = []
+        pending = [id]
+        with self._lock:
+            while pending:
+                uid = pending.pop()
+                if uid not in self:
+                    continue
+                pending.extend(self._dependents.pop(uid, ()))
+                del self[uid]
+                removed.append(uid)
+        return removed
+
+    def add_link(
+        self, id: int, conn: socket.socket, replace: bool
+    ) -> tuple[bool, Optional[socket.socket]]:
+        # Record a direct link to a peer, unless one is already recorded and
+        # the new one must not replace it. Returns whether the link was
+        # recorded, and the link it replaced if any (to close)
+        with self._lock:
+            try:
+                previous = self[id][0]
+            except KeyError:
+                previous = None
+            if previous is not None and not replace:
+                return False, None
+            self.add_local_peer(id, conn)
+            return True, previous
 
-    def add_remote_peer(self, id: int, via_id: int):
-        self.routing_table[id] = (None, via_id)
+    def withdraw(self, id: int, via_id: int) -> list[int]:
+        # Remove a route learned from the given neighbor, and the entries
+        # depending on it (see remove_with_dependents). A local peer, or a
+        # route through another neighbor, is kept
+        with self._lock:
+            try:
+                conn, via = self[id]
+            except KeyError:
+                return []
+            if conn is not None or via != via_id:
+                return []
+            return self.remove_with_dependents(id)
+
+    def count_through(self, via_id: int) -> int:
+        # Number of entries routed through the given peer
+        with self._lock:
+            return self._hashes.count_through(via_id)
+
+    def route_hashes(self, count: int, excluded: Optional[int] = None) -> list[int]:
+        # Bucket hashes of the routes but the ones through `excluded` (see RouteHashes)
+        with self._lock:
+            return self._hashes.routes(count, excluded)
+
+    def route_hashes_through(self, via_id: int, count: int) -> list[int]:
+        # Bucket hashes of the routes through the given peer, with their
+        # lengths from it
+        with self._lock:
+            return self._hashes.routes_through(via_id, count)
 
     def get_routing_table(self):
         return self.routing_table
@@ -35,21 +196,230 @@ class RoutingTable:
         return str(self.routing_table)
 
     def __iter__(self):
-        return iter(self.routing_table.items())
+        # Iterate over a snapshot: other threads may update the table meanwhile
+        with self._lock:
+            return iter(list(self.routing_table.items()))
 
     def __len__(self):
         return len(self.routing_table)
 
     def __delitem__(self, id: int):
-        del self.routing_table[id]
+        with self._lock:
+            if id not in self.routing_table:
+                raise KeyError(id)
+            self._unset(id)
+            del self.routing_table[id]
+            self._hops.pop(id, None)
 
     def __getitem__(self, id: int):
         return self.routing_table[id]
 
+    def format_routing_table(self) -> list[str]:
+        lines = ["ID | Peer | Via"]
+        for id, (peer, via) in self:
+            lines.append(f"{id} | {peer} | {via}")
+        return lines
+
     def print_routing_table(self):
         print()
         print("Routing Table:")
-        print("ID | Peer | Via")
-        for id, (peer, via) in self.routing_table.items():
-            print(f"{id} | {peer} | {via}")
+        for line in self.format_routing_table():
+            print(line)
         print()
+
+
+class CompactRoutingTable(RoutingTable):
+    """
+    Memory-lean routing table for very large meshes.
+
+    Same interface as RoutingTable, but entries are stored in parallel columns
+    sorted by peer ID (int64 IDs and via IDs, 0 meaning no via, and a byte for
+    the route length) instead of a dict of tuples. Only the sockets of the
+    local peers, which are few, live in a side dict. Lookups are binary
+    searches; insertions and removals shift the columns, which is a memmove
+    inside the array. The reverse via index used to invalidate routes keeps
+    one sorted int64 array per via ID, searched and shifted the same way.
+    """
+
+    _instance = None
+    # Runs of removed entries deleted in place, above which the columns are
+    # copied once instead
+    MAX_SHIFTS = 16
+
+    def __init__(self):
+        if not hasattr(self, "_ids"):
+            self._ids = array("q")
+            self._vias = array("q")
+            self._hops = array("B")
+            self._local: Dict[int, socket.socket] = {}
+            self._dependents: Dict[int, array] = {}
+            self._hashes = RouteHashes()
+            self._lock = RLock()
+
+    def _link(self, id: int, via_id: Optional[int]):
+        if via_id:
+            dependents = self._dependents.setdefault(via_id, array("q"))
+            dependents.insert(bisect_left(dependents, id), id)
+
+    def _unlink(self, id: int, via_id: Optional[int]):
+        dependents = self._dependents.get(via_id) if via_id else None
+        if dependents is None:
+            return
+        i = bisect_left(dependents, id)
+        if i < len(dependents) and dependents[i] == id:
+            del dependents[i]
+        if not dependents:
+            del self._dependents[via_id]
+
+    def dependents(self, via_id: int) -> list[int]:
+        with self._lock:
+            return self._dependents[via_id].tolist() if via_id in self._dependents else []
+
+    def _find(self, id: int) -> int:
+        # Index of the given ID, or -1 if it is not in the table
+        i = bisect_left(self._ids, id)
+        if i < len(self._ids) and self._ids[i] == id:
+            return i
+        return -1
+
+    def _hops_at(self, i: int) -> int:
+        return 1 if self._ids[i] in self._local else self._hops[i]
+
+    def _set(
+        self,
+        id: int,
+        via_id: Optional[int],
+        hops: int = 0,
+        conn: Optional[socket.socket] = None,
+    ):
+        # The socket of a local peer is set along with its columns: readers
+        # never see one without the other
+        hops = min(hops, self.MAX_HOPS)
+        with self._lock:
+            i = bisect_left(self._ids, id)
+            if i < len(self._ids) and self._ids[i] == id:
+                self._unlink(id, self._vias[i])
+                self._hashes.remove(id, self._vias[i], self._hops_at(i))
+                self._vias[i] = via_id or 0
+                self._hops[i] = hops
+            else:
+                self._ids.insert(i, id)
+                self._vias.insert(i, via_id or 0)
+                self._hops.insert(i, hops)
+            if conn is None:
+                self._local.pop(id, None)
+            else:
+                self._local[id] = conn
+            self._link(id, via_id)
+            self._hashes.add(id, via_id, 1 if conn else hops)
+
+    def add_local_peer(self, id: int, conn: socket.socket, via_id=None):
+        self._set(id, via_id, conn=conn)
+
+    def add_remote_peer(self, id: int, via_id: int, hops: int = 0):
+        self._set(id, via_id, hops)
+
+    def hops(self, id: int) -> int:
+        with self._lock:
+            i = self._find(id)
+            if i < 0:
+                return 0
+            return 1 if id in self._local else self._hops[i]
+
+    def remove_with_dependents(self, id: int) -> list[int]:
+        # Same as RoutingTable, but the entries are removed from the columns
+        # in runs of adjacent indexes, at a cost proportional to their number
+        with self._lock:
+            removed = []
+            indexes = set[int]()
+            pending = [id]
+            while pending:
+                uid = pending.pop()
+                i = self._find(uid)
+                if i < 0 or i in indexes:
+                    continue
+                removed.append(uid)
+                indexes.add(i)
+                pending.extend(self._dependents.pop(uid, ()))
+                self._hashes.remove(uid, self._vias[i], self._hops_at(i))
+            if not removed:
+                return removed
+            # Every other removed entry was routed through a removed one
+            self._unlink(id, self._vias[self._find(id)])
+            self._delete(sorted(indexes))
+            for uid in removed:
+                self._local.pop(uid, None)
+            return removed
+
+    def _delete(self, indexes: list[int]):
+        # Remove the entries at the given sorted indexes from the columns
+        runs = []
+        for i in indexes:
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+        columns = (self._ids, self._vias, self._hops)
+        if len(runs) <= self.MAX_SHIFTS:
+            # Each deletion shifts the tail of the columns (a memmove)
+            for start, stop in reversed(runs):
+                for column in columns:
+                    del column[start:stop]
+            return
+        # Scattered entries: copy the slices kept in between once instead
+        kept = list(
+            zip([0, *(stop for _, stop in runs)], [*(start for start, _ in runs), None])
+        )
+        self._ids, self._vias, self._hops = (
+            array(column.typecode, b"".join(column[start:stop].tobytes() for start, stop in kept))
+            for column in columns
+        )
+
+    def get_routing_table(self):
+        return dict(self)
+
+    def __contains__(self, id: int):
+        return self._find(id) >= 0
+
+    def __str__(self):
+        return str(self.get_routing_table())
+
+    def __repr__(self):
+        return str(self.get_routing_table())
+
+    def __iter__(self) -> Iterator[tuple[int, tuple[Optional[socket.socket], Optional[int]]]]:
+        # Iterate over a snapshot: other threads may update the table meanwhile
+        with self._lock:
+            ids = self._ids[:]
+            vias = self._vias[:]
+            local = dict(self._local)
+        for id, via in zip(ids, vias):
+            yield id, (local.get(id), via or None)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __delitem__(self, id: int):
+        with self._lock:
+            i = self._find(id)
+            if i < 0:
+                raise KeyError(id)
+            self._unlink(id, self._vias[i])
+            self._hashes.remove(id, self._vias[i], self._hops_at(i))
+            del self._ids[i]
+            del self._vias[i]
+            del self._hops[i]
+            self._local.pop(id, None)
+
+    def __getitem__(self, id: int):
+        with self._lock:
+            i = self._find(id)
+            if i < 0:
+                raise KeyError(id)
+            return (self._local.get(id), self._vias[i] or None)
+
+    def format_routing_table(self) -> list[str]:
+        lines = ["ID | Peer | Via"]
+        for id, (peer, via) in self:
+            lines.append(f"{id} | {peer} | {via}")
+        return lines
@@ -1,34 +1,35 @@
-import select
+import contextvars
+import queue
 from abc import abstractmethod
 from socket import socket
 from threading import Thread
 from typing import Callable
 
-from gen.proto.communication_pb2 import (
-    AnnouncementType,
-    Join,
-    Leave,
-    PeerMessage,
-    PeerMessageType,
-    PropagationMessage,
-)
-from modules.lib.network import send
+from gen.proto.communication_pb2 import Message, PeerMessage, PeerMessageType
+from modules.lib.codec import Encoded, encode_join
+from modules.lib.commands import CONTROL_ID, run_command
+from modules.lib.network import Frame, send, send_many
 from modules.lib.peer import Peer
-from modules.model.errors import ClosingConnectionError
+from modules.model.errors import ClosingConnectionError, NoRouteError
 
 type Address = tuple[str, int]
 
 
 class ConnectionWorker(Thread):
     def __init__(self, conn: socket, addr: Address):
-        super().__init__()
+        super().__init__(name=f"{type(self).__name__}-{addr[0]}:{addr[1]}")
         self._conn = conn
         self._addr = addr
         if self._conn is None:
             raise ValueError("You have to pass a valid connection. Found None")
+        # Run on behalf of the peer that created the worker (see Peer.bound)
+        self._context = contextvars.copy_context()
 
-    @abstractmethod
     def run(self) -> None:
+        self._context.run(self.work)
+
+    @abstractmethod
+    def work(self) -> None:
         pass
 
     def stop(self):
@@ -46,16 +47,22 @@ class ServerAccessWorker(ConnectionWorker):
         super().__init__(conn, addr)
         self.serve = serve
 
-    def run(self) -> None:
+    def work(self) -> None:
         with self._conn:
+            Peer.logger.info("[ServerListener] Listening for connections...")
+            self._conn.listen()
             while not Peer.EXIT_EVENT.is_set():
-                # Start listening for connections
-                Peer.logger.info("[ServerListener] Listening for connections...")
-                self._conn.listen()
-                # Accept connections
+                # Sleep until a connection arrives or the peer exits
                 try:
+                    if not Peer.transport.wait_readable(
+                        self._conn, wakeups=(Peer.EXIT_EVENT,)
+                    ):
+                        continue
                     conn, addr = self._conn.accept()
-                except ConnectionAbortedError as e:
+                except (ConnectionAbortedError, OSError, ValueError) as e:
+                    # ValueError: the listening socket has already been closed
+                    if Peer.EXIT_EVENT.is_set():
+                        break
                     Peer.logger.error(
                         f"[ServerListener] Connection aborted: {e}. Quitting..."
                     )
@@ -71,8 +78,14 @@ class ServerAccessWorker(ConnectionWorker):
 
 
 class PeerWorker(ConnectionWorker):
+    # Relayed traffic subject to the rate limits (announcements, acknowledgements
+    # and handshakes are never throttled)
+    THROTTLED_TYPES = (PeerMessageType.MESSAGE, PeerMessageType.MULTICAST)
+
     def __init__(self, conn: socket, addr: Address):
         super().__init__(conn, addr)
+        # ID of the neighbor on the other end, once known
+        self._peer_id: int | None = None
 
     @abstractmethod
     def prepare(self):
@@ -82,22 +95,54 @@ class PeerWorker(ConnectionWorker):
     def closing(self):
         pass
 
+    def handle(self, frame: Frame):
+        Peer.handle_frame(frame, self._peer_id)
+
+    def admit(self, frame: Frame) -> bool:
+        # Enforce the rate limits before parsing (fast path) or routing the frame
+        limiter = Peer.rate_limiter
+        if not limiter.enabled or self._peer_id is None:
+            return True
+        kind = frame.type if frame.type is not None else frame.message.type
+        if kind not in self.THROTTLED_TYPES:
+            return True
+        delay = limiter.acquire(self._peer_id, frame.origin)
+        if delay is None:
+            Peer.counters["throttled_dropped"] += 1
+            return False
+        if delay > 0:
+            # Not reading meanwhile: the neighbor's writes back up through TCP
+            Peer.counters["throttled_delayed"] += 1
+            Peer.EXIT_EVENT.wait(delay)
+        return True
+
     def listen(self):
         # Start listening
         while not Peer.EXIT_EVENT.is_set():
-            # Check for incoming messages every second
             try:
-                ready_sockets, _, _ = select.select(
-                    [self._conn], [], [], 1
-                )  # 1 second timeout
-                if ready_sockets:
-                    msg = Peer.receive_message(self._conn)
-                    if msg is None:
+                # Sleep until a message arrives or the peer exits. While
+                # profiling, wake up every second to hand back the profile
+                # as soon as it stops, otherwise as soon as it starts
+                if Peer.profiler.active:
+                    timeout, wakeups = 1, (Peer.EXIT_EVENT,)
+                else:
+                    timeout, wakeups = None, (Peer.EXIT_EVENT, Peer.profiler.started)
+                readable = Peer.transport.wait_readable(self._conn, timeout, wakeups)
+                # Start or stop profiling this thread if requested
+                Peer.profiler.checkpoint()
+                if readable:
+                    frame = Peer.receive_message(self._conn)
+                    if frame is None:
                         Peer.logger.info("[PeerServerWorker] Connection closed")
                         break
                     # Handle message
-                    Peer.handle_message(msg)
-            except OSError as e:
+                    if self.admit(frame):
+                        self.handle(frame)
+            except (OSError, ValueError) as e:
+                # ValueError: the connection has already been closed
+                if Peer.EXIT_EVENT.is_set():
+                    # Closed by the shutdown while waiting: nothing went wrong
+                    break
                 Peer.logger.error(f"[PeerServerWorker] Error: {e}")
                 raise ClosingConnectionError(
                     f"An error occurred while listening for messages: {e}"
@@ -105,73 +150,69 @@ class PeerWorker(ConnectionWorker):
         # Notify that we are closing the connection
         raise ClosingConnectionError("Closing connection")
 
-    def run(self) -> None:
+    def work(self) -> None:
         try:
             self.prepare()
             self.listen()
         except ClosingConnectionError as e:
             Peer.logger.info(f"[PeerWorker] Closing connection: {e}")
+        except OSError as e:
+            # The link broke before listening, e.g. while sharing the routing
+            # table with a peer that went away meanwhile
+            Peer.logger.warning(f"[PeerWorker] Connection lost: {e}")
         finally:
             Peer.logger.info("[PeerWorker] Stopping worker...")
+            Peer.profiler.detach()
             self.closing()
             self.stop()
 
 
 # Worker that handles the connection with a peer
 class PeerServerWorker(PeerWorker):
-    def __init__(self, conn: socket, addr: Address):
-        super().__init__(conn, addr)
-        self._peer_id: int | None = None
-
     def prepare(self):
         # Handle connection with peer!
         Peer.logger.debug("[PeerServerWorker] Starting worker...")
 
         # Handle handshake with peer
-        uid, status = Peer.handle_handshake(self._conn)
+        uid, status = Peer.handle_handshake(self._conn, self._addr)
         if not status:
             Peer.logger.warning(
                 "[PeerServerWorker] Handshake failed. Closing connection."
             )
             return
-        self._peer_id = uid  # store peer id in global variable to be used later
 
-        # If the handshake was successful, add the peer to the routing table
+        # If the handshake was successful, add the peer to the routing table,
+        # unless our own link to it got there first and wins the tie-break
+        kept, previous = Peer.link(uid, self._conn, outbound=False)
+        if not kept:
+            raise ClosingConnectionError(f"Already linked to {uid}")
+        self._peer_id = uid  # store peer id in global variable to be used later
         Peer.logger.info(f"[PeerServerWorker] Peer {uid} connected successfully")
-        Peer.routing_table.add_local_peer(uid, self._conn)
+        if previous is not None:
+            previous.close()
 
         # If there are some buffered messages, sent them all
-        if uid in Peer.buffer:
-            if len(Peer.buffer[uid]) > 0:
-                for msg in Peer.buffer[uid]:
-                    send(self._conn, msg)
-                Peer.buffer[uid].clear()
+        Peer.flush_buffer(uid, self._conn)
 
-        # Share the routing table with the new peer
+        # Share the routing table with the new peer, except the routes going
+        # through it (it may have been reachable through others before)
         if len(Peer.routing_table) > 1:
             Peer.logger.debug(f"[PeerServerWorker] Sharing routing table with {uid}...")
-            for peer_id, _ in Peer.routing_table:
-                if peer_id != uid:
-                    join_ann = PeerMessage(
-                        type=PeerMessageType.ANNOUNCEMENT,
-                        announcement=PropagationMessage(
-                            type=AnnouncementType.JOIN,
-                            join=Join(id=peer_id, via_id=Peer.id()),
-                        ),
-                    )
-                    send(self._conn, join_ann)
+            send_many(
+                self._conn,
+                [
+                    _join_announcement(peer_id)
+                    for peer_id, _ in Peer.routing_table
+                    if peer_id != uid and not self._routed_through(peer_id)
+                ],
+            )
         else:
             Peer.logger.debug(
                 f"[PeerServerWorker] Routing table is empty. Nothing to share with {uid}"
             )
 
         # Notify all peers that a new peer has joined
-        join_ann = PeerMessage(
-            type=PeerMessageType.ANNOUNCEMENT,
-            announcement=PropagationMessage(
-                type=AnnouncementType.JOIN, join=Join(id=uid, via_id=Peer.id())
-            ),
-        )
+        join_ann = _join_announcement(uid)
 
         if len(Peer.routing_table) > 1:
             Peer.logger.debug(
@@ -189,24 +230,26 @@ class PeerServerWorker(PeerWorker):
                 "[PeerServerWorker] Routing table is empty. Nothing to notify other peers"
             )
 
+    def _routed_through(self, uid: int) -> bool:
+        # Whether the route to a peer starts with the link of this worker
+        try:
+            return Peer.find_route(uid) is self._conn
+        except NoRouteError:
+            return False
+
     def closing(self):
         # Closing connection with peer, if any was established
         if not self._peer_id:
             return
-        # Remove peer from routing table
-        del Peer.routing_table[self._peer_id]
-        # Send leave message to all peers
-        leave_ann = PeerMessage(
-            type=PeerMessageType.ANNOUNCEMENT,
-            announcement=PropagationMessage(
-                type=AnnouncementType.LEAVE, leave=Leave(id=self._peer_id)
-            ),
-        )
-        # Send leave message to all peers
-        for _, (conn, _) in Peer.routing_table:
-            if not conn:
-                continue
-            send(conn, leave_ann)
+        # Remove the peer and the routes through it, then notify the other peers
+        Peer.drop_link(self._peer_id, self._conn)
+
+
+def _join_announcement(uid: int) -> Encoded:
+    # JOIN for a peer reached through this one, with its listening address and
+    # distance if known
+    host, port = Peer.addresses.get(uid, ("", 0))
+    return encode_join(uid, Peer.id(), host, port, Peer.routing_table.hops(uid))
 
 
 # Worker that only receives messages from an already connected peer
@@ -220,5 +263,101 @@ class PeerClientWorker(PeerWorker):
         pass
 
     def closing(self):
-        # Remove peer from routing table when server closes
-        del Peer.routing_table[self._peer_id]
+        # Remove the server and the routes through it when it closes
+        Peer.drop_link(self._peer_id, self._conn)
+
+
+# Worker that serves a local application connected to the IPC gateway
+class IPCClientWorker(PeerWorker):
+    # Inbound messages queued per client before they are dropped
+    MAX_PENDING = 1024
+
+    def __init__(self, conn: socket, addr: Address):
+        super().__init__(conn, addr)
+        self._outbox = queue.Queue[Message | None](maxsize=self.MAX_PENDING)
+        self._writer = Thread(
+            target=self._write_loop, name=f"{self.name}-writer", daemon=True
+        )
+        self.dropped = 0
+
+    def prepare(self):
+        # Subscribe the client to every inbound message
+        Peer.logger.info("[IPCClientWorker] Local client connected")
+        Peer.listeners.append(self._enqueue)
+        self._writer.start()
+
+    def closing(self):
+        Peer.listeners.remove(self._enqueue)
+        # The writer may be gone (the client stopped reading, then left) with
+        # the outbox full: make room for the sentinel instead of waiting
+        while True:
+            try:
+                self._outbox.put_nowait(None)
+                break
+            except queue.Full:
+                self._discard()
+        if self.dropped:
+            Peer.logger.warning(
+                f"[IPCClientWorker] Client was too slow: {self.dropped} messages dropped"
+            )
+
+    def handle(self, frame: Frame):
+        msg = frame.message
+        if msg.type == PeerMessageType.MULTICAST:
+            peerid = Peer.id()
+            assert peerid is not None, "Peer ID is not set"
+            msg.multicast.fr = peerid
+            msg.multicast.hop_limit = msg.multicast.hop_limit or Peer.max_hops
+            Peer.route_multicast(msg)
+            return
+        if msg.type != PeerMessageType.MESSAGE:
+            Peer.logger.warning(
+                f"[IPCClientWorker] Received unsupported message type: {msg.type}"
+            )
+            return
+        peerid = Peer.id()
+        assert peerid is not None, "Peer ID is not set"
+        # Messages addressed to the control ID are commands for this peer
+        if msg.message.to == CONTROL_ID:
+            self._reply(run_command(msg.message.msg.strip()))
+            return
+        # Local clients always send on behalf of this peer
+        msg.message.fr = peerid
+        msg.message.hop_limit = msg.message.hop_limit or Peer.max_hops
+        Peer.tracer.start(msg.message)
+        if msg.message.to == peerid:
+            Peer.deliver(msg.message)
+        else:
+            Peer.route_message(msg.message.to, msg)
+
+    def _reply(self, lines: list[str]):
+        peerid = Peer.id()
+        assert peerid is not None, "Peer ID is not set"
+        self._enqueue(Message(fr=CONTROL_ID, to=peerid, msg="\n".join(lines)))
+
+    def _enqueue(self, msg: Message):
+        # Never block the worker delivering the message on a slow client
+        try:
+            self._outbox.put_nowait(msg)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        while (msg := self._outbox.get()) is not None:
+            try:
+                send(
+                    self._conn,
+                    PeerMessage(type=PeerMessageType.MESSAGE, message=msg),
+                )
+            except OSError:
+                break
+        # Nothing reads the outbox anymore
+        self._discard()
+
+    def _discard(self):
+        # Drop the messages still queued for the client
+        while True:
+            try:
+                self._outbox.get_nowait()
+            except queue.Empty:
+                return
@@ -1,23 +1,28 @@
+import os
+import select
+import sys
 from sys import argv
+from typing import Iterator, Optional
 
 import modules.lib.args as args
-from gen.proto.communication_pb2 import (
-    PeerMessage,
-)
-from modules.lib.input import read_command
-from modules.lib.network import send
+from modules.lib.commands import run_command
+from modules.lib.input import PROMPT, parse_command, read_command
+from modules.lib.node import PeerNode
 from modules.lib.peer import Peer
-from modules.lib.server import PeerServer
+from modules.lib.renderer import ConsoleRenderer
 from modules.model.config import Config
-from modules.model.errors import InvalidMessageError, NoRouteError, ValidationError
-from modules.model.factory import make_message as _make_message
-from modules.model.workers import PeerClientWorker, PeerServerWorker
+from modules.model.errors import InvalidMessageError, ValidationError
 
 # Set global states
 MAX_PEERS = 10
+# Number of consecutive scripted messages coalesced into a single send_many call
+SCRIPT_BATCH_SIZE = 1024
+# Bytes read from the script at once
+SCRIPT_CHUNK_SIZE = 1 << 16
 
 # Initialize some objects
 config: Config | None = None
+renderer: ConsoleRenderer | None = None
 
 
 def validate_args(raw_args: list[str]) -> Config:
@@ -37,8 +42,121 @@ def validate_args(raw_args: list[str]) -> Config:
     return config
 
 
+def handle_command(node: PeerNode, uid: Optional[int], msg: str) -> bool:
+    """Execute a parsed command. Returns False when the client should exit."""
+    if uid is None:
+        # Handling special events
+        if msg == "":
+            pass
+        elif msg == "exit":
+            return False
+        elif msg.startswith("multicast"):
+            # Send a text to all the members of a group
+            parts = msg.split(" ", 2)
+            try:
+                node.send_group(int(parts[1]), parts[2])
+            except (IndexError, ValueError):
+                Peer.logger.error("The format should be 'multicast <group> <message>'.")
+            except InvalidMessageError as e:
+                Peer.logger.error(f"Invalid message: {e}")
+        elif msg.partition(" ")[0] in (
+            "table",
+            "buffer",
+            "trace",
+            "profile",
+            "groups",
+            "group",
+            "stats",
+            "deliveries",
+            "throttle",
+            "inbox",
+            "history",
+        ):
+            for line in run_command(msg):
+                Peer.logger.info(line)
+            if msg == "inbox" and renderer is not None and renderer.dropped:
+                # Still in the inbox, see 'history'
+                Peer.logger.info(
+                    f"  - {renderer.dropped} messages not shown: the console could not keep up"
+                )
+        else:
+            Peer.logger.error("Invalid command. Please try again.")
+    elif uid == Peer.id():
+        Peer.logger.error("You cannot send a message to yourself!")
+    else:
+        Peer.logger.debug(f"[Console] Sending message to {uid} with content: {msg}")
+        node.send(uid, msg)
+    return True
+
+
+def run_console(node: PeerNode) -> None:
+    while not Peer.EXIT_EVENT.is_set():
+        try:
+            uid, msg = read_command()
+        except InvalidMessageError as e:
+            Peer.logger.error(f"Invalid message: {e}")
+            continue
+
+        if not handle_command(node, uid, msg):
+            break
+
+
+def _has_input(fd: int) -> bool:
+    ready, _, _ = select.select([fd], [], [], 0)
+    return bool(ready)
+
+
+def _script_lines(fd: int) -> Iterator[tuple[str, bool]]:
+    # Lines of the script, with whether more input is already at hand. The
+    # buffered streams of Python read ahead lines that select() cannot see,
+    # so the script is read in chunks and split here instead
+    rest = b""
+    while chunk := os.read(fd, SCRIPT_CHUNK_SIZE):
+        *lines, rest = (rest + chunk).split(b"\n")
+        for i, line in enumerate(lines, start=1):
+            yield line.decode("utf-8"), i < len(lines) or _has_input(fd)
+    if rest:
+        yield rest.decode("utf-8"), False
+
+
+def run_script(node: PeerNode, path: str) -> None:
+    stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+    pending = list[tuple[int, str]]()
+
+    def flush():
+        if pending:
+            node.send_many(pending)
+            pending.clear()
+
+    try:
+        lines = _script_lines(stream.fileno())
+        for lineno, (line, more) in enumerate(lines, start=1):
+            if Peer.EXIT_EVENT.is_set():
+                break
+            try:
+                uid, msg = parse_command(line)
+            except InvalidMessageError as e:
+                Peer.logger.error(f"[Script] Line {lineno}: invalid message: {e}")
+                continue
+
+            # Consecutive messages are sent in batches, commands flush the batch
+            if uid is not None and uid != Peer.id():
+                pending.append((uid, msg))
+                # Flush when full or when the producer is slower than us
+                if len(pending) >= SCRIPT_BATCH_SIZE or not more:
+                    flush()
+                continue
+            flush()
+            if not handle_command(node, uid, msg):
+                break
+        flush()
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+
 def main(raw_args: list[str]) -> None:
-    global config, routing_table, buffer
+    global config, renderer
 
     # Validate the program arguments
     config = validate_args(raw_args)
@@ -46,103 +164,33 @@ def main(raw_args: list[str]) -> None:
     # Apply the desired log level
     Peer.logger.setLevel(config["log_level"])
 
-    # If user has set a desired ID, set it. Otherwise, use a random ID
-    if config["id"] is not None:
-        Peer.set_id(config["id"])
-    else:
-        Peer.set_random_id()
-
-    # Override the make_message function to inclide the ID
-    def make_message(uid: int, msg: str) -> PeerMessage:
-        peerid = Peer.id()
-        assert peerid is not None, "Peer ID is not set"
-        return _make_message(peerid, uid, msg)
-
-    # check whether we want to create a new network or
-    # access an existing one using an handshake request
-    if config["peer"] is not None:
-        # Try to connect to the peer
-        try:
-            Peer.logger.info("[Startup] Connecting to the peer...")
-            addr = (config["peer"]["ip"], config["peer"]["port"])
-            uid, conn = Peer.join(addr[0], addr[1])
-
-            # Record the connection inside the routing table
-            Peer.logger.info("[Startup] Connection successful.")
-            Peer.routing_table.add_local_peer(uid, conn)
-
-            # Start a worker thread to handle all incoming messages
-            worker = PeerClientWorker(uid, conn, addr)
-            worker.start()
-        except ConnectionError as e:
-            Peer.logger.error(f"[Startup] Handshake failed: {e}")
-            exit(1)
-
-    else:
-        Peer.logger.info("[Startup] Creating a new network...")
-
-    # Start the server thread
-    server = PeerServer(
-        config["local"]["ip"], config["local"]["port"], PeerServerWorker, MAX_PEERS
-    )
+    # Join the network (or create a new one) and start the server
+    node = PeerNode(config, MAX_PEERS)
     try:
-        server.start()
+        node.start()
+    except ConnectionError as e:
+        Peer.logger.error(f"[Startup] Handshake failed: {e}")
+        exit(1)
     except OSError as e:
         Peer.logger.error(f"[Startup] Error starting server: {e}")
         exit(1)
 
-    # Start the client
-    while not Peer.EXIT_EVENT.is_set():
-        try:
-            uid, msg = read_command()
-        except InvalidMessageError as e:
-            Peer.logger.error(f"Invalid message: {e}")
-            continue
+    # Print inbound messages on the console, from a single thread
+    renderer = ConsoleRenderer(PROMPT if config["script"] is None else None)
+    renderer.start()
+    node.on_message(renderer.show)
 
-        if uid is None:
-            # Handling special events
-            if msg == "":
-                continue
-            elif msg == "table":
-                Peer.logger.info("[Routing Table]")
-                Peer.routing_table.print_routing_table()
-            elif msg == "exit":
-                Peer.EXIT_EVENT.set()
-                break
-            elif msg == "buffer":
-                Peer.logger.info("[Buffer]")
-                if len(Peer.buffer) == 0:
-                    Peer.logger.warning("  - No messages in the buffer")
-                else:
-                    for uid, msgs in Peer.buffer.items():
-                        Peer.logger.info(f"   [{uid}]: {len(msgs)} messages")
-            else:
-                Peer.logger.error("Invalid command. Please try again.")
-                continue
-        elif uid == Peer.id():
-            Peer.logger.error("You cannot send a message to yourself!")
-            continue
-        else:
-            Peer.logger.debug(f"[Console] Sending message to {uid} with content: {msg}")
-            try:
-                # If the UID is known, try to look for a route to it
-                if uid in Peer.routing_table:
-                    send(Peer.find_route(uid), make_message(uid, msg))
-                else:
-                    raise NoRouteError()
-            except NoRouteError:
-                Peer.logger.error(
-                    f"[Routing] No route to {uid}. Saving message for later..."
-                )
-                if uid not in Peer.buffer:
-                    Peer.buffer[uid] = []
-                Peer.buffer[uid].append(make_message(uid, msg))
-                continue
+    # Start the client
+    if config["script"] is not None:
+        run_script(node, config["script"])
+    else:
+        run_console(node)
 
     # Stop the server
     Peer.logger.info("[Shutdown] Exiting the program...")
     # Force the server to stop and close all connections
-    server.stop()
+    node.stop()
+    renderer.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,9 @@
+import pytest
+
+from modules.model.config import in_process_config
+
+
+@pytest.fixture
+def make_config():
+    # Settings of an in-process peer listening on ("test", uid)
+    return in_process_config
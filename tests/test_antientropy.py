@@ -0,0 +1,111 @@
+import random
+import socket
+
+import pytest
+
+from gen.proto.communication_pb2 import PeerMessage
+from modules.lib.antientropy import AntiEntropy
+from modules.lib.codec import Encoded
+from modules.model.route_hashes import bucket_of, route_hash
+from modules.model.routing_table import CompactRoutingTable, RoutingTable
+
+TABLES = [RoutingTable, CompactRoutingTable]
+
+
+def hashes(routes, count):
+    # The bucket hashes of the given (ID, hops) routes, from scratch
+    buckets = [0] * count
+    for uid, hops in routes:
+        buckets[bucket_of(uid, count)] ^= route_hash(uid, hops)
+    return buckets
+
+
+def shuffled_table(cls, seed):
+    # A table updated in every possible way, with routes through neighbors and
+    # through remote peers
+    rnd = random.Random(seed)
+    table = cls.detached()
+    conn = socket.socket()
+    neighbors = rnd.sample(range(1, 1000), 3)
+    for uid in neighbors:
+        table.add_local_peer(uid, conn)
+    ids = rnd.sample(range(1000, 2000), 200)
+    for _ in range(500):
+        uid, action = rnd.choice(ids), rnd.random()
+        if action < 0.5:
+            table.offer_route(uid, rnd.choice(neighbors + ids[:5]), rnd.randrange(5))
+        elif action < 0.6:
+            table.add_remote_peer(uid, rnd.choice(neighbors), rnd.randrange(300))
+        elif action < 0.8:
+            if uid in table:
+                del table[uid]
+        else:
+            table.remove_with_dependents(uid)
+    conn.close()
+    return table, neighbors
+
+
+@pytest.mark.parametrize("cls", TABLES)
+@pytest.mark.parametrize("seed", range(20))
+def test_route_hashes_follow_the_table(cls, seed):
+    table, neighbors = shuffled_table(cls, seed)
+    for neighbor in neighbors:
+        held = [(uid, max(table.hops(uid) - 1, 0)) for uid in table.dependents(neighbor)]
+        others = [
+            (uid, table.hops(uid))
+            for uid, (_, via) in table
+            if uid != neighbor and via != neighbor
+        ]
+        assert table.count_through(neighbor) == len(held)
+        for count in (1, 8, 256):
+            assert table.route_hashes_through(neighbor, count) == hashes(held, count)
+            mine = table.route_hashes(count, excluded=neighbor)
+            mine[bucket_of(neighbor, count)] ^= route_hash(neighbor, 1)
+            assert mine == hashes(others, count)
+
+
+@pytest.mark.parametrize("cls", TABLES)
+def test_route_hashes_are_empty_once_the_routes_are_removed(cls):
+    table, neighbors = shuffled_table(cls, 0)
+    for neighbor in neighbors:
+        table.remove_with_dependents(neighbor)
+    for uid, _ in table:
+        del table[uid]
+    assert table.route_hashes(256) == [0] * 256
+
+
+def last_sent(sent):
+    message = sent.pop()
+    if isinstance(message, Encoded):
+        message = PeerMessage.FromString(message.body)
+    return message
+
+
+def test_digest_of_agreeing_tables_needs_no_repair(monkeypatch):
+    # Peer 1 reaches 3 and 4 through its neighbor 2, which links to 3
+    sent = []
+    monkeypatch.setattr("modules.lib.antientropy._send", lambda conn, message: sent.append(message))
+    a, b = RoutingTable.detached(), RoutingTable.detached()
+    link = socket.socket()
+    a.add_local_peer(2, link)
+    b.add_local_peer(1, link)
+    b.add_local_peer(3, link)
+    b.add_remote_peer(4, 3, 2)
+    a.add_remote_peer(3, 2, 2)
+    a.add_remote_peer(4, 2, 3)
+
+    AntiEntropy().round(a, 1)
+    digest = last_sent(sent).digest
+    assert digest.fr == 1
+    AntiEntropy().on_digest(b, 2, digest)
+    assert not sent
+
+    # A missing route is repaired
+    a.remove_with_dependents(4)
+    AntiEntropy().round(a, 1)
+    AntiEntropy().on_digest(b, 2, last_sent(sent).digest)
+    repair = last_sent(sent).repair
+    assert 4 in repair.ids
+    AntiEntropy().on_repair(a, 1, repair)
+    assert a[4] == (None, 2) and a.hops(4) == 3
+    link.close()
@@ -0,0 +1,53 @@
+import queue
+import time
+
+from benchmarks.replay import replay
+from modules.lib.capture import read_capture
+from modules.lib.node import PeerNode
+from modules.lib.peer import Peer, PeerState
+from modules.lib.transport import MemoryTransport
+from modules.model.config import ServerAddress
+
+
+def test_capture_then_replay(tmp_path, make_config):
+    # Peers 2 and 3 joined hub 1, which relays a message from 2 to 3. The hub
+    # and peer 3 record their own traffic in the same process
+    transport = MemoryTransport()
+    hub = PeerNode(
+        make_config(1, capture=str(tmp_path / "hub.bin")), transport=transport, isolated=True
+    )
+    hub.start()
+    nodes = [hub]
+    try:
+        for uid in (2, 3):
+            config = make_config(uid, peer=ServerAddress(ip="test", port=1))
+            if uid == 3:
+                config["capture"] = str(tmp_path / "peer.bin")
+            nodes.append(PeerNode(config, transport=transport, isolated=True))
+            nodes[-1].start()
+        deadline = time.monotonic() + 5
+        while 3 not in nodes[1].state.routing_table and time.monotonic() < deadline:
+            time.sleep(0.01)
+        received = queue.Queue()
+        nodes[2].on_message(received.put)
+        assert nodes[1].send(3, "through the hub")
+        assert received.get(timeout=5).msg == "through the hub"
+    finally:
+        for node in nodes:
+            node.stop()
+
+    peer_id, records = read_capture(str(tmp_path / "peer.bin"))
+    assert peer_id == 3
+    assert {record.link for record in records} == {1}
+
+    peer_id, records = read_capture(str(tmp_path / "hub.bin"))
+    captured = list(records)
+    assert peer_id == 1
+    assert len({record.link for record in captured}) == 2
+    with Peer.bound(PeerState()):
+        Peer.set_id(1)
+        handled, _ = replay(captured, "max", {})
+        assert handled["MESSAGE"] == 1
+        # Relayed to the link of peer 3 again
+        assert Peer.routing_table[3][0].writes >= 1
+        Peer.deliveries.close()
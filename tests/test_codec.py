@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+from gen.proto.communication_pb2 import (
+    AnnouncementType,
+    Digest,
+    HandshakeResponse,
+    HandshakeStart,
+    Join,
+    Leave,
+    PeerMessage,
+    PeerMessageType,
+    PropagationMessage,
+)
+from modules.lib.codec import (
+    encode_digest,
+    encode_handshake_response,
+    encode_handshake_start,
+    encode_join,
+    encode_leave,
+    varint,
+)
+
+INT64 = (-(1 << 63), -(1 << 31), -1, 0, 1, 127, 128, 16383, 16384, (1 << 31) - 1, (1 << 63) - 1)
+INT32 = (-(1 << 31), -1, 0, 1, 127, 128, 65535, (1 << 31) - 1)
+HOSTS = ("", "127.0.0.1", "::1", "peer.example", "hôte")
+
+
+def int64(rnd: random.Random) -> int:
+    # Edge values half of the time, any size otherwise
+    if rnd.random() < 0.5:
+        return rnd.choice(INT64)
+    return rnd.randrange(-(1 << 63), 1 << 63) >> rnd.randrange(64)
+
+
+def int32(rnd: random.Random) -> int:
+    if rnd.random() < 0.5:
+        return rnd.choice(INT32)
+    return rnd.randrange(-(1 << 31), 1 << 31) >> rnd.randrange(32)
+
+
+def announcement(**fields) -> bytes:
+    return PeerMessage(
+        type=PeerMessageType.ANNOUNCEMENT, announcement=PropagationMessage(**fields)
+    ).SerializeToString()
+
+
+@pytest.mark.parametrize("value", [*INT64, 1 << 35, 1 << 56, 1 << 62])
+def test_varint_matches_protobuf(value):
+    # A Digest holds the varint of `fr` right after its key (none if 0)
+    expected = b"\x08" + varint(value) if value else b""
+    assert Digest(fr=value).SerializeToString() == expected
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_control_messages_match_protobuf(seed):
+    rnd = random.Random(seed)
+    for _ in range(100):
+        uid, via, host = int64(rnd), int64(rnd), rnd.choice(HOSTS)
+        port, hops = int32(rnd), int32(rnd)
+        assert encode_join(uid, via, host, port, hops).body == announcement(
+            type=AnnouncementType.JOIN,
+            join=Join(id=uid, via_id=via, host=host, port=port, hops=hops),
+        )
+
+        ids = [int64(rnd) for _ in range(rnd.randrange(4))]
+        assert encode_leave(uid, ids).body == announcement(
+            type=AnnouncementType.LEAVE, leave=Leave(id=uid, ids=ids)
+        )
+
+        fast_path, error = rnd.random() < 0.5, rnd.random() < 0.5
+        start = HandshakeStart(id=uid, fast_path=fast_path, host=host, port=port)
+        assert (
+            encode_handshake_start(uid, fast_path, host, port).body
+            == PeerMessage(type=PeerMessageType.HANDSHAKE_START, handshakeStart=start).SerializeToString()
+        )
+        response = HandshakeResponse(id=uid, error=error, fast_path=fast_path)
+        assert (
+            encode_handshake_response(uid, error, fast_path).body
+            == PeerMessage(
+                type=PeerMessageType.HANDSHAKE_RESPONSE, handshakeResponse=response
+            ).SerializeToString()
+        )
+
+        buckets = [rnd.getrandbits(64) for _ in range(rnd.choice((0, 1, 8, 256)))]
+        digest = Digest(fr=uid, buckets=buckets)
+        assert (
+            encode_digest(uid, buckets).body
+            == PeerMessage(type=PeerMessageType.DIGEST, digest=digest).SerializeToString()
+        )
+
+
+def test_encoded_messages_parse_back():
+    join = PeerMessage.FromString(encode_join(7, 3, "10.0.0.1", 4000, 2).body)
+    assert join.type == PeerMessageType.ANNOUNCEMENT
+    assert join.announcement.join == Join(id=7, via_id=3, host="10.0.0.1", port=4000, hops=2)
+    leave = PeerMessage.FromString(encode_leave(7, [8, 9]).body).announcement
+    assert leave.type == AnnouncementType.LEAVE
+    assert list(leave.leave.ids) == [8, 9]
@@ -0,0 +1,107 @@
+import queue
+import time
+
+from gen.proto.communication_pb2 import Message, PeerMessage, PeerMessageType
+from modules.lib.delivery import DeliveryStatus, DeliveryTracker
+
+SENDER, RECIPIENT = 1, 2
+
+
+class Link:
+    # A sender and a recipient tracker joined by a queue of serialized
+    # messages, which the test pumps. Lost messages are never queued
+    def __init__(self, lost=frozenset[int](), **kwargs):
+        self.lost = lost
+        self.frames = queue.Queue[bytes]()
+        self.sender = DeliveryTracker(self._route, **kwargs)
+        self.recipient = DeliveryTracker(lambda to, message: True)
+        # Short timeouts: failed messages are given up on within a second
+        self.sender.INITIAL_RTO = self.sender.MIN_RTO = 0.01
+        self.sender.MAX_RTO = 0.05
+        self.received = list[int]()
+        self.acks = 0
+
+    def _route(self, to: int, message: PeerMessage) -> bool:
+        if message.message.seq not in self.lost:
+            self.frames.put(message.message.SerializeToString())
+        return True
+
+    def send(self, count: int):
+        return [
+            self.sender.send(
+                PeerMessage(
+                    type=PeerMessageType.MESSAGE,
+                    message=Message(fr=SENDER, to=RECIPIENT, msg=f"message {i}"),
+                )
+            )
+            for i in range(count)
+        ]
+
+    def pump(self, deliveries, timeout: float = 10.0) -> None:
+        # Deliver the messages and send the acknowledgements back until every
+        # delivery has an outcome
+        deadline = time.monotonic() + timeout
+        while not all(d.done for d in deliveries) and time.monotonic() < deadline:
+            try:
+                data = self.frames.get(timeout=0.01)
+            except queue.Empty:
+                continue
+            msg = Message()
+            msg.ParseFromString(data)
+            fresh, ack = self.recipient.on_message(msg)
+            if fresh:
+                self.received.append(msg.seq)
+            self.sender.on_ack(ack)
+            self.acks += 1
+
+    def close(self) -> None:
+        self.sender.close()
+        self.recipient.close()
+
+
+def test_every_message_is_delivered_once():
+    link = Link()
+    deliveries = link.send(200)
+    link.pump(deliveries)
+    link.close()
+    assert all(d.status == DeliveryStatus.DELIVERED for d in deliveries)
+    assert sorted(link.received) == list(range(1, 201))
+
+
+def test_lost_message_does_not_hold_the_acknowledgements_back():
+    # The first message never arrives: it fails, every later one is delivered
+    link = Link(lost={1}, max_attempts=3)
+    deliveries = link.send(200)
+    link.pump(deliveries)
+    assert deliveries[0].status == DeliveryStatus.FAILED
+    assert all(d.status == DeliveryStatus.DELIVERED for d in deliveries[1:])
+    # The next message tells the recipient to stop waiting for the first one
+    last = link.send(1)
+    link.pump(last)
+    link.close()
+    assert last[0].status == DeliveryStatus.DELIVERED
+    received = link.recipient._received[SENDER]
+    assert received.cumulative == 201
+    assert not received.above
+
+
+def test_selective_acknowledgement_lists_the_latest_messages():
+    tracker = DeliveryTracker(lambda to, message: True)
+    for seq in range(2, 101):
+        _, ack = tracker.on_message(
+            Message(fr=SENDER, to=RECIPIENT, session=7, seq=seq, lowest_unacked=1)
+        )
+    assert ack.cumulative == 0
+    assert list(ack.selective) == list(range(101 - tracker.MAX_SELECTIVE, 101))
+
+
+def test_messages_below_the_lowest_unacknowledged_are_duplicates():
+    tracker = DeliveryTracker(lambda to, message: True)
+    fresh, ack = tracker.on_message(
+        Message(fr=SENDER, to=RECIPIENT, session=7, seq=5, lowest_unacked=5)
+    )
+    assert fresh and ack.cumulative == 5
+    # A message the sender gave up on, arriving late
+    fresh, _ = tracker.on_message(Message(fr=SENDER, to=RECIPIENT, session=7, seq=3))
+    assert not fresh
+    assert tracker.counters["duplicates"] == 1
@@ -0,0 +1,96 @@
+import os
+import time
+
+import pytest
+
+from gen.proto.communication_pb2 import Message
+from modules.lib.inbox import InboxStore
+
+
+class Clock:
+    # Stands for the time module: time only moves when the test says so
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def __getattr__(self, name: str):
+        # Formatting functions of the time module
+        return getattr(time, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("modules.lib.inbox.time", clock)
+    return clock
+
+
+def receive(store: InboxStore, clock: Clock, *messages: tuple[int, str]) -> None:
+    # One message per second, from the given senders
+    for fr, text in messages:
+        store.add(Message(fr=fr, to=1, msg=text))
+        clock.now += 1
+
+
+def texts(entries) -> list[str]:
+    return [msg.msg for _, msg in entries]
+
+
+def test_history_by_sender_and_time(clock):
+    store = InboxStore()
+    receive(store, clock, (2, "a"), (3, "b"), (2, "c"), (2, "d"))
+    assert texts(store.history(2)) == ["a", "c", "d"]
+    assert texts(store.history(2, limit=2)) == ["c", "d"]
+    # Received at 1002 and 1003
+    assert texts(store.history(2, since=1001.5)) == ["c", "d"]
+    assert store.history(404) == []
+
+
+def test_history_reads_the_log_past_the_capacity(clock, tmp_path):
+    store = InboxStore(capacity=2)
+    store.open(str(tmp_path / "inbox.log"))
+    receive(store, clock, (2, "a"), (3, "b"), (2, "c"), (2, "d"))
+    assert texts(store.recent()) == ["c", "d"]
+    assert texts(store.history(2)) == ["a", "c", "d"]
+    assert texts(store.history(2, limit=1)) == ["d"]
+    assert [at for at, _ in store.history(2, since=1001.5)] == [1002.0, 1003.0]
+    store.close()
+
+
+def test_the_log_is_indexed_again_when_opened(clock, tmp_path):
+    path = str(tmp_path / "inbox.log")
+    store = InboxStore()
+    store.open(path)
+    receive(store, clock, (2, "a"), (3, "b"), (2, "c"))
+    store.close()
+
+    store = InboxStore()
+    store.open(path)
+    assert store.recent() == []
+    assert texts(store.history(2)) == ["a", "c"]
+    assert texts(store.history(3)) == ["b"]
+    # Messages per sender
+    assert [line.split(" | ")[:2] for line in store.report()[1:]] == [["2", "2"], ["3", "1"]]
+    # Appends go after the records already there
+    receive(store, clock, (3, "d"))
+    assert texts(store.history(3)) == ["b", "d"]
+    store.close()
+
+
+def test_a_record_cut_short_is_dropped(clock, tmp_path):
+    path = str(tmp_path / "inbox.log")
+    store = InboxStore()
+    store.open(path)
+    receive(store, clock, (2, "a"), (2, "b"))
+    store.close()
+    # Crash while writing the last record
+    os.truncate(path, os.path.getsize(path) - 1)
+
+    store = InboxStore()
+    store.open(path)
+    assert texts(store.history(2)) == ["a"]
+    receive(store, clock, (2, "c"))
+    assert texts(store.history(2)) == ["a", "c"]
+    store.close()
@@ -0,0 +1,45 @@
+import socket
+import threading
+import time
+
+from gen.proto.communication_pb2 import Message
+from modules.lib.node import PeerNode
+from modules.lib.peer import Peer
+from modules.lib.transport import MemoryTransport
+from modules.model.workers import IPCClientWorker
+
+
+def connect(client: socket.socket, path: str) -> None:
+    # The gateway listens from its own thread, shortly after the node started
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            client.connect(path)
+            return
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def test_client_leaving_with_a_full_outbox_does_not_block_the_node(tmp_path, make_config):
+    path = str(tmp_path / "ipc.sock")
+    node = PeerNode(make_config(1, ipc=path), transport=MemoryTransport(), isolated=True)
+    node.start()
+    stopped = threading.Event()
+    try:
+        # A client that never reads: its socket fills up, then its outbox
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        connect(client, path)
+        while not node.state.listeners:
+            time.sleep(0.01)
+        with Peer.bound(node.state):
+            for i in range(2 * IPCClientWorker.MAX_PENDING):
+                Peer.deliver(Message(fr=2, to=1, msg=f"{i:01000}"))
+        client.close()
+    finally:
+        stopper = threading.Thread(target=lambda: (node.stop(), stopped.set()), daemon=True)
+        stopper.start()
+        stopper.join(timeout=10)
+    assert stopped.is_set()
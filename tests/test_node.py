@@ -0,0 +1,138 @@
+import queue
+import threading
+import time
+
+from modules.lib.node import PeerNode
+from modules.lib.peer import Peer
+from modules.lib.transport import MemoryTransport
+from modules.model.config import ServerAddress
+
+
+def neighbors(node: PeerNode) -> list[int]:
+    return [uid for uid, (conn, _) in node.state.routing_table if conn]
+
+
+def dial(node: PeerNode, port: int) -> None:
+    with Peer.bound(node.state):
+        node._connect(("test", port))
+
+
+def test_peers_dialing_each_other_keep_a_single_link(make_config):
+    for _ in range(40):
+        transport = MemoryTransport()
+        nodes = [PeerNode(make_config(uid), transport=transport, isolated=True) for uid in (1, 2)]
+        for node in nodes:
+            node.start()
+        try:
+            dials = [
+                threading.Thread(target=dial, args=(nodes[0], 2)),
+                threading.Thread(target=dial, args=(nodes[1], 1)),
+            ]
+            for thread in dials:
+                thread.start()
+            for thread in dials:
+                thread.join()
+            time.sleep(0.05)
+            # Both ends kept the same link, the one opened by peer 1
+            assert neighbors(nodes[0]) == [2]
+            assert neighbors(nodes[1]) == [1]
+            received = queue.Queue()
+            nodes[1].on_message(received.put)
+            assert nodes[0].send(2, "hello")
+            assert received.get(timeout=5).msg == "hello"
+        finally:
+            for node in nodes:
+                node.stop()
+
+
+def test_multicasts_reach_every_recipient_once(make_config):
+    # 1 -> (2 -> (4, 5), 3 -> 6): the copies split where the routes branch
+    parents = {2: 1, 3: 1, 4: 2, 5: 2, 6: 3}
+    transport = MemoryTransport()
+    nodes = {}
+    received = {uid: queue.Queue() for uid in range(1, 7)}
+    try:
+        for uid in range(1, 7):
+            peer = ServerAddress(ip="test", port=parents[uid]) if uid in parents else None
+            config = make_config(uid, peer=peer, repair_interval=0.1)
+            nodes[uid] = PeerNode(config, transport=transport, isolated=True)
+            nodes[uid].start()
+            nodes[uid].on_message(received[uid].put)
+        deadline = time.monotonic() + 10
+        while any(len(node.state.routing_table) < 5 for node in nodes.values()):
+            assert time.monotonic() < deadline, "the routing tables did not converge"
+            time.sleep(0.05)
+
+        # Sent over the single link of 4, split at 2, then at 1
+        assert nodes[4].send_multicast([1, 2, 3, 4, 5, 6, 5], "to all") == 1
+        with Peer.bound(nodes[5].state):
+            Peer.groups.add_members(8, [1, 4, 6])
+        assert nodes[5].send_group(8, "to the group") == 1
+        time.sleep(0.3)
+        copies = {}
+        for uid, inbox in received.items():
+            copies[uid] = sorted((msg.fr, msg.msg, msg.group) for msg in inbox.queue)
+        assert copies == {
+            1: [(4, "to all", 0), (5, "to the group", 8)],
+            2: [(4, "to all", 0)],
+            3: [(4, "to all", 0)],
+            4: [(5, "to the group", 8)],
+            5: [(4, "to all", 0)],
+            6: [(4, "to all", 0), (5, "to the group", 8)],
+        }
+    finally:
+        for node in nodes.values():
+            node.stop()
+
+
+def test_traced_messages_record_every_hop(make_config):
+    # 1 -> 2 -> 3, each write delayed by 20ms: the histograms of peer 3 hold
+    # the hops of the path and how long each of them took
+    transport = MemoryTransport(latency=0.02)
+    nodes = {}
+    received = queue.Queue()
+    try:
+        for uid in range(1, 4):
+            peer = ServerAddress(ip="test", port=uid - 1) if uid > 1 else None
+            rate = 1.0 if uid == 1 else 0.0
+            config = make_config(uid, peer=peer, repair_interval=0.1, trace_rate=rate)
+            nodes[uid] = PeerNode(config, transport=transport, isolated=True)
+            nodes[uid].start()
+        nodes[3].on_message(received.put)
+        deadline = time.monotonic() + 10
+        while 3 not in nodes[1].state.routing_table:
+            assert time.monotonic() < deadline, "the routing tables did not converge"
+            time.sleep(0.05)
+
+        for i in range(3):
+            assert nodes[1].send(3, f"traced {i}")
+        messages = [received.get(timeout=5) for _ in range(3)]
+        for msg in messages:
+            hops = msg.trace.hops
+            assert [hop.id for hop in hops] == [1, 2, 3]
+            assert hops[1].timestamp - hops[0].timestamp >= 20_000
+            assert hops[2].timestamp - hops[1].timestamp >= 20_000
+        assert len({msg.trace.trace_id for msg in messages}) == 3
+
+        tracer = nodes[3].state.tracer
+        assert set(tracer.hops) == {(1, 2), (2, 3)}
+        assert all(hist.count == 3 and hist.min >= 20_000 for hist in tracer.hops.values())
+        assert set(tracer.end_to_end) == {1}
+        assert tracer.end_to_end[1].count == 3
+        assert tracer.end_to_end[1].min >= 40_000
+        # Only the recipient aggregates
+        assert not nodes[1].state.tracer.hops and not nodes[2].state.tracer.hops
+
+        report = nodes[3].trace_report()
+        assert report[0] == "Sample rate: 0.0"
+        assert [line.split(":")[0] for line in report[1:]] == [
+            "End-to-end (by sender)",
+            "  1",
+            "Per hop",
+            "  1 -> 2",
+            "  2 -> 3",
+        ]
+        assert all(line.split(": ")[1].startswith("n=3 ") for line in report if ": n=" in line)
+    finally:
+        for node in nodes.values():
+            node.stop()
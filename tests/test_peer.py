@@ -0,0 +1,291 @@
+import socket
+
+import pytest
+
+from gen.proto.communication_pb2 import (
+    AnnouncementType,
+    HandshakeResponse,
+    HandshakeStart,
+    Leave,
+    Message,
+    Multicast,
+    PeerMessage,
+    PeerMessageType,
+    TraceContext,
+    Undeliverable,
+)
+from modules.lib.codec import encode_join
+from modules.lib.network import (
+    FLAG_TRACED,
+    decode_frame,
+    enable_fast_path,
+    encode,
+    receive,
+    receive_frame,
+    send,
+)
+from modules.lib.peer import Peer, PeerState
+
+
+@pytest.fixture
+def peer():
+    # Peer 1; link(uid) adds a neighbor and returns the neighbor's end of the
+    # link, both ends using the fast-path header unless told otherwise
+    pairs = list[tuple[socket.socket, socket.socket]]()
+
+    def link(uid: int, fast_path: bool = True) -> socket.socket:
+        pairs.append(socket.socketpair())
+        local, remote = pairs[-1]
+        if fast_path:
+            enable_fast_path(local)
+            enable_fast_path(remote)
+        Peer.routing_table.add_local_peer(uid, local)
+        return remote
+
+    with Peer.bound(PeerState()):
+        Peer.set_id(1)
+        yield link
+    for pair in pairs:
+        for conn in pair:
+            conn.close()
+
+
+def message(fr: int, to: int, text: str, hop_limit: int = 5, **fields) -> PeerMessage:
+    return PeerMessage(
+        type=PeerMessageType.MESSAGE,
+        message=Message(fr=fr, to=to, msg=text, hop_limit=hop_limit, **fields),
+    )
+
+
+def received(msg: PeerMessage, fast_path: bool = True):
+    # Frame of the message as the worker of a link reads it
+    return decode_frame(encode(msg, fast_path)[4:], fast_path)
+
+
+def test_leave_only_drops_the_routes_through_its_sender():
+    # Neighbors 2 and 3; 4 and its dependent 6 are reached through 2, 5
+    # through 3
+    links = {uid: socket.socketpair() for uid in (2, 3)}
+    with Peer.bound(PeerState()):
+        Peer.set_id(1)
+        table = Peer.routing_table
+        for uid, (conn, _) in links.items():
+            table.add_local_peer(uid, conn)
+        table.add_remote_peer(4, 2, 2)
+        table.add_remote_peer(5, 3, 2)
+        table.add_remote_peer(6, 4, 3)
+
+        removed = Peer.handle_leave(Leave(id=9, ids=[3, 4, 5]), sender=2)
+
+        assert sorted(removed) == [4, 6]
+        assert sorted(uid for uid, _ in table) == [2, 3, 5]
+        # The other neighbors learn about the peers that became unreachable
+        leave = receive(links[3][1]).announcement
+        assert leave.type == AnnouncementType.LEAVE
+        assert sorted((leave.leave.id, *leave.leave.ids)) == [4, 6]
+    for pair in links.values():
+        for conn in pair:
+            conn.close()
+
+
+def test_leave_from_an_unknown_sender_is_ignored():
+    with Peer.bound(PeerState()):
+        Peer.set_id(1)
+        Peer.routing_table.add_remote_peer(4, 2, 2)
+        assert Peer.handle_leave(Leave(id=4), sender=None) == []
+        assert 4 in Peer.routing_table
+
+
+def test_link_opened_by_the_smaller_id_is_kept():
+    first, second, third = (socket.socket() for _ in range(3))
+    with Peer.bound(PeerState()):
+        Peer.set_id(5)
+        assert Peer.link(3, first, outbound=False) == (True, None)
+        # Opened by 5: loses to the link opened by 3
+        assert Peer.link(3, second, outbound=True) == (False, None)
+        # Opened by 3 again: replaces the first one
+        assert Peer.link(3, third, outbound=False) == (True, first)
+        assert Peer.routing_table[3][0] is third
+        # Toward a larger ID, our own links win
+        assert Peer.link(7, first, outbound=False) == (True, None)
+        assert Peer.link(7, second, outbound=True) == (True, first)
+        assert Peer.link(7, third, outbound=False) == (False, None)
+    for conn in (first, second, third):
+        conn.close()
+
+
+def test_fast_path_frames_round_trip():
+    frame = received(message(2, 3, "hello", hop_limit=7))
+    header = (frame.type, frame.flags, frame.hops, frame.to, frame.fr)
+    assert header == (PeerMessageType.MESSAGE, 0, 7, 3, 2)
+    assert frame.message == message(2, 3, "hello", hop_limit=7)
+    traced = received(message(2, 3, "hello", trace=TraceContext(trace_id=9)))
+    assert traced.flags & FLAG_TRACED
+    # Messages encoded by the codec get a header too, never routed
+    join = decode_frame(encode(encode_join(4, 0, "test", 4), True)[4:], True)
+    assert (join.type, join.to, join.fr) == (PeerMessageType.ANNOUNCEMENT, 0, 0)
+    assert join.message.announcement.join.id == 4
+    # No header on the other links
+    plain = received(message(2, 3, "hello"), fast_path=False)
+    assert (plain.type, plain.hops, plain.to) == (None, None, None)
+    assert plain.origin == 2
+
+
+def test_handshake_with_a_peer_without_fast_path(peer):
+    local, remote = socket.socketpair()
+    try:
+        start = HandshakeStart(id=2)
+        send(remote, PeerMessage(type=PeerMessageType.HANDSHAKE_START, handshakeStart=start))
+        assert Peer.handle_handshake(local) == (2, True)
+        response = receive(remote).handshakeResponse
+        assert response.id == 1 and not response.fast_path
+        # Plain framing on both ends
+        send(local, message(1, 2, "hello"))
+        assert receive(remote).message.msg == "hello"
+
+        # Dialing it: the start offers the fast path, its response leaves it out
+        response = HandshakeResponse(id=2)
+        send(
+            remote,
+            PeerMessage(type=PeerMessageType.HANDSHAKE_RESPONSE, handshakeResponse=response),
+        )
+        assert Peer._send_handshake(local) == (2, True)
+        assert receive(remote).handshakeStart.fast_path
+        send(local, message(1, 2, "hello"))
+        assert receive(remote).message.msg == "hello"
+    finally:
+        local.close()
+        remote.close()
+
+
+def test_handshake_agrees_on_the_fast_path(peer):
+    local, remote = socket.socketpair()
+    try:
+        start = HandshakeStart(id=2, fast_path=True)
+        send(remote, PeerMessage(type=PeerMessageType.HANDSHAKE_START, handshakeStart=start))
+        assert Peer.handle_handshake(local) == (2, True)
+        assert receive(remote).handshakeResponse.fast_path
+        send(local, message(1, 2, "hello"))
+        enable_fast_path(remote)
+        frame = receive_frame(remote)
+        assert (frame.type, frame.to, frame.fr) == (PeerMessageType.MESSAGE, 2, 1)
+    finally:
+        local.close()
+        remote.close()
+
+
+def test_relays_forward_fast_path_frames_without_parsing_them(peer):
+    peer(2)
+    next_hop = peer(3)
+    Peer.routing_table.add_remote_peer(4, 3, 2)
+    frame = received(message(2, 4, "through"))
+    Peer.handle_frame(frame, 2)
+    assert frame._message is None
+    forwarded = receive_frame(next_hop)
+    # Only the header carries the new hop limit, the body is the sender's
+    assert (forwarded.hops, forwarded.to, forwarded.fr) == (4, 4, 2)
+    assert bytes(forwarded.body) == bytes(frame.body)
+    assert forwarded.message.message.hop_limit == 5
+
+
+def test_relays_parse_the_frames_they_cannot_forward_as_is(peer):
+    peer(2)
+    plain = peer(3, fast_path=False)
+    fast = peer(4)
+    # Toward a link without header: the hop limit goes in the body
+    Peer.handle_frame(received(message(2, 3, "plain")), 2)
+    assert receive(plain).message.hop_limit == 4
+    # Traced: the relay records its hop
+    frame = received(message(2, 4, "traced", trace=TraceContext(trace_id=9)))
+    Peer.handle_frame(frame, 2)
+    forwarded = receive_frame(fast)
+    assert forwarded.hops == 4
+    assert [hop.id for hop in forwarded.message.message.trace.hops] == [1]
+    # From a link without header: the header is built from the message
+    Peer.handle_frame(received(message(3, 4, "from plain"), fast_path=False), 3)
+    forwarded = receive_frame(fast)
+    assert (forwarded.hops, forwarded.to, forwarded.fr) == (4, 4, 3)
+    assert forwarded.message.message.msg == "from plain"
+
+
+@pytest.mark.parametrize("fast_path", [True, False])
+def test_messages_out_of_hops_are_dropped(peer, fast_path):
+    peer(2, fast_path)
+    next_hop = peer(3, fast_path)
+    # One link left: the one to this relay
+    Peer.handle_frame(received(message(2, 3, "too far", hop_limit=1), fast_path), 2)
+    assert Peer.counters["dropped_hop_limit"] == 1
+    next_hop.setblocking(False)
+    with pytest.raises(BlockingIOError):
+        next_hop.recv(1)
+
+
+def test_the_sender_of_a_dropped_message_is_notified(peer):
+    Peer.notify_drops = True
+    previous_hop = peer(2)
+    peer(3)
+    Peer.routing_table.add_remote_peer(5, 2, 2)
+    Peer.handle_frame(received(message(5, 3, "too far", hop_limit=1)), 2)
+    notice = receive_frame(previous_hop).message
+    assert notice.type == PeerMessageType.UNDELIVERABLE
+    assert notice.undeliverable == Undeliverable(fr=1, to=5, dest=3, hop_limit=Peer.max_hops)
+
+    # Relayed toward the sender like the messages, but never notified about
+    und = Undeliverable(fr=7, to=5, dest=3, hop_limit=2)
+    Peer.handle_message(PeerMessage(type=PeerMessageType.UNDELIVERABLE, undeliverable=und), 3)
+    assert receive_frame(previous_hop).message.undeliverable.hop_limit == 1
+    und.hop_limit = 1
+    Peer.handle_message(PeerMessage(type=PeerMessageType.UNDELIVERABLE, undeliverable=und), 3)
+    assert Peer.counters["dropped_hop_limit"] == 1
+
+    # At the sender
+    und.to = 1
+    Peer.handle_message(PeerMessage(type=PeerMessageType.UNDELIVERABLE, undeliverable=und), 2)
+    assert Peer.counters["undeliverable"] == 1
+
+
+@pytest.mark.parametrize("hop_limit, max_hops", [(8, 32), (0, 4)])
+def test_a_routing_loop_is_bounded(hop_limit, max_hops):
+    # Peers 1 and 2 both reach peer 9 through the other. Unset, the hop limit
+    # of the message is the one of the relays
+    ends = dict(zip((1, 2), socket.socketpair()))
+    states = {uid: PeerState() for uid in ends}
+    for uid, conn in ends.items():
+        conn.settimeout(5)
+        enable_fast_path(conn)
+        with Peer.bound(states[uid]):
+            Peer.set_id(uid)
+            Peer.max_hops = max_hops
+            Peer.routing_table.add_local_peer(3 - uid, conn)
+            Peer.routing_table.add_remote_peer(9, 3 - uid, 2)
+    try:
+        with Peer.bound(states[1]):
+            Peer.route_message(9, message(1, 9, "lost", hop_limit=hop_limit))
+        # Each peer hands the message back to the other until one drops it
+        received, uid = 0, 2
+        while True:
+            with Peer.bound(states[uid]):
+                Peer.handle_frame(receive_frame(ends[uid]), 3 - uid)
+            received += 1
+            if states[uid].counters["dropped_hop_limit"]:
+                break
+            uid = 3 - uid
+        assert received == (hop_limit or max_hops)
+    finally:
+        for conn in ends.values():
+            conn.close()
+
+
+def test_a_multicast_is_sent_once_per_link(peer):
+    # 4 and 5 are reached through 2, 6 through 3
+    links = {uid: peer(uid) for uid in (2, 3)}
+    Peer.routing_table.add_remote_peer(4, 2, 2)
+    Peer.routing_table.add_remote_peer(5, 2, 2)
+    Peer.routing_table.add_remote_peer(6, 3, 2)
+    delivered = []
+    Peer.listeners.append(delivered.append)
+    mc = Multicast(fr=7, to=[1, 4, 5, 6, 4], msg="hi", group=3, hop_limit=5)
+    assert Peer.route_multicast(PeerMessage(type=PeerMessageType.MULTICAST, multicast=mc)) == 2
+    assert [(msg.fr, msg.msg, msg.group) for msg in delivered] == [(7, "hi", 3)]
+    assert list(receive(links[2]).multicast.to) == [4, 5]
+    assert list(receive(links[3]).multicast.to) == [6]
@@ -0,0 +1,111 @@
+import queue
+import socket
+import time
+
+from gen.proto.communication_pb2 import KnownPeer, PeerCache, Route
+from modules.lib.node import PeerNode
+from modules.lib.peer import Peer, PeerState
+from modules.lib.persistence import StateFile, known_addresses, restore
+from modules.lib.transport import MemoryTransport
+from modules.model.config import ServerAddress
+from modules.model.factory import make_message
+
+
+def test_buffered_messages_are_sent_when_linking_back(tmp_path, make_config):
+    # Peer 1 restarts with a message buffered for peer 2, and links to it
+    state_file = tmp_path / "state"
+    cache = PeerCache(
+        id=1, peers=[KnownPeer(id=2, host="test", port=2)], routes=[Route(id=2)]
+    )
+    cache.buffered.add(to=2, messages=[make_message(1, 2, "while you were away")])
+    state_file.write_bytes(cache.SerializeToString())
+
+    transport = MemoryTransport()
+    recipient = PeerNode(make_config(2), transport=transport, isolated=True)
+    recipient.start()
+    received = queue.Queue()
+    recipient.on_message(received.put)
+    sender = PeerNode(make_config(1, state_file=str(state_file)), transport=transport, isolated=True)
+    try:
+        sender.start()
+        assert received.get(timeout=5).msg == "while you were away"
+        assert not sender.state.buffer
+    finally:
+        sender.stop()
+        recipient.stop()
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "state")
+    conn = socket.socket()
+    message = make_message(1, 4, "later")
+    try:
+        with Peer.bound(PeerState()):
+            Peer.set_id(1)
+            Peer.routing_table.add_local_peer(2, conn)
+            Peer.routing_table.add_remote_peer(3, 2, 2)
+            Peer.routing_table.add_remote_peer(4, 3, 3)
+            Peer.buffer[4] = [message]
+            Peer.buffer[5] = []
+            Peer.addresses[2] = ("test", 2)
+            state_file = StateFile(path)
+            assert state_file.save()
+            # Nothing changed since
+            assert not state_file.save()
+
+        cache = StateFile(path).load()
+        assert cache.id == 1 and cache.saved_at
+        assert known_addresses(cache) == [(2, ("test", 2))]
+        # Only the non-empty buffers are kept
+        assert [buffered.to for buffered in cache.buffered] == [4]
+
+        with Peer.bound(PeerState()):
+            Peer.set_id(1)
+            # The routes are restored once their neighbor is linked again
+            assert restore(cache) == 0
+            Peer.routing_table.add_local_peer(2, conn)
+            assert restore(cache) == 2
+            assert Peer.routing_table[3] == (None, 2) and Peer.routing_table.hops(3) == 2
+            assert Peer.routing_table[4] == (None, 3) and Peer.routing_table.hops(4) == 3
+            assert Peer.buffer[4][0].SerializeToString() == message.SerializeToString()
+            assert Peer.addresses == {2: ("test", 2)}
+    finally:
+        conn.close()
+
+
+def test_unreadable_state_files_are_ignored(tmp_path):
+    path = tmp_path / "state"
+    assert StateFile(str(path)).load() is None
+    path.write_bytes(b"\xff\xff\xff")
+    assert StateFile(str(path)).load() is None
+
+
+def test_restart_links_back_to_the_former_neighbors_only(tmp_path, make_config):
+    # Peer 1 only knows the others through the announcements of hub 2
+    state_file = str(tmp_path / "state")
+    transport = MemoryTransport()
+    hub = PeerNode(make_config(2), transport=transport, isolated=True)
+    hub.start()
+    seed = ServerAddress(ip="test", port=2)
+    others = [
+        PeerNode(make_config(uid, peer=seed), transport=transport, isolated=True)
+        for uid in range(3, 9)
+    ]
+    config = make_config(1, peer=seed, state_file=state_file)
+    node = PeerNode(config, transport=transport, isolated=True)
+    try:
+        node.start()
+        for other in others:
+            other.start()
+        deadline = time.monotonic() + 5
+        while len(node.state.addresses) < 7 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(node.state.addresses) == 7
+        node.stop()
+
+        node = PeerNode(make_config(1, state_file=state_file), transport=transport, isolated=True)
+        node.start()
+        assert [uid for uid, (conn, _) in node.state.routing_table if conn] == [2]
+    finally:
+        for peer in (node, hub, *others):
+            peer.stop()
@@ -0,0 +1,104 @@
+import pstats
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from modules.lib.commands import run_command
+from modules.lib.profiler import Profiler
+
+
+def spin(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def nap(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+def functions(path: str) -> set[str]:
+    return {name for _, _, name in pstats.Stats(path).stats}
+
+
+@pytest.fixture
+def worker():
+    # A single thread: the profile it enables stays with it between the calls
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ProfiledWorker") as executor:
+        yield executor
+
+
+def hand_back(profiler: Profiler) -> None:
+    # What a worker does on its next iteration once profiling stops
+    while profiler.active:
+        time.sleep(0.01)
+    profiler.checkpoint()
+
+
+def test_an_idle_worker_profiles_as_soon_as_started(tmp_path):
+    profiler = Profiler()
+    stopped = threading.Event()
+
+    def work():
+        # Waits on the event alone, as a worker with no traffic
+        profiler.started.wait()
+        while not stopped.is_set():
+            profiler.checkpoint()
+            spin(0.01)
+        profiler.checkpoint()
+
+    thread = threading.Thread(target=work, name="IdleWorker")
+    thread.start()
+    assert profiler.start() == ["Profiler started (sampling every 5ms)"]
+    assert profiler.active
+    assert profiler.start() == ["Profiler is already running"]
+    time.sleep(0.2)
+    stopped.set()
+    path = str(tmp_path / "profile.prof")
+    lines = profiler.stop(path)
+    thread.join()
+
+    assert not profiler.active and not profiler.started.is_set()
+    assert f"cProfile data of 1 threads written to {path}" in lines
+    assert "spin" in functions(path)
+    with open(f"{path}.stacks", encoding="utf-8") as f:
+        stacks = f.read().splitlines()
+    assert any(line.startswith("IdleWorker;") and "spin (" in line for line in stacks)
+    cpu = lines[lines.index("CPU time per thread:") + 1 :]
+    assert any(line.startswith("  MainThread: ") for line in cpu)
+    assert profiler.stop(path) == ["Profiler is not running"]
+
+
+def test_a_profile_left_from_an_earlier_session_is_dropped(tmp_path, worker, monkeypatch):
+    monkeypatch.setattr(Profiler, "COLLECT_TIMEOUT", 0.1)
+    profiler = Profiler()
+    path = str(tmp_path / "profile.prof")
+
+    # The worker started profiling but stayed busy until the end of the session
+    profiler.start()
+    worker.submit(profiler.checkpoint).result()
+    worker.submit(nap, 0.05).result()
+    assert "No worker thread was profiled" in profiler.stop(path)
+
+    # Its next checkpoint drops that profile and records the new session only
+    profiler.start()
+    worker.submit(profiler.checkpoint).result()
+    worker.submit(spin, 0.05).result()
+    handed_back = worker.submit(hand_back, profiler)
+    lines = profiler.stop(path)
+    handed_back.result()
+    assert f"cProfile data of 1 threads written to {path}" in lines
+    assert "spin" in functions(path)
+    assert "nap" not in functions(path)
+
+
+def test_profile_commands():
+    assert run_command("profile") == [
+        "The format should be 'profile start [interval_ms]' or 'profile stop [file]'."
+    ]
+    assert run_command("profile start fast") == [
+        "Invalid sampling interval. Should be a number of milliseconds."
+    ]
+    assert run_command("profile stop") == ["[Profiler]", "Profiler is not running"]
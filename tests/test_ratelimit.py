@@ -0,0 +1,89 @@
+import pytest
+
+import modules.lib.args as args
+from modules.lib.ratelimit import RateLimiter, ThrottlePolicy
+from modules.model.errors import ValidationError
+
+
+class Clock:
+    # Stands for the time module: time only moves when the test says so
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("modules.lib.ratelimit.time", clock)
+    return clock
+
+
+def test_burst_then_drop(clock):
+    limiter = RateLimiter(neighbor_rate=10, burst=5)
+    assert [limiter.acquire(1, None) for _ in range(6)] == [0, 0, 0, 0, 0, None]
+    assert limiter.dropped["neighbor", 1] == 1
+    # Other neighbors have their own bucket
+    assert limiter.acquire(2, None) == 0
+    # One token every 100ms
+    clock.now += 0.1
+    assert limiter.acquire(1, None) == 0
+    assert limiter.acquire(1, None) is None
+
+
+def test_burst_defaults_to_one_second_of_traffic(clock):
+    limiter = RateLimiter(neighbor_rate=3)
+    assert [limiter.acquire(1, None) for _ in range(4)] == [0, 0, 0, None]
+
+
+def test_delay_waits_for_the_tokens_already_promised(clock):
+    limiter = RateLimiter(neighbor_rate=10, burst=1, policy=ThrottlePolicy.DELAY)
+    waits = [limiter.acquire(1, None) for _ in range(3)]
+    assert waits == pytest.approx([0, 0.1, 0.2])
+    assert limiter.delayed["neighbor", 1] == 2
+    # Longer than MAX_DELAY: dropped anyway
+    for _ in range(8):
+        limiter.acquire(1, None)
+    assert limiter.acquire(1, None) is None
+    assert limiter.dropped["neighbor", 1] == 1
+
+
+def test_both_buckets_must_have_a_token(clock):
+    limiter = RateLimiter(neighbor_rate=100, origin_rate=1, burst=1)
+    assert limiter.acquire(1, 7) == 0
+    # Peer 7 is over its limit through any neighbor; only its bucket is charged
+    assert limiter.acquire(2, 7) is None
+    assert limiter.dropped == {("origin", 7): 1}
+    # Frames without a sender are only limited per neighbor
+    assert limiter.acquire(2, None) == 0
+
+
+def test_least_recently_used_origins_are_forgotten(clock):
+    limiter = RateLimiter(origin_rate=1, burst=1)
+    limiter.MAX_ORIGINS = 2
+    for origin in (1, 2, 3):
+        assert limiter.acquire(9, origin) == 0
+    # The bucket of 1 was forgotten: full again
+    assert limiter.acquire(9, 1) == 0
+    assert limiter.acquire(9, 3) is None
+
+
+@pytest.mark.parametrize(
+    "options, valid",
+    [
+        (["--rate-limit", "10", "--rate-burst", "0.5"], False),
+        (["--origin-rate-limit", "10", "--rate-burst", "0.5"], False),
+        (["--rate-limit", "10", "--rate-burst", "1"], True),
+        (["--rate-limit", "10"], True),
+        (["--rate-burst", "0.5"], True),
+        (["--rate-limit", "-1"], False),
+    ],
+)
+def test_rate_options_are_validated(options, valid):
+    if valid:
+        args.parse(["127.0.0.1:5000", *options])
+    else:
+        with pytest.raises(ValidationError):
+            args.parse(["127.0.0.1:5000", *options])
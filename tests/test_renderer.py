@@ -0,0 +1,50 @@
+import io
+
+from gen.proto.communication_pb2 import Message
+from modules.lib.renderer import ConsoleRenderer
+
+
+class Stream(io.StringIO):
+    # Records every write
+    def __init__(self):
+        super().__init__()
+        self.writes = list[str]()
+
+    def write(self, text: str) -> int:
+        self.writes.append(text)
+        return super().write(text)
+
+
+def test_messages_queued_meanwhile_are_written_at_once():
+    stream = Stream()
+    renderer = ConsoleRenderer(stream=stream)
+    for i in range(3):
+        renderer.show(Message(fr=2, msg=f"m{i}"))
+    renderer.start()
+    renderer.stop()
+    assert stream.writes == ["[Peer 2]: m0\n[Peer 2]: m1\n[Peer 2]: m2\n"]
+
+
+def test_stops_at_the_sentinel_inside_a_batch():
+    stream = Stream()
+    renderer = ConsoleRenderer(stream=stream)
+    renderer.show(Message(fr=2, msg="before"))
+    renderer._queue.put(None)
+    renderer.show(Message(fr=2, msg="after"))
+    renderer.start()
+    renderer._thread.join(timeout=5)
+    assert not renderer._thread.is_alive()
+    assert stream.getvalue() == "[Peer 2]: before\n"
+
+
+def test_messages_are_dropped_when_the_console_falls_behind(monkeypatch):
+    monkeypatch.setattr(ConsoleRenderer, "MAX_PENDING", 2)
+    stream = Stream()
+    renderer = ConsoleRenderer(stream=stream)
+    for i in range(3):
+        renderer.show(Message(fr=2, group=7, msg=f"m{i}"))
+    assert renderer.dropped == 1
+    renderer.start()
+    renderer._queue.put(None)
+    renderer._thread.join(timeout=5)
+    assert stream.getvalue() == "[Peer 2 @ 7]: m0\n[Peer 2 @ 7]: m1\n"
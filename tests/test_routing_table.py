@@ -0,0 +1,127 @@
+import random
+import socket
+
+import pytest
+
+from modules.model.routing_table import CompactRoutingTable, RoutingTable
+
+TABLES = [RoutingTable, CompactRoutingTable]
+
+
+@pytest.fixture
+def conn():
+    conn = socket.socket()
+    yield conn
+    conn.close()
+
+
+def entries(table) -> dict:
+    return {uid: (via, table.hops(uid)) for uid, (_, via) in table}
+
+
+@pytest.mark.parametrize("cls", TABLES)
+def test_offer_route_keeps_the_shortest_route(cls, conn):
+    table = cls.detached()
+    table.add_local_peer(2, conn)
+    table.add_local_peer(3, conn)
+    # New peer
+    assert table.offer_route(9, 2, 4)
+    # Longer, same length, or of unknown length through another neighbor
+    assert not table.offer_route(9, 3, 5)
+    assert not table.offer_route(9, 3, 4)
+    assert not table.offer_route(9, 3, 0)
+    assert entries(table)[9] == (2, 4)
+    # Shorter through another neighbor
+    assert table.offer_route(9, 3, 2)
+    assert entries(table)[9] == (3, 2)
+    # The neighbor the route goes through reports a new distance
+    assert not table.offer_route(9, 3, 6)
+    assert entries(table)[9] == (3, 6)
+    assert table.dependents(3) == [9] and table.dependents(2) == []
+    # Local peers are kept
+    assert not table.offer_route(2, 3, 1)
+    assert table[2] == (conn, None)
+
+
+@pytest.mark.parametrize("cls", TABLES)
+def test_routes_of_unknown_length_are_replaced_by_known_ones(cls, conn):
+    table = cls.detached()
+    table.add_local_peer(2, conn)
+    table.add_local_peer(3, conn)
+    assert table.offer_route(9, 2)
+    assert table.offer_route(9, 3, 7)
+    assert entries(table)[9] == (3, 7)
+
+
+@pytest.mark.parametrize("cls", TABLES)
+def test_hops_are_capped(cls, conn):
+    table = cls.detached()
+    table.add_local_peer(2, conn)
+    table.add_remote_peer(9, 2, 1000)
+    assert table.hops(9) == table.MAX_HOPS
+    assert table.hops(2) == 1
+    assert table.hops(404) == 0
+
+
+@pytest.mark.parametrize("cls", TABLES)
+def test_remove_with_dependents_follows_the_via_chains(cls, conn):
+    table = cls.detached()
+    table.add_local_peer(2, conn)
+    table.add_local_peer(3, conn)
+    table.add_remote_peer(4, 2, 2)
+    table.add_remote_peer(5, 4, 3)
+    table.add_remote_peer(6, 5, 4)
+    table.add_remote_peer(7, 3, 2)
+    assert sorted(table.remove_with_dependents(2)) == [2, 4, 5, 6]
+    assert sorted(entries(table)) == [3, 7]
+    assert table.dependents(2) == [] and table.dependents(4) == []
+    assert table.dependents(3) == [7]
+    assert table.remove_with_dependents(404) == []
+    # The removed IDs can be added again
+    table.add_remote_peer(4, 3, 2)
+    assert sorted(table.dependents(3)) == [4, 7]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_compact_table_matches_the_dict_table(seed, conn):
+    # Same operations on both backends, including removals scattered enough
+    # for the compact table to copy its columns (see MAX_SHIFTS)
+    rnd = random.Random(seed)
+    tables = [cls.detached() for cls in TABLES]
+    neighbors = rnd.sample(range(1, 1 << 40), 4)
+    ids = rnd.sample(range(1, 1 << 40), 300)
+    for table in tables:
+        for uid in neighbors:
+            table.add_local_peer(uid, conn)
+    for _ in range(1000):
+        uid, action = rnd.choice(ids), rnd.random()
+        via = rnd.choice(neighbors + ids[:20])
+        hops = rnd.randrange(8)
+        if action < 0.6:
+            results = [table.offer_route(uid, via, hops) for table in tables]
+        elif action < 0.97:
+            results = [sorted(table.remove_with_dependents(uid)) for table in tables]
+        else:
+            # A neighbor leaves, then links back
+            uid = rnd.choice(neighbors)
+            results = [sorted(table.remove_with_dependents(uid)) for table in tables]
+            for table in tables:
+                table.add_local_peer(uid, conn)
+        assert results[0] == results[1]
+    expected, actual = (entries(table) for table in tables)
+    assert actual == expected
+    for via in neighbors + ids:
+        assert sorted(tables[1].dependents(via)) == sorted(tables[0].dependents(via))
+
+
+def test_compact_table_removes_scattered_entries(conn):
+    table = CompactRoutingTable.detached()
+    table.add_local_peer(1, conn)
+    table.add_local_peer(2, conn)
+    # Every other ID goes through 1: one run per removed entry
+    for uid in range(10, 10 + 4 * table.MAX_SHIFTS):
+        table.add_remote_peer(uid, 1 if uid % 2 else 2, 2)
+    removed = table.remove_with_dependents(1)
+    assert sorted(removed) == [1, *range(11, 10 + 4 * table.MAX_SHIFTS, 2)]
+    assert [uid for uid, _ in table] == [2, *range(10, 10 + 4 * table.MAX_SHIFTS, 2)]
+    assert all(table.hops(uid) == 2 and table[uid] == (None, 2) for uid, _ in table if uid != 2)
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import peer
+from modules.lib.peer import Peer, PeerState
+
+
+@pytest.fixture
+def pipe():
+    read, write = os.pipe()
+    yield read, write
+    for fd in (read, write):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def test_lines_split_across_chunks(pipe, monkeypatch):
+    # Three bytes per read: every line spans several chunks, the "é" as well
+    monkeypatch.setattr(peer, "SCRIPT_CHUNK_SIZE", 3)
+    read, write = pipe
+    os.write(write, "2 hello\n3 café\n\n4 last".encode("utf-8"))
+    os.close(write)
+    assert list(peer._script_lines(read)) == [
+        ("2 hello", True),
+        ("3 café", True),
+        ("", True),
+        ("4 last", False),
+    ]
+
+
+def test_more_input_at_hand(pipe):
+    read, write = pipe
+    lines = peer._script_lines(read)
+    os.write(write, b"2 a\n2 b\n")
+    assert next(lines) == ("2 a", True)
+    # Nothing else written yet: the producer is slower than the reader
+    assert next(lines) == ("2 b", False)
+    # The end of a line comes with the next write
+    os.write(write, b"2 c\n2 spl")
+    assert next(lines) == ("2 c", False)
+    os.write(write, b"it\n")
+    assert next(lines) == ("2 split", False)
+    os.close(write)
+    assert next(lines, None) is None
+
+
+class Node:
+    # Records the batches sent by the script
+    def __init__(self):
+        self.batches = list[list[tuple[int, str]]]()
+
+    def send_many(self, messages: list[tuple[int, str]]) -> None:
+        self.batches.append(list(messages))
+
+
+def test_scripted_messages_are_sent_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(peer, "SCRIPT_BATCH_SIZE", 2)
+    path = tmp_path / "script.txt"
+    # Full batches, a command flushing a partial one, then the end of the script
+    path.write_text("2 a\n3 b\n2 c\n\n3 d\nend\n2 never\n", encoding="utf-8")
+    node = Node()
+    with Peer.bound(PeerState()):
+        Peer.set_id(1)
+        peer.run_script(node, str(path))
+    assert node.batches == [[(2, "a"), (3, "b")], [(2, "c")], [(3, "d")]]
@@ -0,0 +1,103 @@
+import random
+import socket
+from collections import Counter
+
+import pytest
+
+from gen.proto.communication_pb2 import Leave
+from modules.lib.peer import Peer, PeerState
+from modules.lib.topology import TopologyManager
+
+
+@pytest.fixture
+def peer():
+    # Peer 1, with the given neighbors and remote routes
+    pairs = list[tuple[socket.socket, socket.socket]]()
+
+    def link(uid: int) -> socket.socket:
+        pairs.append(socket.socketpair())
+        Peer.routing_table.add_local_peer(uid, pairs[-1][0])
+        Peer.addresses[uid] = ("test", uid)
+        return pairs[-1][1]
+
+    with Peer.bound(PeerState()):
+        Peer.set_id(1)
+        yield link
+    for pair in pairs:
+        for conn in pair:
+            conn.close()
+
+
+def test_distant_peers_are_tried_first_more_often(peer):
+    peer(2)
+    for uid, hops in ((3, 2), (4, 8), (5, 0)):
+        Peer.routing_table.add_remote_peer(uid, 2, hops)
+        Peer.addresses[uid] = ("test", uid)
+    # Known address, no route
+    Peer.addresses[6] = ("test", 6)
+    manager = TopologyManager(2, lambda addr: True)
+    random.seed(0)
+    firsts = Counter(manager.candidates()[0] for _ in range(1000))
+    assert sorted(firsts) == [3, 4, 5, 6]
+    assert firsts[4] > firsts[3] > max(firsts[5], firsts[6])
+
+
+def test_unreachable_peers_are_left_aside(peer):
+    peer(2)
+    Peer.routing_table.add_remote_peer(3, 2, 2)
+    Peer.addresses[3] = ("test", 3)
+    # Known address, no route: a former neighbor gone meanwhile
+    Peer.addresses[4] = ("test", 4)
+    manager = TopologyManager(2, lambda addr: False)
+    assert manager.rebalance() is None
+    assert Peer.counters["topology_failures"] == 2
+    assert manager.candidates() == []
+    assert 4 not in Peer.addresses
+    manager._round += manager.BACKOFF
+    assert manager.candidates() == [3]
+
+
+def test_links_to_a_known_peer_below_the_target(peer):
+    peer(2)
+    Peer.routing_table.add_remote_peer(3, 2, 2)
+    Peer.addresses[3] = ("test", 3)
+    dialed = []
+    manager = TopologyManager(2, lambda addr: dialed.append(addr) or True)
+    assert manager.rebalance() == 3
+    assert dialed == [("test", 3)]
+    assert Peer.counters["topology_links"] == 1
+
+
+def test_nothing_changes_between_the_target_and_twice_the_target(peer):
+    for uid in (2, 3, 4):
+        peer(uid)
+    manager = TopologyManager(2, lambda addr: pytest.fail("no link expected"))
+    assert manager.rebalance() is None
+
+
+def test_sheds_the_link_carrying_the_fewest_routes(peer):
+    remotes = {uid: peer(uid) for uid in (2, 3, 4)}
+    for uid, via in ((5, 2), (6, 2), (7, 4)):
+        Peer.routing_table.add_remote_peer(uid, via, 2)
+    manager = TopologyManager(1, lambda addr: pytest.fail("no link expected"))
+    assert manager.rebalance() == 3
+    # The neighbor reads the end of the stream
+    remotes[3].settimeout(1)
+    assert remotes[3].recv(1) == b""
+    assert Peer.counters["topology_shed"] == 1
+    assert 3 not in manager.candidates()
+    # Not dropped yet (no worker reads it): not closed a second time
+    assert manager.rebalance() is None
+    assert Peer.counters["topology_shed"] == 1
+
+
+def test_addresses_of_the_peers_that_left_are_forgotten(peer):
+    peer(2)
+    for uid in (3, 4):
+        Peer.routing_table.add_remote_peer(uid, 2, 2)
+        Peer.addresses[uid] = ("test", uid)
+    Peer.handle_leave(Leave(id=3), sender=2)
+    assert sorted(Peer.addresses) == [2, 4]
+    # Lost along with the link: still known, to link to them again
+    Peer.drop_link(2)
+    assert sorted(Peer.addresses) == [2, 4]